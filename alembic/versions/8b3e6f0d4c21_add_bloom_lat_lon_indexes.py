@@ -0,0 +1,40 @@
+"""add bloom lat lon indexes
+
+Revision ID: 8b3e6f0d4c21
+Revises: 5f1d7c2b9a43
+Create Date: 2026-10-18 15:02:11.730519
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = "8b3e6f0d4c21"
+down_revision: Union[str, None] = "5f1d7c2b9a43"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # nearest neighbour lookups search a bounding box around a point across
+    # every map, the existing indexes lead with map_id and cannot serve them
+    op.create_index(
+        "ix_bloom_observations_lat_lon",
+        "bloom_observations",
+        ["latitude", "longitude"],
+        unique=False,
+    )
+    op.create_index(
+        "ix_bloom_predictions_lat_lon",
+        "bloom_predictions",
+        ["latitude", "longitude"],
+        unique=False,
+    )
+
+
+def downgrade() -> None:
+    op.drop_index("ix_bloom_predictions_lat_lon", table_name="bloom_predictions")
+    op.drop_index("ix_bloom_observations_lat_lon", table_name="bloom_observations")
@@ -0,0 +1,45 @@
+"""bloom location gist indexes
+
+Revision ID: a7c3e9f15b02
+Revises: 3d2f8c6a1e57
+Create Date: 2026-10-18 21:12:40.284913
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = "a7c3e9f15b02"
+down_revision: Union[str, None] = "3d2f8c6a1e57"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# BLOOM_LOCATION_SQL of src/database/models.py at this revision
+LOCATION_SQL = "point(longitude * cos(radians(latitude)), latitude)"
+
+
+def upgrade() -> None:
+    # a (latitude, longitude) B-tree only narrows the first column, the
+    # nearest neighbour lookups use a GiST index on a point instead
+    for table in ("bloom_observations", "bloom_predictions"):
+        op.execute(
+            f"""
+            ALTER TABLE {table}
+            ADD COLUMN location point
+            GENERATED ALWAYS AS ({LOCATION_SQL}) STORED
+            """
+        )
+        op.execute(f"CREATE INDEX ix_{table}_location ON {table} USING gist (location)")
+        op.drop_index(f"ix_{table}_lat_lon", table_name=table)
+
+
+def downgrade() -> None:
+    for table in ("bloom_observations", "bloom_predictions"):
+        op.create_index(
+            f"ix_{table}_lat_lon", table, ["latitude", "longitude"], unique=False
+        )
+        op.drop_index(f"ix_{table}_location", table_name=table)
+        op.drop_column(table, "location")
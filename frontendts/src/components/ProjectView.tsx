@@ -323,6 +323,13 @@ export default function ProjectView() {
           if (action.status === 'active') {
             // Add to active actions
             setActiveActions((prev) => [...prev, action]);
+          } else if (action.status === 'streaming') {
+            // Streamed completions resend the same action with the text so far
+            setActiveActions((prev) =>
+              prev.some((a) => a.action_id === action.action_id)
+                ? prev.map((a) => (a.action_id === action.action_id ? action : a))
+                : [...prev, action],
+            );
           } else if (action.status === 'completed') {
             // Remove from active actions
             setActiveActions((prev) => prev.filter((a) => a.action_id !== action.action_id));
@@ -512,6 +512,14 @@ export default function VersionVisualization({
                   </div>
                 </div>
               </div>
+              {/* Partial assistant response while it streams in */}
+              {activeActions
+                .filter((action) => action.status === 'streaming' && action.content)
+                .map((action) => (
+                  <div key={action.action_id} className="mt-2 text-sm text-gray-300 whitespace-pre-wrap">
+                    {action.content}
+                  </div>
+                ))}
             </div>
           )}
         </div>
@@ -93,11 +93,12 @@ export interface EphemeralAction {
   action: string;
   timestamp: string;
   completed_at: string | null;
-  status: 'active' | 'completed' | 'zoom_action' | 'error';
+  status: 'active' | 'completed' | 'zoom_action' | 'error' | 'streaming';
   updates: EphemeralUpdates;
   bounds?: [number, number, number, number];
   description?: string;
   error_message?: string;
+  content?: string | null;
 }
 
 /* tree */
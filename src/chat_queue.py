@@ -0,0 +1,272 @@
+# Copyright (C) 2025 Bunting Labs, Inc.
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import asyncio
+import os
+import statistics
+import time
+import uuid
+from contextlib import asynccontextmanager
+from functools import lru_cache
+from typing import AsyncIterator, Optional
+
+from fastapi import HTTPException, status
+from pydantic import BaseModel
+
+from src.dependencies.redis_pool import get_redis
+
+CHAT_QUEUE_KEY = "chat_runs:queue"
+PROCESSING_KEY_PREFIX = "chat_runs:processing:"
+WORKER_KEY_PREFIX = "chat_runs:worker:"
+USER_RUNS_KEY_PREFIX = "chat_runs:user:"
+LLM_LATENCY_KEY = "chat_runs:llm_latency"
+LLM_LATENCY_SAMPLES = 20
+
+# a running chat holds its conversation lock and user slot through a lease
+# that is renewed while it runs, so a crashed process frees them quickly
+LEASE_SECONDS = 60
+WORKER_HEARTBEAT_SECONDS = 30
+
+# delete the lock only if it still belongs to this run
+_RELEASE_LOCK_SCRIPT = """
+if redis.call("GET", KEYS[1]) == ARGV[1] then
+    return redis.call("DEL", KEYS[1])
+end
+return 0
+"""
+# (re)take the lock for this run unless another run holds it
+_HOLD_LOCK_SCRIPT = """
+local owner = redis.call("GET", KEYS[1])
+if owner == false or owner == ARGV[1] then
+    redis.call("SET", KEYS[1], ARGV[1], "EX", ARGV[2])
+    return 1
+end
+return 0
+"""
+
+
+def chat_lock_key(conversation_id: int) -> str:
+    return f"chat_lock:{conversation_id}"
+
+
+def chat_execution_mode() -> str:
+    # "inline" runs chats as background tasks of the web process that received
+    # the message, "queue" hands them to `python -m src.chat_worker` processes
+    return os.environ.get("MUNDI_CHAT_EXECUTION", "inline")
+
+
+class ChatRun(BaseModel):
+    run_id: str
+    map_id: str
+    conversation_id: int
+    user_id: str
+    enqueued_at: float
+
+    @classmethod
+    def new(cls, map_id: str, conversation_id: int, user_id: str) -> "ChatRun":
+        return cls(
+            run_id=str(uuid.uuid4()),
+            map_id=map_id,
+            conversation_id=conversation_id,
+            user_id=user_id,
+            enqueued_at=time.time(),
+        )
+
+
+class ChatRunQueue:
+    """Admission control and a reliable Redis queue for chat runs.
+
+    Admission enforces at most one active run per conversation, a cap on
+    active runs per user and, when chats are queued, a cap on queue depth that
+    shrinks while the model provider is responding slowly. Claimed runs are
+    moved atomically to a per-worker processing list, so runs held by a worker
+    that died can be found and released by the surviving workers.
+    """
+
+    def __init__(
+        self,
+        max_runs_per_user: int,
+        max_queue_depth: int,
+        slow_provider_seconds: float,
+        queue_wait_seconds: int,
+    ):
+        self.max_runs_per_user = max_runs_per_user
+        self.max_queue_depth = max_queue_depth
+        self.slow_provider_seconds = slow_provider_seconds
+        # how long a queued run may wait for a worker before its conversation
+        # lock and user slot expire
+        self.queue_wait_seconds = queue_wait_seconds
+
+    async def llm_latency(self) -> Optional[float]:
+        samples = await get_redis().lrange(LLM_LATENCY_KEY, 0, -1)
+        if not samples:
+            return None
+        return statistics.median(float(s) for s in samples)
+
+    async def record_llm_latency(self, seconds: float):
+        async with get_redis().pipeline(transaction=False) as pipe:
+            pipe.lpush(LLM_LATENCY_KEY, f"{seconds:.3f}")
+            pipe.ltrim(LLM_LATENCY_KEY, 0, LLM_LATENCY_SAMPLES - 1)
+            pipe.expire(LLM_LATENCY_KEY, 3600)
+            await pipe.execute()
+
+    async def queue_depth_limit(self) -> int:
+        latency = await self.llm_latency()
+        if latency is not None and latency > self.slow_provider_seconds:
+            # every queued run will wait on the slow provider, stop accepting
+            # work that would sit in the queue for minutes
+            return max(1, self.max_queue_depth // 4)
+        return self.max_queue_depth
+
+    async def admit(self, run: ChatRun, queued: bool):
+        """Take the conversation lock and a user slot for the run, or raise."""
+        redis = get_redis()
+        ttl = self.queue_wait_seconds if queued else LEASE_SECONDS
+
+        if not await redis.set(
+            chat_lock_key(run.conversation_id), run.run_id, ex=ttl, nx=True
+        ):
+            raise HTTPException(
+                status_code=status.HTTP_409_CONFLICT,
+                detail="Conversation is currently being processed by another request",
+            )
+
+        user_key = USER_RUNS_KEY_PREFIX + run.user_id
+        now = time.time()
+        async with redis.pipeline(transaction=True) as pipe:
+            pipe.zremrangebyscore(user_key, "-inf", now)
+            pipe.zadd(user_key, {run.run_id: now + ttl})
+            pipe.zcard(user_key)
+            # slots expire by score, the key TTL only cleans up idle users
+            pipe.expire(user_key, self.queue_wait_seconds)
+            _, _, active_runs, _ = await pipe.execute()
+        if active_runs > self.max_runs_per_user:
+            await self.release(run)
+            raise HTTPException(
+                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                detail=f"At most {self.max_runs_per_user} conversations can be processed at once, please wait for one to finish",
+                headers={"Retry-After": "10"},
+            )
+
+        if queued and await redis.llen(CHAT_QUEUE_KEY) >= (
+            await self.queue_depth_limit()
+        ):
+            await self.release(run)
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Kue is busy right now, please try again in a minute",
+                headers={"Retry-After": "30"},
+            )
+
+    async def release(self, run: ChatRun):
+        redis = get_redis()
+        await redis.zrem(USER_RUNS_KEY_PREFIX + run.user_id, run.run_id)
+        await redis.eval(
+            _RELEASE_LOCK_SCRIPT, 1, chat_lock_key(run.conversation_id), run.run_id
+        )
+
+    async def renew(self, run: ChatRun, ttl: int = LEASE_SECONDS) -> bool:
+        """Extends the run's lock and user slot, False if another run took the lock."""
+        redis = get_redis()
+        user_key = USER_RUNS_KEY_PREFIX + run.user_id
+        async with redis.pipeline(transaction=False) as pipe:
+            pipe.zadd(user_key, {run.run_id: time.time() + ttl})
+            pipe.expire(user_key, self.queue_wait_seconds)
+            await pipe.execute()
+        return bool(
+            await redis.eval(
+                _HOLD_LOCK_SCRIPT,
+                1,
+                chat_lock_key(run.conversation_id),
+                run.run_id,
+                ttl,
+            )
+        )
+
+    @asynccontextmanager
+    async def lease(self, run: ChatRun) -> AsyncIterator[None]:
+        """Holds the run's lock and user slot while it executes, then frees them.
+
+        Raises 409 if the lock expired while the run was queued and another
+        run on the same conversation has taken it since.
+        """
+        if not await self.renew(run):
+            await self.release(run)
+            raise HTTPException(
+                status_code=status.HTTP_409_CONFLICT,
+                detail="Conversation is currently being processed by another request",
+            )
+
+        async def keep_renewing():
+            while True:
+                await asyncio.sleep(LEASE_SECONDS / 3)
+                await self.renew(run)
+
+        renewer = asyncio.create_task(keep_renewing())
+        try:
+            yield
+        finally:
+            renewer.cancel()
+            await asyncio.gather(renewer, return_exceptions=True)
+            await self.release(run)
+
+    async def enqueue(self, run: ChatRun):
+        await get_redis().lpush(CHAT_QUEUE_KEY, run.model_dump_json())
+
+    async def claim(
+        self, worker_id: str, timeout: float
+    ) -> Optional[tuple[str, ChatRun]]:
+        raw = await get_redis().blmove(
+            CHAT_QUEUE_KEY,
+            PROCESSING_KEY_PREFIX + worker_id,
+            timeout,
+            "RIGHT",
+            "LEFT",
+        )
+        if raw is None:
+            return None
+        return raw, ChatRun.model_validate_json(raw)
+
+    async def ack(self, worker_id: str, raw: str):
+        await get_redis().lrem(PROCESSING_KEY_PREFIX + worker_id, 1, raw)
+
+    async def heartbeat(self, worker_id: str):
+        await get_redis().set(
+            WORKER_KEY_PREFIX + worker_id, "alive", ex=WORKER_HEARTBEAT_SECONDS
+        )
+
+    async def take_orphaned_runs(self) -> list[ChatRun]:
+        """Removes and returns the runs claimed by workers that stopped heartbeating."""
+        redis = get_redis()
+        orphans = []
+        async for key in redis.scan_iter(match=PROCESSING_KEY_PREFIX + "*"):
+            worker_id = key[len(PROCESSING_KEY_PREFIX) :]
+            if await redis.exists(WORKER_KEY_PREFIX + worker_id):
+                continue
+            while (raw := await redis.rpop(key)) is not None:
+                orphans.append(ChatRun.model_validate_json(raw))
+        return orphans
+
+
+@lru_cache(maxsize=1)
+def get_chat_run_queue() -> ChatRunQueue:
+    return ChatRunQueue(
+        max_runs_per_user=int(os.environ.get("MUNDI_CHAT_MAX_RUNS_PER_USER", "2")),
+        max_queue_depth=int(os.environ.get("MUNDI_CHAT_MAX_QUEUE_DEPTH", "200")),
+        slow_provider_seconds=float(
+            os.environ.get("MUNDI_CHAT_SLOW_PROVIDER_SECONDS", "20")
+        ),
+        queue_wait_seconds=int(os.environ.get("MUNDI_CHAT_QUEUE_WAIT_SECONDS", "600")),
+    )
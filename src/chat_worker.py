@@ -0,0 +1,146 @@
+# Copyright (C) 2025 Bunting Labs, Inc.
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Dedicated chat worker process.
+
+With MUNDI_CHAT_EXECUTION=queue the web processes only admit and enqueue chat
+runs, and any number of workers started with `python -m src.chat_worker` run
+them. Each worker runs up to MUNDI_CHAT_WORKER_CONCURRENCY chats at once.
+Messages reach the browser through the Postgres NOTIFY channel the web
+processes already listen on.
+"""
+
+import asyncio
+import logging
+import os
+import signal
+import uuid
+
+from fastapi import HTTPException
+
+from src.chat_queue import WORKER_HEARTBEAT_SECONDS, ChatRun, get_chat_run_queue
+from src.dependencies.redis_pool import close_redis
+from src.routes import websocket
+from src.routes.message_routes import (
+    CHAT_TOOL_FANOUT,
+    TOOL_CALL_CONNECTIONS,
+    chat_cancellations,
+    run_queued_chat,
+)
+from src.routes.websocket import kue_notify_error
+from src.services.earth_engine import get_earth_engine
+from src.services.pest import get_pest_detector
+from src.wsgi import app
+
+logger = logging.getLogger(__name__)
+
+CLAIM_TIMEOUT_SECONDS = 5
+
+
+async def _heartbeat(worker_id: str):
+    queue = get_chat_run_queue()
+    while True:
+        try:
+            await queue.heartbeat(worker_id)
+            # runs claimed by workers that died mid-chat cannot be resumed
+            # safely, tools may already have changed the map
+            for run in await queue.take_orphaned_runs():
+                logger.warning(f"Releasing chat run {run.run_id} of a dead worker")
+                await queue.release(run)
+                await kue_notify_error(
+                    run.conversation_id,
+                    "Kue was interrupted while working on this message, please send it again.",
+                )
+        except Exception:
+            logger.exception("Chat worker heartbeat failed")
+        await asyncio.sleep(WORKER_HEARTBEAT_SECONDS / 3)
+
+
+async def _run_slot(worker_id: str, stopping: asyncio.Event):
+    queue = get_chat_run_queue()
+    while not stopping.is_set():
+        try:
+            claimed = await queue.claim(worker_id, CLAIM_TIMEOUT_SECONDS)
+        except Exception:
+            logger.exception("Failed to claim a chat run")
+            await asyncio.sleep(CLAIM_TIMEOUT_SECONDS)
+            continue
+        if claimed is None:
+            continue
+
+        raw, run = claimed
+        try:
+            await run_queued_chat(run, app)
+        except HTTPException as e:
+            await _notify_failed(run, e.detail)
+        except Exception:
+            logger.exception(f"Chat run {run.run_id} failed")
+            await _notify_failed(
+                run,
+                "Error processing this message. This is probably a bug with Mundi, please open a new issue on GitHub.",
+            )
+        finally:
+            # no-op unless the run failed before taking its lease
+            await queue.release(run)
+            await queue.ack(worker_id, raw)
+
+
+async def _notify_failed(run: ChatRun, error_message: str):
+    try:
+        await kue_notify_error(run.conversation_id, error_message)
+    except Exception:
+        logger.exception(f"Failed to report chat run {run.run_id} failure")
+
+
+def pool_size(concurrency: int) -> int:
+    """Postgres connections the worker's chats can hold at once: each chat's
+    own, plus those of the tool calls it runs concurrently."""
+    return concurrency * (1 + CHAT_TOOL_FANOUT * TOOL_CALL_CONNECTIONS)
+
+
+async def run_worker(concurrency: int):
+    websocket.publish_ephemeral_via_pg_notify = True
+    # before anything creates the pool, an explicit setting still wins
+    os.environ.setdefault("MUNDI_PG_POOL_MAX_SIZE", str(pool_size(concurrency)))
+    worker_id = str(uuid.uuid4())
+    stopping = asyncio.Event()
+
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        # finish the chats in flight, claim nothing new
+        loop.add_signal_handler(sig, stopping.set)
+
+    await get_chat_run_queue().heartbeat(worker_id)
+    await get_earth_engine().start()
+    # the pest_detection tool needs the model and imagery index loaded
+    await get_pest_detector().start()
+    heartbeat = asyncio.create_task(_heartbeat(worker_id))
+    logger.info(f"Chat worker {worker_id} running {concurrency} slots")
+    try:
+        await asyncio.gather(
+            *(_run_slot(worker_id, stopping) for _ in range(concurrency))
+        )
+    finally:
+        heartbeat.cancel()
+        await asyncio.gather(heartbeat, return_exceptions=True)
+        get_earth_engine().close()
+        get_pest_detector().close()
+        await chat_cancellations.close()
+        await close_redis()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(run_worker(int(os.environ.get("MUNDI_CHAT_WORKER_CONCURRENCY", "4"))))
@@ -14,20 +14,16 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import asyncio
-import redis.asyncio as redis
 from pathlib import Path
 from alembic import command
 from alembic.config import Config
 from concurrent.futures import ThreadPoolExecutor
-import os
+from src.dependencies.redis_pool import get_redis
 
 
 async def run_migrations():
     """Run Alembic migrations programmatically with Redis lock"""
-    redis_host = os.getenv("REDIS_HOST", "localhost")
-    redis_client = redis.Redis(host=redis_host, port=6379)
-
-    async with redis_client.lock("migration_lock", timeout=60, blocking_timeout=30):
+    async with get_redis().lock("migration_lock", timeout=60, blocking_timeout=30):
         # Get the project root directory (mundi-public)
         project_root = Path(__file__).parent.parent.parent
         alembic_cfg = Config(project_root / "alembic.ini")
@@ -27,7 +27,9 @@ from sqlalchemy import (
     ForeignKey,
     Date,
     Index,
+    Computed,
 )
+from sqlalchemy.types import UserDefinedType
 
 import json
 from sqlalchemy.orm import declarative_base, Mapped, mapped_column
@@ -41,9 +43,6 @@ import os
 import tempfile
 import time
 from contextlib import asynccontextmanager
-from boto3.s3.transfer import TransferConfig
-
-one_shot_config = TransferConfig(multipart_threshold=5 * 1024**3)  # 5 GiB
 
 if TYPE_CHECKING:
     pass
@@ -217,8 +216,13 @@ class MapLayer(Base):
             never_return_local_file: If True, return presigned URLs for S3 instead of downloading
         """
 
+        from src import s3_transfer
         from src.structures import async_conn
-        from src.utils import get_async_s3_client, get_bucket_name
+        from src.utils import (
+            get_async_s3_client,
+            get_bucket_name,
+            get_presigned_get_url,
+        )
 
         @asynccontextmanager
         async def _source_context():
@@ -278,8 +282,8 @@ class MapLayer(Base):
                         timestamp = int(time.time())
                         s3_key = f"temp/postgis/{self.layer_id}_{timestamp}.gpkg"
 
-                        await s3_client.upload_file(
-                            temp_gpkg_path, bucket_name, s3_key, Config=one_shot_config
+                        await s3_transfer.upload_file(
+                            temp_gpkg_path, bucket_name, s3_key
                         )
 
                         presigned_url = await s3_client.generate_presigned_url(
@@ -316,15 +320,13 @@ class MapLayer(Base):
                     yield f"/vsicurl/{self.remote_url}"
             elif self.s3_key:
                 # S3 storage: either download to temp file or return presigned URL
-                s3_client = await get_async_s3_client()
                 bucket_name = get_bucket_name()
 
                 if never_return_local_file:
-                    # Generate presigned GET URL for remote access
-                    presigned_url = await s3_client.generate_presigned_url(
-                        "get_object",
-                        Params={"Bucket": bucket_name, "Key": self.s3_key},
-                        ExpiresIn=3600,
+                    # Presigned GET URL for remote access, reused while it has
+                    # at least 15 minutes left so downstream caches see one URL
+                    presigned_url = await get_presigned_get_url(
+                        bucket_name, self.s3_key, expires_in=3600, min_remaining=900
                     )
                     yield presigned_url
                 else:
@@ -337,7 +339,7 @@ class MapLayer(Base):
 
                     try:
                         # Download S3 file to temporary location
-                        await s3_client.download_file(
+                        await s3_transfer.download_file(
                             bucket_name, self.s3_key, temp_path
                         )
                         yield temp_path
@@ -440,16 +442,39 @@ class MundiChatCompletionMessage(Base):
 
 #---------------------New Tables for Bloom Prediction-----------------------#
 
+class Point(UserDefinedType):
+    """Postgres' built-in point type."""
+
+    cache_ok = True
+
+    def get_col_spec(self, **kw):
+        return "POINT"
+
+
+# longitude scaled by cos(latitude), so that locally a degree is the same
+# distance along both axes, see bloom_store
+BLOOM_LOCATION_SQL = "point(longitude * cos(radians(latitude)), latitude)"
+
+
 class BloomObservation(Base):
     __tablename__ = "bloom_observations"
 
     id = Column(Integer, primary_key=True)
-    map_id = Column(String(12), ForeignKey("user_mundiai_maps.id"), nullable=False)
+    # null for detections cached by detect_bloom outside of any map
+    map_id = Column(String(12), ForeignKey("user_mundiai_maps.id"), nullable=True)
     latitude = Column(Float, nullable=False)
     longitude = Column(Float, nullable=False)
     date_of_max_ebi = Column(Date, nullable=False)
     ebi_value = Column(Float, nullable=True)
     image_url = Column(Text, nullable=True)
+    season = Column(Integer, nullable=True)
+    # most recent acquisition the detection was computed from
+    imagery_date = Column(Date, nullable=True)
+    # backend, region and cloud filter the detection was computed with
+    parameters = Column(JSONB, nullable=True)
+    # reusable until then, when newer imagery may exist
+    valid_until = Column(TIMESTAMP(timezone=True), nullable=True)
+    location = Column(Point, Computed(BLOOM_LOCATION_SQL, persisted=True))
     created_at = Column(
         TIMESTAMP(timezone=True),
         nullable=False,
@@ -461,20 +486,50 @@ class BloomObservation(Base):
     __table_args__ = (
         Index("ix_bloom_observations_map_lat_lon", "map_id", "latitude", "longitude"),
         Index("ix_bloom_observations_map_date", "map_id", "date_of_max_ebi"),
+        Index("ix_bloom_observations_location", "location", postgresql_using="gist"),
     )
 
 
+class MonitoredField(Base):
+    __tablename__ = "monitored_fields"
+
+    id = Column(String(12), primary_key=True)  # starts with F
+    project_id = Column(
+        String(12), ForeignKey("user_mundiai_projects.id"), nullable=False
+    )
+    user_id = Column(UUID, nullable=False)
+    name = Column(String(255), nullable=True)
+    latitude = Column(Float, nullable=False)
+    longitude = Column(Float, nullable=False)
+    created_at = Column(
+        TIMESTAMP(timezone=True),
+        nullable=False,
+        server_default=func.current_timestamp(),
+    )
+    # last time the scheduler precomputed this field's bloom results
+    refreshed_at = Column(TIMESTAMP(timezone=True), nullable=True)
+    # valid_until of the field's latest stored detection
+    observation_valid_until = Column(TIMESTAMP(timezone=True), nullable=True)
+    soft_deleted_at = Column(TIMESTAMP(timezone=True))
+
+    project = relationship("MundiProject")
+
+    __table_args__ = (Index("ix_monitored_fields_project_id", "project_id"),)
+
+
 class BloomPrediction(Base):
     __tablename__ = "bloom_predictions"
 
     id = Column(Integer, primary_key=True)
-    map_id = Column(String(12), ForeignKey("user_mundiai_maps.id"), nullable=False)
+    # null for predictions made by predict_bloom outside of any map
+    map_id = Column(String(12), ForeignKey("user_mundiai_maps.id"), nullable=True)
     latitude = Column(Float, nullable=False)
     longitude = Column(Float, nullable=False)
     predicted_bloom_start = Column(Date, nullable=False)
     predicted_bloom_peak = Column(Date, nullable=False)
     confidence = Column(Float, nullable=True)
     model_version = Column(String(64), nullable=True)
+    location = Column(Point, Computed(BLOOM_LOCATION_SQL, persisted=True))
     created_at = Column(
         TIMESTAMP(timezone=True),
         nullable=False,
@@ -486,6 +541,7 @@ class BloomPrediction(Base):
     __table_args__ = (
         Index("ix_bloom_predictions_map_lat_lon", "map_id", "latitude", "longitude"),
         Index("ix_bloom_predictions_map_peak", "map_id", "predicted_bloom_peak"),
+        Index("ix_bloom_predictions_location", "location", postgresql_using="gist"),
     )
 
 
@@ -512,3 +568,19 @@ class PestDiagnosis(Base):
         Index("ix_pest_diagnosis_map_lat_lon", "map_id", "latitude", "longitude"),
         Index("ix_pest_diagnosis_species", "species_detected"),
     )
+
+
+class GeocodeCache(Base):
+    __tablename__ = "geocode_cache"
+
+    backend = Column(String(32), primary_key=True)
+    # normalized query, see src.dependencies.geocoder.normalize_query
+    query = Column(Text, primary_key=True)
+    # both null when the backend found nothing
+    latitude = Column(Float, nullable=True)
+    longitude = Column(Float, nullable=True)
+    fetched_at = Column(
+        TIMESTAMP(timezone=True),
+        nullable=False,
+        server_default=func.current_timestamp(),
+    )
@@ -15,8 +15,15 @@
 
 from abc import ABC, abstractmethod
 from typing import Dict, Any, Optional, List
+import asyncio
+import json
+import logging
+import time
 import httpx
 import os
+from src.dependencies.redis_pool import get_redis
+
+logger = logging.getLogger(__name__)
 
 
 class BaseMapProvider(ABC):
@@ -53,6 +60,128 @@ class BaseMapProvider(ABC):
         pass
 
 
+class RemoteStyleCache:
+    """Caches remote MapLibre styles in process and in Redis.
+
+    A style is served from cache while fresh. Once it goes stale it is still
+    served for up to `stale_seconds` while a single background task
+    revalidates it upstream with If-None-Match / If-Modified-Since. Upstream
+    failures fall back to the stale copy whenever one exists.
+
+    Setting MUNDI_BASEMAP_STYLES_DIR to a directory containing `<name>.json`
+    files serves those styles from disk and never touches the network.
+    """
+
+    def __init__(self, fresh_seconds: float = 300, stale_seconds: float = 86400):
+        self.fresh_seconds = fresh_seconds
+        self.stale_seconds = stale_seconds
+        # url -> {"body", "etag", "last_modified", "fetched_at"}
+        self.entries: Dict[str, Dict[str, Any]] = {}
+        self.revalidations: Dict[str, asyncio.Task] = {}
+        self.local_styles: Dict[str, tuple[int, str]] = {}
+
+    def get_local_style(self, name: str) -> Optional[Dict[str, Any]]:
+        styles_dir = os.environ.get("MUNDI_BASEMAP_STYLES_DIR")
+        if not styles_dir:
+            return None
+        path = os.path.join(styles_dir, f"{name}.json")
+        try:
+            mtime_ns = os.stat(path).st_mtime_ns
+        except FileNotFoundError:
+            return None
+        cached = self.local_styles.get(path)
+        if cached is None or cached[0] != mtime_ns:
+            with open(path, "r") as f:
+                cached = (mtime_ns, f.read())
+            self.local_styles[path] = cached
+        return json.loads(cached[1])
+
+    async def _load_from_redis(self, url: str) -> Optional[Dict[str, Any]]:
+        try:
+            raw = await get_redis().get(f"basemap_style:{url}")
+        except Exception:
+            logger.warning("Redis unavailable for basemap style cache")
+            return None
+        return json.loads(raw) if raw else None
+
+    async def _store(self, url: str, entry: Dict[str, Any]):
+        self.entries[url] = entry
+        try:
+            await get_redis().setex(
+                f"basemap_style:{url}",
+                int(self.fresh_seconds + self.stale_seconds),
+                json.dumps(entry),
+            )
+        except Exception:
+            logger.warning("Redis unavailable for basemap style cache")
+
+    async def _revalidate(
+        self, url: str, entry: Optional[Dict[str, Any]]
+    ) -> Dict[str, Any]:
+        headers = {}
+        if entry is not None:
+            if entry.get("etag"):
+                headers["If-None-Match"] = entry["etag"]
+            if entry.get("last_modified"):
+                headers["If-Modified-Since"] = entry["last_modified"]
+
+        try:
+            async with httpx.AsyncClient(timeout=10.0) as client:
+                response = await client.get(url, headers=headers)
+            if response.status_code == 304 and entry is not None:
+                new_entry = {**entry, "fetched_at": time.time()}
+            else:
+                response.raise_for_status()
+                new_entry = {
+                    "body": response.text,
+                    "etag": response.headers.get("etag"),
+                    "last_modified": response.headers.get("last-modified"),
+                    "fetched_at": time.time(),
+                }
+        except (httpx.HTTPError, ValueError):
+            if entry is None:
+                raise
+            logger.warning(f"Failed to revalidate basemap style {url}, serving stale")
+            return entry
+
+        await self._store(url, new_entry)
+        return new_entry
+
+    def _revalidate_in_background(self, url: str, entry: Dict[str, Any]):
+        task = self.revalidations.get(url)
+        if task is not None and not task.done():
+            return
+        task = asyncio.create_task(self._revalidate(url, entry))
+        task.add_done_callback(lambda t: t.cancelled() or t.exception())
+        self.revalidations[url] = task
+
+    async def get_style(self, url: str) -> Dict[str, Any]:
+        entry = self.entries.get(url)
+        if entry is None or time.time() - entry["fetched_at"] >= self.fresh_seconds:
+            # another worker may already have refreshed it
+            shared_entry = await self._load_from_redis(url)
+            if shared_entry is not None and (
+                entry is None or shared_entry["fetched_at"] > entry["fetched_at"]
+            ):
+                entry = shared_entry
+                self.entries[url] = entry
+
+        if entry is not None:
+            age = time.time() - entry["fetched_at"]
+            if age >= self.fresh_seconds + self.stale_seconds:
+                entry = await self._revalidate(url, entry)
+            elif age >= self.fresh_seconds:
+                self._revalidate_in_background(url, entry)
+        else:
+            entry = await self._revalidate(url, None)
+
+        # decode per call, callers mutate the style they get back
+        return json.loads(entry["body"])
+
+
+remote_style_cache = RemoteStyleCache()
+
+
 class OpenStreetMapProvider(BaseMapProvider):
     """Default base map provider using OpenStreetMap tiles."""
 
@@ -65,14 +194,16 @@ class OpenStreetMapProvider(BaseMapProvider):
         # Default to openstreetmap if no name provided
         basemap_name = name or "openstreetmap"
 
+        # Offline and test deployments can ship styles on disk
+        local_style = remote_style_cache.get_local_style(basemap_name)
+        if local_style is not None:
+            return local_style
+
         if basemap_name == "openfreemap":
-            # Fetch the OpenFreeMap vector style from their API
-            async with httpx.AsyncClient() as client:
-                response = await client.get(
-                    "https://tiles.openfreemap.org/styles/liberty"
-                )
-                response.raise_for_status()
-                return response.json()
+            # OpenFreeMap vector style from their API, cached and revalidated
+            return await remote_style_cache.get_style(
+                "https://tiles.openfreemap.org/styles/liberty"
+            )
         else:
             # Default OpenStreetMap style
             return {
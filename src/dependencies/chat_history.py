@@ -0,0 +1,210 @@
+# Copyright (C) 2025 Bunting Labs, Inc.
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import hashlib
+import json
+import os
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Any, Dict, List
+
+# Rough per-message overhead of the chat format (role, separators)
+MESSAGE_OVERHEAD_TOKENS = 4
+# String values in a summarized tool result are cut to this many characters
+SUMMARY_VALUE_CHARS = 400
+
+
+def estimate_tokens(text: str) -> int:
+    # ~4 characters per token for English and JSON, close enough for
+    # budgeting without shipping a tokenizer for every provider we support
+    return (len(text) + 3) // 4
+
+
+class ChatHistoryCompactor(ABC):
+    @abstractmethod
+    def compact(
+        self, messages: List[Dict[str, Any]], reserved_tokens: int = 0
+    ) -> List[Dict[str, Any]]:
+        """Return the messages to send to the LLM, never mutating the input.
+
+        `reserved_tokens` is taken by what is sent alongside them, the system
+        prompt, tool definitions and map state.
+        """
+        pass
+
+
+class DefaultChatHistoryCompactor(ChatHistoryCompactor):
+    """Keeps the conversation sent to the LLM under a token budget.
+
+    Compaction happens in three steps, stopping as soon as the history fits:
+    1. tool results are replaced by a shortened summary, oldest first, up to
+       the results of the latest assistant message
+    2. system messages from earlier turns are dropped, they describe map
+       state that has since been superseded
+    3. the oldest turns are dropped entirely
+
+    The current turn (everything from the last user message on) is never
+    dropped, and the latest tool results are always sent in full. Summaries
+    are cached by content hash, so re-compacting a long history on every
+    loop iteration is cheap.
+    """
+
+    def __init__(self, token_budget: int, max_cache_entries: int = 10000):
+        self.token_budget = token_budget
+        self.max_cache_entries = max_cache_entries
+        self.summaries: OrderedDict[str, str] = OrderedDict()
+
+    def _remember(self, cache: OrderedDict, key: str, value):
+        cache[key] = value
+        cache.move_to_end(key)
+        while len(cache) > self.max_cache_entries:
+            cache.popitem(last=False)
+
+    def count_tokens(self, message: Dict[str, Any]) -> int:
+        # serializing is the cost, a cache keyed on content would pay it too
+        serialized = json.dumps(message, default=str)
+        return estimate_tokens(serialized) + MESSAGE_OVERHEAD_TOKENS
+
+    def summarize_tool_content(self, content: str) -> str:
+        key = hashlib.sha256(content.encode("utf-8")).hexdigest()
+        summary = self.summaries.get(key)
+        if summary is None:
+            summary = self._summarize(content)
+        self._remember(self.summaries, key, summary)
+        return summary
+
+    def _summarize(self, content: str) -> str:
+        try:
+            result = json.loads(content)
+        except ValueError:
+            result = None
+
+        if not isinstance(result, dict):
+            if len(content) <= SUMMARY_VALUE_CHARS:
+                return content
+            return (
+                content[:SUMMARY_VALUE_CHARS]
+                + f"... [truncated {len(content) - SUMMARY_VALUE_CHARS} characters from an earlier tool result]"
+            )
+
+        # keep every small field (status, ids, errors), shorten the dumps
+        summary: Dict[str, Any] = {}
+        truncated = False
+        for key, value in result.items():
+            if isinstance(value, str) and len(value) > SUMMARY_VALUE_CHARS:
+                lines = value.count("\n")
+                summary[key] = (
+                    value[:SUMMARY_VALUE_CHARS]
+                    + f"... [truncated, {len(value)} characters / {lines} lines]"
+                )
+                truncated = True
+            elif isinstance(value, (dict, list)):
+                serialized = json.dumps(value, default=str)
+                if len(serialized) > SUMMARY_VALUE_CHARS:
+                    summary[key] = serialized[:SUMMARY_VALUE_CHARS] + "... [truncated]"
+                    truncated = True
+                else:
+                    summary[key] = value
+            else:
+                summary[key] = value
+        if truncated:
+            summary["kue_note"] = (
+                "Earlier tool result shortened to save context, re-run the tool "
+                "if the full output is needed."
+            )
+        return json.dumps(summary, default=str)
+
+    def compact(
+        self, messages: List[Dict[str, Any]], reserved_tokens: int = 0
+    ) -> List[Dict[str, Any]]:
+        budget = self.token_budget - reserved_tokens
+        counts = [self.count_tokens(m) for m in messages]
+        total = sum(counts)
+        if total <= budget:
+            return messages
+
+        current_turn_start = next(
+            (
+                i
+                for i in range(len(messages) - 1, -1, -1)
+                if messages[i].get("role") == "user"
+            ),
+            0,
+        )
+
+        # the results of the latest tool calls are what the model acts on next
+        latest_results_start = next(
+            (
+                i
+                for i in range(len(messages) - 1, current_turn_start - 1, -1)
+                if messages[i].get("role") == "assistant"
+            ),
+            current_turn_start,
+        )
+
+        compacted: List[Dict[str, Any] | None] = list(messages)
+
+        # 1. summarize tool results, oldest first
+        for i in range(latest_results_start):
+            if total <= budget:
+                break
+            message = messages[i]
+            if message.get("role") != "tool" or not isinstance(
+                message.get("content"), str
+            ):
+                continue
+            summarized = {
+                **message,
+                "content": self.summarize_tool_content(message["content"]),
+            }
+            new_count = self.count_tokens(summarized)
+            total -= counts[i] - new_count
+            counts[i] = new_count
+            compacted[i] = summarized
+
+        # 2. drop superseded system messages
+        for i in range(current_turn_start):
+            if total <= budget:
+                break
+            if messages[i].get("role") == "system":
+                total -= counts[i]
+                compacted[i] = None
+
+        # 3. drop whole turns from the start, so every tool result keeps the
+        # assistant message that called it
+        turn_starts = [
+            i for i in range(current_turn_start) if messages[i].get("role") == "user"
+        ] + [current_turn_start]
+        drop_until = 0
+        for next_start in turn_starts[1:]:
+            if total <= budget:
+                break
+            for i in range(drop_until, next_start):
+                if compacted[i] is not None:
+                    total -= counts[i]
+                    compacted[i] = None
+            drop_until = next_start
+
+        return [m for m in compacted if m is not None]
+
+
+def get_chat_token_budget() -> int:
+    return int(os.environ.get("MUNDI_CHAT_TOKEN_BUDGET", "60000"))
+
+
+@lru_cache(maxsize=1)
+def get_chat_history_compactor() -> ChatHistoryCompactor:
+    return DefaultChatHistoryCompactor(token_budget=get_chat_token_budget())
@@ -20,15 +20,8 @@ import secrets
 from src.structures import get_async_db_connection
 from src.dependencies.postgres_connection import PostgresConnectionManager
 from src.dependencies.chat_completions import ChatArgsProvider
-from redis import Redis
+from src.dependencies.redis_pool import get_redis
 from openai import AsyncOpenAI
-import os
-
-redis = Redis(
-    host=os.environ["REDIS_HOST"],
-    port=int(os.environ["REDIS_PORT"]),
-    decode_responses=True,
-)
 
 
 def generate_id(length=12, prefix=""):
@@ -89,8 +82,11 @@ class DefaultDatabaseDocumenter(DatabaseDocumenter):
                 """
                 )
 
-                redis.set(f"dbdocumenter:{connection_id}:total_tables", len(tables))
-                redis.set(f"dbdocumenter:{connection_id}:processed_tables", 0)
+                redis = get_redis()
+                await redis.set(
+                    f"dbdocumenter:{connection_id}:total_tables", len(tables)
+                )
+                await redis.set(f"dbdocumenter:{connection_id}:processed_tables", 0)
 
                 # Build schema description
                 schema_description = f"Database: {connection_name}\n\n"
@@ -129,7 +125,7 @@ class DefaultDatabaseDocumenter(DatabaseDocumenter):
 
                     schema_description += "\n"
 
-                    redis.incr(f"dbdocumenter:{connection_id}:processed_tables")
+                    await redis.incr(f"dbdocumenter:{connection_id}:processed_tables")
             finally:
                 # Ensure the connection is closed to avoid leaks
                 await conn.close()
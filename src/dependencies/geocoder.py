@@ -0,0 +1,316 @@
+# Copyright (C) 2025 Bunting Labs, Inc.
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import asyncio
+import csv
+import logging
+import os
+import re
+import time
+import unicodedata
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
+
+import httpx
+
+from src.structures import async_conn
+
+logger = logging.getLogger(__name__)
+
+Coordinates = Tuple[float, float]
+
+# how long stored lookups stay valid, misses are retried sooner
+POSITIVE_TTL = timedelta(days=180)
+NEGATIVE_TTL = timedelta(days=1)
+
+
+def normalize_query(query: str) -> str:
+    """Cache key for an address: case, accents, spacing and punctuation folded."""
+    query = unicodedata.normalize("NFKD", query)
+    query = "".join(c for c in query if not unicodedata.combining(c))
+    query = query.casefold()
+    query = re.sub(r"[^\w,]+", " ", query)
+    parts = [" ".join(part.split()) for part in query.split(",")]
+    return ", ".join(part for part in parts if part)
+
+
+class GeocoderBackend(ABC):
+    # identifies the backend's results in the persistent cache
+    name: str
+    # whether results are worth storing in Postgres
+    persist_results: bool = True
+
+    @abstractmethod
+    async def geocode(self, query: str) -> Optional[Coordinates]:
+        """Resolve an address as the user wrote it to (latitude, longitude),
+        None if unknown.
+
+        Raises if the lookup itself failed, those results are not cached.
+        """
+        pass
+
+
+class NominatimGeocoderBackend(GeocoderBackend):
+    """Nominatim search API, public by default.
+
+    Override with GEOCODER_URL and GEOCODER_USER_AGENT. Requests from a
+    process are spaced at least `min_interval` seconds apart, as the public
+    instance's usage policy allows one request per second.
+    """
+
+    name = "nominatim"
+
+    def __init__(self, url: str, user_agent: str, min_interval: float = 1.0):
+        self.url = url
+        self.user_agent = user_agent
+        self.min_interval = min_interval
+        self.client: Optional[httpx.AsyncClient] = None
+        self.rate_lock = asyncio.Lock()
+        self.last_request = 0.0
+
+    def _client(self) -> httpx.AsyncClient:
+        if self.client is None or self.client.is_closed:
+            self.client = httpx.AsyncClient(
+                timeout=10.0, headers={"User-Agent": self.user_agent}
+            )
+        return self.client
+
+    async def geocode(self, query: str) -> Optional[Coordinates]:
+        async with self.rate_lock:
+            wait = self.last_request + self.min_interval - time.monotonic()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            self.last_request = time.monotonic()
+        resp = await self._client().get(
+            self.url, params={"q": query, "format": "jsonv2", "limit": 1}
+        )
+        resp.raise_for_status()
+        data = resp.json()
+        if not data:
+            return None
+        return (float(data[0]["lat"]), float(data[0]["lon"]))
+
+
+class GazetteerGeocoderBackend(GeocoderBackend):
+    """Offline lookups against a local gazetteer file.
+
+    Accepts a GeoNames dump (e.g. cities500.txt, tab separated) or a CSV with
+    name, latitude and longitude columns. GeoNames places are also indexed as
+    "name, admin1" and "name, country" ("fresno, ca", "fresno, us"), keeping
+    the most populous place for each key. An address that matches no key
+    falls back to its comma separated parts, so "12 Orchard Rd, Fresno, CA"
+    resolves to Fresno.
+    """
+
+    name = "gazetteer"
+    persist_results = False
+
+    def __init__(self, path: str):
+        self.path = path
+        self.places: Dict[str, Coordinates] = {}
+        self._load()
+
+    def _add(self, key: str, coords: Coordinates, population: int, populations):
+        key = normalize_query(key)
+        if key and population >= populations.get(key, -1):
+            self.places[key] = coords
+            populations[key] = population
+
+    def _load(self):
+        populations: Dict[str, int] = {}
+        with open(self.path, newline="", encoding="utf-8") as f:
+            if self.path.endswith(".csv"):
+                for row in csv.DictReader(f):
+                    coords = (float(row["latitude"]), float(row["longitude"]))
+                    self._add(row["name"], coords, 0, populations)
+                return
+            for line in f:
+                cols = line.rstrip("\n").split("\t")
+                if len(cols) < 15:
+                    continue
+                name, asciiname = cols[1], cols[2]
+                coords = (float(cols[4]), float(cols[5]))
+                country, admin1 = cols[8], cols[10]
+                population = int(cols[14] or 0)
+                for place_name in {name, asciiname}:
+                    self._add(place_name, coords, population, populations)
+                    if admin1:
+                        self._add(
+                            f"{place_name}, {admin1}", coords, population, populations
+                        )
+                    self._add(
+                        f"{place_name}, {country}", coords, population, populations
+                    )
+
+    async def geocode(self, query: str) -> Optional[Coordinates]:
+        query = normalize_query(query)
+        parts = query.split(", ")
+        candidates = [query]
+        candidates += [", ".join(parts[i : i + 2]) for i in range(len(parts) - 1)]
+        candidates += parts
+        for candidate in candidates:
+            coords = self.places.get(candidate)
+            if coords is not None:
+                return coords
+        return None
+
+
+class Geocoder:
+    """Geocoder with an in-memory LRU in front of a Postgres cache.
+
+    Queries are normalized into the cache key, so trivially different
+    spellings of the same address share one entry, while the backend gets
+    the address as written. Misses are cached too, with a shorter
+    lifetime, so a bad address does not hit the backend on every question.
+    """
+
+    def __init__(self, backend: GeocoderBackend, max_memory_entries: int = 10000):
+        self.backend = backend
+        self.max_memory_entries = max_memory_entries
+        # normalized query -> (coordinates or None, expires_at)
+        self.memory: OrderedDict[str, Tuple[Optional[Coordinates], float]] = (
+            OrderedDict()
+        )
+
+    def _remember(self, key: str, coords: Optional[Coordinates], expires_at: float):
+        self.memory[key] = (coords, expires_at)
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.max_memory_entries:
+            self.memory.popitem(last=False)
+
+    async def geocode(self, address: str) -> Optional[Coordinates]:
+        return (await self.geocode_many([address]))[0]
+
+    async def geocode_many(self, addresses: List[str]) -> List[Optional[Coordinates]]:
+        keys = [normalize_query(a) if isinstance(a, str) else "" for a in addresses]
+        results: Dict[str, Optional[Coordinates]] = {"": None}
+
+        now = time.time()
+        for key in set(keys) - results.keys():
+            cached = self.memory.get(key)
+            if cached is not None and cached[1] > now:
+                self.memory.move_to_end(key)
+                results[key] = cached[0]
+
+        # the first spelling of each key is what the backend is asked
+        originals: Dict[str, str] = {}
+        for key, address in zip(keys, addresses):
+            originals.setdefault(key, address)
+        missing = [key for key in originals if key not in results]
+        if missing and self.backend.persist_results:
+            try:
+                persisted = await self._load_persisted(missing)
+            except Exception:
+                # the backend can still answer
+                logger.exception("Loading persisted geocodes failed")
+                persisted = []
+            for key, coords, expires_at in persisted:
+                results[key] = coords
+                self._remember(key, coords, expires_at)
+            missing = [key for key in missing if key not in results]
+
+        if missing:
+            resolved = await asyncio.gather(
+                *(self.backend.geocode(originals[key]) for key in missing),
+                return_exceptions=True,
+            )
+            fetched_at = datetime.now(timezone.utc)
+            to_persist = []
+            for key, coords in zip(missing, resolved):
+                if isinstance(coords, Exception):
+                    logger.warning(f"Geocoding {key!r} failed: {coords!r}")
+                    results[key] = None
+                    continue
+                results[key] = coords
+                ttl = POSITIVE_TTL if coords is not None else NEGATIVE_TTL
+                self._remember(key, coords, (fetched_at + ttl).timestamp())
+                to_persist.append((key, coords))
+            if to_persist and self.backend.persist_results:
+                try:
+                    await self._persist(to_persist, fetched_at)
+                except Exception:
+                    # still remembered in memory
+                    logger.exception("Persisting geocodes failed")
+
+        return [results[key] for key in keys]
+
+    async def _load_persisted(
+        self, keys: List[str]
+    ) -> List[Tuple[str, Optional[Coordinates], float]]:
+        async with async_conn("geocoder.load") as conn:
+            rows = await conn.fetch(
+                """
+                SELECT query, latitude, longitude, fetched_at
+                FROM geocode_cache
+                WHERE backend = $1 AND query = ANY($2::text[])
+                """,
+                self.backend.name,
+                keys,
+            )
+        now = datetime.now(timezone.utc)
+        persisted = []
+        for row in rows:
+            found = row["latitude"] is not None
+            expires_at = row["fetched_at"] + (POSITIVE_TTL if found else NEGATIVE_TTL)
+            if expires_at <= now:
+                continue
+            coords = (row["latitude"], row["longitude"]) if found else None
+            persisted.append((row["query"], coords, expires_at.timestamp()))
+        return persisted
+
+    async def _persist(
+        self, results: List[Tuple[str, Optional[Coordinates]]], fetched_at: datetime
+    ):
+        async with async_conn("geocoder.persist") as conn:
+            await conn.execute(
+                """
+                INSERT INTO geocode_cache (backend, query, latitude, longitude, fetched_at)
+                SELECT $1, q.query, q.latitude, q.longitude, $5
+                FROM unnest($2::text[], $3::float8[], $4::float8[])
+                    AS q(query, latitude, longitude)
+                ON CONFLICT (backend, query) DO UPDATE
+                SET latitude = EXCLUDED.latitude,
+                    longitude = EXCLUDED.longitude,
+                    fetched_at = EXCLUDED.fetched_at
+                """,
+                self.backend.name,
+                [key for key, _ in results],
+                [coords[0] if coords else None for _, coords in results],
+                [coords[1] if coords else None for _, coords in results],
+                fetched_at,
+            )
+
+
+def get_geocoder_backend() -> GeocoderBackend:
+    # MUNDI_GEOCODER=gazetteer with MUNDI_GAZETTEER_PATH serves lookups from a
+    # local file, for offline and test deployments
+    if os.environ.get("MUNDI_GEOCODER", "nominatim") == "gazetteer":
+        return GazetteerGeocoderBackend(os.environ["MUNDI_GAZETTEER_PATH"])
+    return NominatimGeocoderBackend(
+        url=os.environ.get(
+            "GEOCODER_URL", "https://nominatim.openstreetmap.org/search"
+        ),
+        user_agent=os.environ.get("GEOCODER_USER_AGENT", "mundi.ai/1.0 (geocode)"),
+        # self-hosted instances can lift the public instance's rate limit
+        min_interval=float(os.environ.get("GEOCODER_MIN_INTERVAL", "1.0")),
+    )
+
+
+@lru_cache(maxsize=1)
+def get_geocoder() -> Geocoder:
+    return Geocoder(get_geocoder_backend())
@@ -13,17 +13,10 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
-import os
 from abc import ABC, abstractmethod
 from functools import lru_cache
 from src.dependencies.postgres_connection import PostgresConnectionManager
-from redis import Redis
-
-redis = Redis(
-    host=os.environ["REDIS_HOST"],
-    port=int(os.environ["REDIS_PORT"]),
-    decode_responses=True,
-)
+from src.dependencies.redis_pool import get_redis
 
 
 class PostGISProvider(ABC):
@@ -39,7 +32,7 @@ class DefaultPostGISProvider(PostGISProvider):
         self, connection_id: str, connection_manager: PostgresConnectionManager
     ) -> str:
         cache_key = f"postgis:{connection_id}:tables"
-        cached_result = redis.get(cache_key)
+        cached_result = await get_redis().get(cache_key)
         if cached_result:
             return cached_result
 
@@ -57,7 +50,7 @@ class DefaultPostGISProvider(PostGISProvider):
 
             result = str([dict(table) for table in tables])
 
-            redis.setex(cache_key, 3600, result)
+            await get_redis().setex(cache_key, 3600, result)
 
             return result
         finally:
@@ -0,0 +1,56 @@
+# Copyright (C) 2025 Bunting Labs, Inc.
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import asyncio
+import os
+from typing import Optional
+
+import redis.asyncio as aioredis
+
+_redis_client: Optional[aioredis.Redis] = None
+_redis_loop: Optional[asyncio.AbstractEventLoop] = None
+
+
+def get_redis() -> aioredis.Redis:
+    """Shared asyncio Redis client for the process.
+
+    Every caller shares one connection pool. When the pool is exhausted callers
+    wait for a free connection instead of opening new sockets. Connections
+    are bound to the event loop they were opened on, so a new client is
+    created if the loop changes (e.g. between pytest event loops).
+    """
+    global _redis_client, _redis_loop
+    loop = asyncio.get_running_loop()
+    if _redis_client is None or _redis_loop is not loop:
+        pool = aioredis.BlockingConnectionPool(
+            host=os.environ["REDIS_HOST"],
+            port=int(os.environ.get("REDIS_PORT", "6379")),
+            decode_responses=True,
+            max_connections=int(os.environ.get("MUNDI_REDIS_MAX_CONNECTIONS", "64")),
+            timeout=10,
+            health_check_interval=30,
+        )
+        _redis_client = aioredis.Redis(connection_pool=pool)
+        _redis_loop = loop
+    return _redis_client
+
+
+async def close_redis():
+    """Close the shared client and every pooled connection, called on shutdown."""
+    global _redis_client, _redis_loop
+    if _redis_client is not None:
+        await _redis_client.aclose(close_connection_pool=True)
+    _redis_client = None
+    _redis_loop = None
@@ -34,6 +34,15 @@ class EditOrReadOnlyUserContext(UserContext):
         return "00000000-0000-0000-0000-000000000000"
 
 
+# a user authenticated earlier, e.g. by the web process that queued a chat run
+class StaticUserContext(UserContext):
+    def __init__(self, user_id: str):
+        self.user_id = user_id
+
+    def get_user_id(self) -> str:
+        return self.user_id
+
+
 def verify_session(session_required: bool = True):
     async def _verify_session() -> Optional[UserContext]:
         auth_mode = os.environ.get("MUNDI_AUTH_MODE")
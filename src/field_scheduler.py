@@ -0,0 +1,243 @@
+# Copyright (C) 2025 Bunting Labs, Inc.
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Off-peak precomputation of bloom results for monitored fields.
+
+`python -m src.field_scheduler` refreshes the fields projects registered in
+monitored_fields once per MUNDI_FIELD_REFRESH_WINDOW (UTC hours, "2-6" by
+default), writing detections through to bloom_observations and predictions
+to bloom_predictions, where chat tools and the bloom endpoints then find
+them instead of calling Earth Engine while a user waits. `--once` runs a
+single pass immediately and exits, for cron. A Redis lock keeps concurrent
+schedulers from refreshing the same fields twice.
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import signal
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from src.dependencies.redis_pool import close_redis, get_redis
+from src.services.bloom import (
+    BATCH_FAILED_ERROR,
+    detect_bloom_many,
+    predict_bloom_many,
+)
+from src.services.bloom_store import detection_valid_until
+from src.services.earth_engine import Region, get_earth_engine
+from src.structures import async_conn
+
+logger = logging.getLogger(__name__)
+
+LOCK_NAME = "field_scheduler_lock"
+# fields closer than ~10 m share one computation
+COORDINATE_DECIMALS = 4
+
+
+def refresh_window() -> Tuple[int, int]:
+    """(start, end) UTC hours of the off-peak window, end exclusive. The
+    window may wrap midnight, e.g. "22-4"."""
+    start, end = os.environ.get("MUNDI_FIELD_REFRESH_WINDOW", "2-6").split("-")
+    return int(start) % 24, int(end) % 24
+
+
+def in_window(hour: int, window: Tuple[int, int]) -> bool:
+    start, end = window
+    if start == end:
+        return True
+    if start < end:
+        return start <= hour < end
+    return hour >= start or hour < end
+
+
+def seconds_until_next_opening(now: datetime, window: Tuple[int, int]) -> float:
+    """Seconds until the window next opens after `now`, a day ahead if it
+    opened earlier today."""
+    opens = now.replace(hour=window[0], minute=0, second=0, microsecond=0)
+    if opens <= now:
+        opens += timedelta(days=1)
+    return (opens - now).total_seconds()
+
+
+def _refresh_interval() -> timedelta:
+    return timedelta(
+        hours=float(os.environ.get("MUNDI_FIELD_REFRESH_INTERVAL_HOURS", "24"))
+    )
+
+
+def _lead_time() -> timedelta:
+    """Refresh fields whose detection expires before the next window."""
+    return timedelta(hours=float(os.environ.get("MUNDI_FIELD_LEAD_HOURS", "24")))
+
+
+def _batch_size() -> int:
+    return int(os.environ.get("MUNDI_FIELD_REFRESH_BATCH_SIZE", "1000"))
+
+
+async def _due_fields(
+    pass_started: datetime, limit: int, failed: Sequence[str]
+) -> List[Dict]:
+    async with async_conn("field_scheduler.due_fields") as conn:
+        rows = await conn.fetch(
+            """
+            SELECT id, latitude, longitude
+            FROM monitored_fields
+            WHERE soft_deleted_at IS NULL
+              AND NOT (id = ANY($5::text[]))
+              AND (
+                refreshed_at IS NULL
+                OR (
+                  refreshed_at < $1
+                  AND (
+                    refreshed_at < $2
+                    OR observation_valid_until IS NULL
+                    OR observation_valid_until < $3
+                  )
+                )
+              )
+            ORDER BY refreshed_at NULLS FIRST, id
+            LIMIT $4
+            """,
+            pass_started,
+            pass_started - _refresh_interval(),
+            pass_started + _lead_time(),
+            limit,
+            list(failed),
+        )
+    return [dict(row) for row in rows]
+
+
+async def refresh_fields(fields: List[Dict]) -> Tuple[int, List[str]]:
+    """Detect and predict bloom for `fields`, then mark them refreshed.
+
+    Returns how many fields got a detection and the ids of fields whose
+    detection failed. Those are left unmarked, so the next pass retries
+    them instead of skipping them for a whole refresh interval.
+    """
+    points: Dict[Tuple[float, float], List[str]] = {}
+    for field in fields:
+        key = (
+            round(field["latitude"], COORDINATE_DECIMALS),
+            round(field["longitude"], COORDINATE_DECIMALS),
+        )
+        points.setdefault(key, []).append(field["id"])
+    keys = list(points)
+
+    now = datetime.now(timezone.utc)
+    # None for fields with no imagery, refreshed but without a detection
+    valid_until: Dict[str, Optional[datetime]] = {}
+    failed: List[str] = []
+    async for result in detect_bloom_many([Region(lat, lon) for lat, lon in keys]):
+        field_ids = points[keys[result["index"]]]
+        if result["error"] == BATCH_FAILED_ERROR:
+            failed.extend(field_ids)
+            continue
+        expires = None
+        if result["error"] is None:
+            expires = detection_valid_until(result["imagery_date"], now)
+        for field_id in field_ids:
+            valid_until[field_id] = expires
+
+    await predict_bloom_many(keys, store=True)
+
+    field_ids = list(valid_until)
+    if field_ids:
+        async with async_conn("field_scheduler.mark_refreshed") as conn:
+            await conn.execute(
+                """
+                UPDATE monitored_fields f
+                SET refreshed_at = $3, observation_valid_until = r.valid_until
+                FROM unnest($1::text[], $2::timestamptz[]) AS r(id, valid_until)
+                WHERE f.id = r.id
+                """,
+                field_ids,
+                [valid_until[field_id] for field_id in field_ids],
+                now,
+            )
+    detected = sum(expires is not None for expires in valid_until.values())
+    return detected, failed
+
+
+async def run_pass(stopping: asyncio.Event) -> int:
+    """Refresh every due field in batches. Returns the number of fields
+    processed, 0 if another scheduler holds the lock."""
+    lock_timeout = float(os.environ.get("MUNDI_FIELD_LOCK_SECONDS", "900"))
+    lock = get_redis().lock(LOCK_NAME, timeout=lock_timeout)
+    if not await lock.acquire(blocking=False):
+        logger.info("Another field scheduler is running, skipping this pass")
+        return 0
+
+    pass_started = datetime.now(timezone.utc)
+    processed = 0
+    # retried next pass, not again in this one
+    failed: List[str] = []
+    try:
+        while not stopping.is_set():
+            fields = await _due_fields(pass_started, _batch_size(), failed)
+            if not fields:
+                break
+            detected, batch_failed = await refresh_fields(fields)
+            failed.extend(batch_failed)
+            processed += len(fields)
+            logger.info(
+                f"Refreshed {len(fields)} monitored fields, {detected} with a "
+                f"detection, {len(batch_failed)} failed"
+            )
+            # a batch can take a while, keep the lock for the next one
+            await lock.reacquire()
+    finally:
+        await lock.release()
+    return processed
+
+
+async def run_scheduler(once: bool):
+    stopping = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        # finish the batch in flight, start nothing new
+        loop.add_signal_handler(sig, stopping.set)
+
+    await get_earth_engine().start()
+    try:
+        if once:
+            await run_pass(stopping)
+            return
+        while not stopping.is_set():
+            window = refresh_window()
+            now = datetime.now(timezone.utc)
+            if in_window(now.hour, window):
+                try:
+                    await run_pass(stopping)
+                except Exception:
+                    logger.exception("Monitored field refresh failed")
+            # one pass per window
+            wait = seconds_until_next_opening(datetime.now(timezone.utc), window)
+            try:
+                await asyncio.wait_for(stopping.wait(), timeout=wait)
+            except asyncio.TimeoutError:
+                pass
+    finally:
+        get_earth_engine().close()
+        await close_redis()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--once", action="store_true", help="run one pass now and exit")
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(run_scheduler(parser.parse_args().once))
@@ -19,7 +19,8 @@ from collections import OrderedDict
 import asyncio
 from contextlib import asynccontextmanager
 from src.structures import get_async_db_connection
-from src.utils import get_async_s3_client, get_bucket_name
+from src.utils import get_bucket_name
+from src import s3_transfer
 
 
 class FileCache:
@@ -181,8 +182,9 @@ class LayerCache:
                         temp_dir, f"{layer_id}_input{file_extension}"
                     )
 
-                    s3 = await get_async_s3_client()
-                    await s3.download_file(bucket_name, s3_key, local_input_file)
+                    await s3_transfer.download_file(
+                        bucket_name, s3_key, local_input_file
+                    )
 
                     cached_output_gpkg = os.path.join(temp_dir, f"{layer_id}.gpkg")
 
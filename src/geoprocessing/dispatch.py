@@ -15,6 +15,7 @@
 
 import os
 import json
+from functools import lru_cache
 
 
 class UnsupportedAlgorithmError(Exception):
@@ -25,6 +26,17 @@ class InvalidInputFormatError(Exception):
     pass
 
 
-def get_tools():
+@lru_cache(maxsize=1)
+def _read_tools_json() -> str:
     with open(os.path.join(os.path.dirname(__file__), "tools.json"), "r") as f:
-        return json.load(f)
+        return f.read()
+
+
+def get_tools():
+    # parsed per call so callers are free to mutate the result
+    return json.loads(_read_tools_json())
+
+
+@lru_cache(maxsize=1)
+def geoprocessing_tool_names() -> frozenset[str]:
+    return frozenset(tool["function"]["name"] for tool in get_tools())
@@ -0,0 +1,120 @@
+# Copyright (C) 2025 Bunting Labs, Inc.
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import hashlib
+import json
+import time
+from collections import OrderedDict
+from typing import Optional
+
+
+# One query computes a digest over every column that feeds into the style, so
+# any change to the map's layer list, basemap, layer rows or map_layer_styles
+# (styles themselves are immutable, a new style_id is written each time)
+# produces a new fingerprint and the cached style is rebuilt.
+MAP_STYLE_FINGERPRINT_SQL = """
+    SELECT m.layers, m.basemap,
+        md5(
+            format('%s;%s;', array_to_string(m.layers, ','), m.basemap) ||
+            COALESCE((
+                SELECT string_agg(
+                    format(
+                        '%s|%s|%s|%s|%s|%s|%s',
+                        ml.layer_id,
+                        ml.type,
+                        ml.geometry_type,
+                        ml.remote_url,
+                        array_to_string(ml.bounds, ','),
+                        md5(ml.metadata::text),
+                        mls.style_id
+                    ),
+                    ',' ORDER BY ml.id
+                )
+                FROM map_layers ml
+                LEFT JOIN map_layer_styles mls
+                    ON mls.layer_id = ml.layer_id AND mls.map_id = m.id
+                WHERE ml.layer_id = ANY(m.layers)
+            ), '')
+        ) AS style_fingerprint
+    FROM user_mundiai_maps m
+    WHERE m.id = $1 AND m.soft_deleted_at IS NULL
+"""
+
+
+class CachedMapStyle:
+    def __init__(self, fingerprint: str, body: bytes, expires_at: float):
+        self.fingerprint = fingerprint
+        self.body = body
+        self.etag = f'"{hashlib.sha256(body).hexdigest()[:32]}"'
+        self.expires_at = expires_at
+
+    def style_json(self) -> dict:
+        # decoding doubles as a deep copy, callers are free to mutate the result
+        return json.loads(self.body)
+
+
+class MapStyleCache:
+    """LRU of serialized MapLibre styles keyed by (map_id, basemap, options).
+
+    Entries are only served while their fingerprint matches the one just read
+    from the database, so every worker stays correct without cross-process
+    invalidation.
+    """
+
+    def __init__(self, max_entries: int = 1024, ttl_seconds: float = 3600):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.entries: OrderedDict[tuple, CachedMapStyle] = OrderedDict()
+
+    def get(self, key: tuple, fingerprint: str) -> Optional[CachedMapStyle]:
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        if entry.fingerprint != fingerprint or entry.expires_at <= time.monotonic():
+            del self.entries[key]
+            return None
+        self.entries.move_to_end(key)
+        return entry
+
+    def set(
+        self,
+        key: tuple,
+        fingerprint: str,
+        style_json: dict,
+        ttl_seconds: Optional[float] = None,
+    ) -> CachedMapStyle:
+        body = json.dumps(style_json, separators=(",", ":")).encode("utf-8")
+        ttl = self.ttl_seconds if ttl_seconds is None else ttl_seconds
+        entry = CachedMapStyle(fingerprint, body, time.monotonic() + ttl)
+        self.entries[key] = entry
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+        return entry
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Weak comparison of an If-None-Match header against an entity tag."""
+    if not if_none_match:
+        return False
+    candidates = [c.strip() for c in if_none_match.split(",")]
+    return "*" in candidates or etag in [c.removeprefix("W/") for c in candidates]
+
+
+cache_singleton = MapStyleCache()
+
+
+def map_style_cache() -> MapStyleCache:
+    return cache_singleton
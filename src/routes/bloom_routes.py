@@ -1,9 +1,16 @@
 from fastapi import APIRouter, Depends, HTTPException, status
-from pydantic import BaseModel, Field
-from typing import Optional
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, Field, model_validator
+from typing import Any, Dict, List, Optional
 from datetime import date
 from src.dependencies.session import UserContext, verify_session_required
-from src.services.bloom import detect_bloom, predict_bloom
+from src.services.bloom import (
+    detect_bloom,
+    detect_bloom_many,
+    predict_bloom,
+    predict_bloom_many,
+)
+from src.services.earth_engine import Region, region_from_geojson
 
 
 router = APIRouter()
@@ -32,10 +39,71 @@ async def bloom_detection(
     request: BloomDetectionRequest,
     session: UserContext = Depends(verify_session_required),
 ):
-    # Dummy implementation via service stub
     return await detect_bloom(request.latitude, request.longitude)
 
 
+class BloomBatchLocation(BaseModel):
+    latitude: Optional[float] = Field(None, description="Latitude of a point location")
+    longitude: Optional[float] = Field(
+        None, description="Longitude of a point location"
+    )
+    geometry: Optional[Dict[str, Any]] = Field(
+        None, description="GeoJSON Polygon or MultiPolygon of an orchard block"
+    )
+
+    @model_validator(mode="after")
+    def point_or_geometry(self):
+        if self.geometry is None and (self.latitude is None or self.longitude is None):
+            raise ValueError(
+                "Each location needs latitude and longitude, or a geometry"
+            )
+        return self
+
+
+class BloomBatchDetectionRequest(BaseModel):
+    locations: List[BloomBatchLocation] = Field(..., min_length=1, max_length=5000)
+
+
+class BloomBatchDetectionResult(BaseModel):
+    index: int
+    latitude: float
+    longitude: float
+    season: Optional[int] = None
+    imagery_date: Optional[date] = None
+    date_of_max_ebi: Optional[date] = None
+    ebi_value: Optional[float] = None
+    mean_ebi: Optional[float] = None
+    image_count: int = 0
+    error: Optional[str] = None
+
+
+@router.post("/bloom-detection/batch")
+async def bloom_detection_batch(
+    request: BloomBatchDetectionRequest,
+    session: UserContext = Depends(verify_session_required),
+):
+    """Streams one BloomBatchDetectionResult per location as newline delimited
+    JSON, in completion order. `index` refers to the request's locations."""
+    regions = []
+    for i, location in enumerate(request.locations):
+        if location.geometry is None:
+            regions.append(Region(location.latitude, location.longitude))
+            continue
+        try:
+            regions.append(region_from_geojson(location.geometry))
+        except (ValueError, KeyError, IndexError, TypeError) as e:
+            raise HTTPException(
+                status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                detail=f"Invalid geometry for location {i}: {e}",
+            )
+
+    async def stream_results():
+        async for result in detect_bloom_many(regions):
+            yield BloomBatchDetectionResult(**result).model_dump_json() + "\n"
+
+    return StreamingResponse(stream_results(), media_type="application/x-ndjson")
+
+
 # ------------------------
 # BLOOM PREDICTION (future events)
 # ------------------------
@@ -59,5 +127,20 @@ async def bloom_prediction(
     request: BloomPredictionRequest,
     session: UserContext = Depends(verify_session_required),
 ):
-    # Dummy implementation via service stub
     return await predict_bloom(request.latitude, request.longitude)
+
+
+class BloomBatchPredictionRequest(BaseModel):
+    locations: List[BloomPredictionRequest] = Field(..., min_length=1, max_length=50000)
+
+
+@router.post("/bloom-prediction/batch", response_model=List[BloomPredictionResponse])
+async def bloom_prediction_batch(
+    request: BloomBatchPredictionRequest,
+    session: UserContext = Depends(verify_session_required),
+):
+    """Predictions for every location in request order, computed in one
+    vectorized pass."""
+    return await predict_bloom_many(
+        [(location.latitude, location.longitude) for location in request.locations]
+    )
@@ -36,7 +36,7 @@ from src.dependencies.session import (
 )
 import logging
 import re
-from redis import Redis
+from src.dependencies.redis_pool import get_redis
 import tempfile
 import asyncio
 import io
@@ -47,6 +47,7 @@ from rio_tiler.colormap import cmap
 from src.utils import (
     get_bucket_name,
     get_async_s3_client,
+    get_presigned_get_url,
 )
 import subprocess
 from src.structures import get_async_db_connection, async_conn
@@ -55,9 +56,7 @@ from src.dependencies.layer_describer import LayerDescriber, get_layer_describer
 from opentelemetry import trace
 from src.dependencies.base_map import get_base_map_provider
 from src.utils import generate_id
-from boto3.s3.transfer import TransferConfig
-
-one_shot_config = TransferConfig(multipart_threshold=5 * 1024**3)  # 5 GiB
+from src import s3_transfer
 
 # Global semaphore to limit concurrent social image renderings
 # This prevents OOM issues when many maps load simultaneously
@@ -66,14 +65,140 @@ SOCIAL_RENDER_SEMAPHORE = asyncio.Semaphore(2)  # Max 2 concurrent renders
 logger = logging.getLogger(__name__)
 tracer = trace.get_tracer(__name__)
 
-redis = Redis(
-    host=os.environ["REDIS_HOST"],
-    port=int(os.environ["REDIS_PORT"]),
-    decode_responses=True,
-)
+layer_router = APIRouter()
 
 
-layer_router = APIRouter()
+async def run_cmd(cmd: list[str], timeout_seconds: int = 30) -> str:
+    proc = await asyncio.create_subprocess_exec(
+        *cmd,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+    )
+    try:
+        stdout_bytes, stderr_bytes = await asyncio.wait_for(
+            proc.communicate(), timeout=timeout_seconds
+        )
+    except asyncio.TimeoutError:
+        try:
+            proc.kill()
+        except Exception:
+            pass
+        raise HTTPException(
+            status_code=status.HTTP_504_GATEWAY_TIMEOUT,
+            detail=f"Command timed out after {timeout_seconds}s: {' '.join(cmd)}",
+        )
+    if (proc.returncode or 0) != 0:
+        stderr_text = (stderr_bytes or b"").decode("utf-8", "ignore")
+        raise subprocess.CalledProcessError(
+            returncode=int(proc.returncode or 1),
+            cmd=cmd,
+            output=stdout_bytes,
+            stderr=stderr_text,
+        )
+    return (stdout_bytes or b"").decode("utf-8", "ignore")
+
+
+def cog_timeout_seconds(local_input_file: str) -> float:
+    """How long the GDAL steps of create_cog may take for a file, 30 s plus
+    MUNDI_COG_SECONDS_PER_MB per MB of input, up to the 600 s the lazy
+    conversion holds its lock for."""
+    per_mb = float(os.environ.get("MUNDI_COG_SECONDS_PER_MB", "1"))
+    size_mb = os.path.getsize(local_input_file) / 2**20
+    return min(30 + per_mb * size_mb, 600)
+
+
+async def create_cog(
+    local_input_file: str, local_cog_file: str, layer_id: str, metadata: dict
+):
+    """Convert a raster to a web mercator COG for viewing.
+
+    Single band rasters with a color table are expanded to RGB, others keep
+    their values as Float32 so they can be styled with a color ramp, which
+    needs raster_value_stats_b1 in the layer `metadata`. Intermediate files
+    are written next to `local_cog_file`.
+    """
+    temp_dir = os.path.dirname(local_cog_file)
+    timeout_seconds = cog_timeout_seconds(local_input_file)
+    gdalinfo_cmd = ["gdalinfo", "-json", local_input_file]
+    try:
+        gdalinfo_out = await run_cmd(gdalinfo_cmd, timeout_seconds=30)
+        gdalinfo_json = json.loads(gdalinfo_out)
+    except (subprocess.CalledProcessError, json.JSONDecodeError):
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Failed to process raster info for layer {layer_id}.",
+        )
+
+    # Default input for downstream steps
+    input_file_for_cog = local_input_file
+
+    # Get band count from the original gdalinfo output
+    num_bands = len(gdalinfo_json.get("bands", []))
+    needs_color_ramp_suffix = False
+
+    if num_bands == 1:
+        try:
+            # Try expanding to RGB first
+            local_rgb_file = os.path.join(temp_dir, f"layer_{layer_id}_rgb.tif")
+            rgb_cmd = [
+                "gdal_translate",
+                "-of",
+                "GTiff",
+                "-expand",
+                "rgb",
+                local_input_file,
+                local_rgb_file,
+            ]
+            await run_cmd(rgb_cmd, timeout_seconds=timeout_seconds)
+            input_file_for_cog = local_rgb_file
+        except subprocess.CalledProcessError:
+            # Use the existing raster_value_stats_b1 from metadata
+            if "raster_value_stats_b1" in metadata:
+                needs_color_ramp_suffix = True
+            # Keep input_file_for_cog as the original single-band file
+
+    # Combine reprojection and COG creation in a single gdalwarp call
+    # gdalwarp will reproject to EPSG:3857 and write COG directly
+    warp_cmd_base = [
+        "gdalwarp",
+        "-t_srs",
+        "EPSG:3857",
+        "-r",
+        "bilinear",
+        "-of",
+        "COG",
+        "-co",
+        "BLOCKSIZE=256",
+    ]
+    if needs_color_ramp_suffix:
+        warp_cmd_base.extend(["-ot", "Float32"])
+        warp_compress = ["-co", "COMPRESS=LZW"]
+    else:
+        warp_compress = [
+            "-co",
+            "COMPRESS=JPEG",
+            "-co",
+            "QUALITY=85",
+        ]
+
+    warp_cmd = (
+        warp_cmd_base
+        + warp_compress
+        + [
+            "-co",
+            "OVERVIEWS=AUTO",
+            input_file_for_cog,
+            local_cog_file,
+        ]
+    )
+
+    try:
+        await run_cmd(warp_cmd, timeout_seconds=timeout_seconds)
+    except subprocess.CalledProcessError:
+        raise HTTPException(
+            status_code=500,
+            detail="COG generation failed",
+        )
 
 
 @layer_router.get(
@@ -105,8 +230,8 @@ async def get_layer_cog_tif(
 
         if not cog_key:
             lock_key = f"lock:cog:{layer.layer_id}"
-            lock = redis.lock(lock_key, timeout=600, blocking_timeout=30)
-            acquired = lock.acquire(blocking=True)
+            lock = get_redis().lock(lock_key, timeout=600, blocking_timeout=30)
+            acquired = await lock.acquire(blocking=True)
             if not acquired:
                 raise HTTPException(
                     status_code=423,
@@ -132,142 +257,26 @@ async def get_layer_cog_tif(
                             temp_dir, f"layer_{layer.layer_id}{file_extension}"
                         )
 
-                        # Download from S3 using async client
-                        s3 = await get_async_s3_client()
-                        await s3.download_file(bucket_name, s3_key, local_input_file)
+                        # Download from S3 with parallel ranged reads
+                        await s3_transfer.download_file(
+                            bucket_name, s3_key, local_input_file
+                        )
                         # Create COG file path
                         local_cog_file = os.path.join(
                             temp_dir, f"layer_{layer.layer_id}.cog.tif"
                         )
 
-                        # Helper to run commands asynchronously with timeout
-                        async def run_cmd(
-                            cmd: list[str], timeout_seconds: int = 30
-                        ) -> str:
-                            proc = await asyncio.create_subprocess_exec(
-                                *cmd,
-                                stdout=asyncio.subprocess.PIPE,
-                                stderr=asyncio.subprocess.PIPE,
-                            )
-                            try:
-                                stdout_bytes, stderr_bytes = await asyncio.wait_for(
-                                    proc.communicate(), timeout=timeout_seconds
-                                )
-                            except asyncio.TimeoutError:
-                                try:
-                                    proc.kill()
-                                except Exception:
-                                    pass
-                                raise HTTPException(
-                                    status_code=status.HTTP_504_GATEWAY_TIMEOUT,
-                                    detail=f"Command timed out after {timeout_seconds}s: {' '.join(cmd)}",
-                                )
-                            if (proc.returncode or 0) != 0:
-                                stderr_text = (stderr_bytes or b"").decode(
-                                    "utf-8", "ignore"
-                                )
-                                raise subprocess.CalledProcessError(
-                                    returncode=int(proc.returncode or 1),
-                                    cmd=cmd,
-                                    output=stdout_bytes,
-                                    stderr=stderr_text,
-                                )
-                            return (stdout_bytes or b"").decode("utf-8", "ignore")
-
-                        gdalinfo_cmd = ["gdalinfo", "-json", local_input_file]
-                        try:
-                            gdalinfo_out = await run_cmd(
-                                gdalinfo_cmd, timeout_seconds=30
-                            )
-                            gdalinfo_json = json.loads(gdalinfo_out)
-                        except (subprocess.CalledProcessError, json.JSONDecodeError):
-                            raise HTTPException(
-                                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                                detail=f"Failed to process raster info for layer {layer.layer_id}.",
-                            )
-
-                        # Default input for downstream steps
-                        input_file_for_cog = local_input_file
-
-                        # Get band count from the original gdalinfo output
-                        num_bands = len(gdalinfo_json.get("bands", []))
-                        needs_color_ramp_suffix = False
-
-                        if num_bands == 1:
-                            try:
-                                # Try expanding to RGB first
-                                local_rgb_file = os.path.join(
-                                    temp_dir, f"layer_{layer.layer_id}_rgb.tif"
-                                )
-                                rgb_cmd = [
-                                    "gdal_translate",
-                                    "-of",
-                                    "GTiff",
-                                    "-expand",
-                                    "rgb",
-                                    local_input_file,
-                                    local_rgb_file,
-                                ]
-                                await run_cmd(rgb_cmd)
-                                input_file_for_cog = local_rgb_file
-                            except subprocess.CalledProcessError:
-                                # Use the existing raster_value_stats_b1 from metadata
-                                meta = layer.metadata_dict or {}
-                                if (
-                                    isinstance(meta, dict)
-                                    and "raster_value_stats_b1" in meta
-                                ):
-                                    needs_color_ramp_suffix = True
-                                # Keep input_file_for_cog as the original single-band file
-
-                        # Combine reprojection and COG creation in a single gdalwarp call
-                        # gdalwarp will reproject to EPSG:3857 and write COG directly
-                        warp_cmd_base = [
-                            "gdalwarp",
-                            "-t_srs",
-                            "EPSG:3857",
-                            "-r",
-                            "bilinear",
-                            "-of",
-                            "COG",
-                            "-co",
-                            "BLOCKSIZE=256",
-                        ]
-                        if needs_color_ramp_suffix:
-                            warp_cmd_base.extend(["-ot", "Float32"])
-                            warp_compress = ["-co", "COMPRESS=LZW"]
-                        else:
-                            warp_compress = [
-                                "-co",
-                                "COMPRESS=JPEG",
-                                "-co",
-                                "QUALITY=85",
-                            ]
-
-                        warp_cmd = (
-                            warp_cmd_base
-                            + warp_compress
-                            + [
-                                "-co",
-                                "OVERVIEWS=AUTO",
-                                input_file_for_cog,
-                                local_cog_file,
-                            ]
+                        await create_cog(
+                            local_input_file,
+                            local_cog_file,
+                            layer.layer_id,
+                            layer.metadata_dict or {},
                         )
 
-                        try:
-                            await run_cmd(warp_cmd)
-                        except subprocess.CalledProcessError:
-                            raise HTTPException(
-                                status_code=500,
-                                detail="COG generation failed",
-                            )
-
                         # Upload the COG file to S3
                         cog_key = f"cog/layer/{layer.layer_id}.cog.tif"
-                        s3 = await get_async_s3_client()
-                        await s3.upload_file(
-                            local_cog_file, bucket_name, cog_key, Config=one_shot_config
+                        await s3_transfer.upload_file(
+                            local_cog_file, bucket_name, cog_key
                         )
 
                         # Update the layer metadata with the COG key
@@ -288,7 +297,7 @@ async def get_layer_cog_tif(
                         )
             finally:
                 try:
-                    lock.release()
+                    await lock.release()
                 except Exception:
                     pass
 
@@ -596,12 +605,9 @@ async def get_raster_xyz_tile(
     metadata = layer.metadata_dict or {}
     s3_key = metadata.get("cog_key") or layer.s3_key
 
-    bucket = get_bucket_name()
-    s3 = await get_async_s3_client(signature_version="s3v4")
-    asset_url = await s3.generate_presigned_url(
-        "get_object",
-        Params={"Bucket": bucket, "Key": s3_key},
-        ExpiresIn=180,  # 3 minutes
+    # a stable URL per key lets GDAL's VSI cache reuse reads across tiles
+    asset_url = await get_presigned_get_url(
+        get_bucket_name(), s3_key, signature_version="s3v4"
     )
 
     try:
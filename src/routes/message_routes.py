@@ -15,7 +15,7 @@
 
 from fastapi import APIRouter, HTTPException, status, Request, Depends
 from fastapi.responses import JSONResponse
-from typing import List, Union
+from typing import List, Optional, Union
 from collections import defaultdict
 from pydantic import BaseModel
 import logging
@@ -27,12 +27,18 @@ from opentelemetry import trace
 import io
 import csv
 import asyncio
+import contextlib
+import copy
 import traceback
-from src.dependencies.dag import get_map
+import tempfile
+import time
+import uuid
+from src.dependencies.dag import forked_map, get_map
+from src.dag import ForkReason
 from fastapi import UploadFile
 import httpx
 from typing import Callable
-from redis import Redis
+from src.dependencies.redis_pool import get_redis
 from openai.types.chat.chat_completion_message import ChatCompletionMessage
 from openai.types.chat.chat_completion_tool_message_param import (
     ChatCompletionToolMessageParam,
@@ -62,22 +68,35 @@ from src.structures import (
 )
 from src.utils import get_openai_client
 from src.routes.postgres_routes import (
+    add_remote_layer,
     generate_id,
     get_map_description,
     internal_upload_layer,
     InternalLayerUploadResponse,
+    RemoteLayerRequest,
 )
 from src.geoprocessing.dispatch import (
     UnsupportedAlgorithmError,
     InvalidInputFormatError,
     get_tools,
 )
-from src.dependencies.conversation import get_or_create_conversation
+from src.dependencies.conversation import get_conversation, get_or_create_conversation
 from src.duckdb import execute_duckdb_query
 from src.utils import get_async_s3_client, get_bucket_name
+from src import s3_transfer
 from src.dependencies.postgis import get_postgis_provider
 from src.dependencies.layer_describer import LayerDescriber, get_layer_describer
 from src.dependencies.chat_completions import ChatArgsProvider, get_chat_args_provider
+from src.dependencies.geocoder import get_geocoder
+from src.services.bloom import bloom_observation, bloom_study
+from src.services.phenology import PREDICTION_BASIS
+from src.services.pest import detect_pest
+from src.dependencies.chat_history import (
+    ChatHistoryCompactor,
+    estimate_tokens,
+    get_chat_history_compactor,
+)
+
 
 # Ensure tool results with dates/decimals serialize cleanly for tool messages
 def _json_default(o):
@@ -91,8 +110,11 @@ def _json_default(o):
     # Fallback to string for any non-serializable types (e.g., Decimal)
     return str(o)
 
+
 def json_dumps_safe(obj) -> str:
     return json.dumps(obj, default=_json_default)
+
+
 from src.dependencies.map_state import (
     MapStateProvider,
     get_map_state_provider,
@@ -104,6 +126,7 @@ from src.dependencies.system_prompt import (
 )
 from src.dependencies.session import (
     verify_session_required,
+    StaticUserContext,
     UserContext,
 )
 from src.dependencies.postgres_connection import (
@@ -116,54 +139,107 @@ from src.database.models import (
     MapLayer,
     Conversation,
 )
-from src.routes.websocket import kue_ephemeral_action, kue_notify_error
+from src.routes.websocket import (
+    kue_ephemeral_action,
+    kue_notify_error,
+    kue_stream_update,
+)
 from src.tools.pyd import tool_from as tool_from_pyd
 from src.dependencies.pydantic_tools import (
     get_pydantic_tool_calls,
     PydanticToolRegistry,
+    ToolFn,
 )
+from src.tools.registry import (
+    DEFAULT_TOOL_CONCURRENCY,
+    RegisteredTool,
+    ToolHandler,
+    ToolRegistry,
+)
+from src.chat_queue import ChatRun, chat_execution_mode, get_chat_run_queue
 
 logger = logging.getLogger(__name__)
 tracer = trace.get_tracer(__name__)
 
 
-redis = Redis(
-    host=os.environ["REDIS_HOST"],
-    port=int(os.environ["REDIS_PORT"]),
-    decode_responses=True,
-)
+def chat_cancel_channel(map_id: str) -> str:
+    return f"messages:{map_id}:cancel"
+
+
+class ChatCancellations:
+    """Delivers cancel requests to the chats running in this process.
+
+    A single pub/sub connection per process pattern-subscribes to every map's
+    cancel channel, so the chat loop checks a local asyncio.Event instead of
+    making a Redis round trip on every iteration. Cancel requests can arrive
+    on any worker, publishing reaches the one running the chat.
+    """
+
+    def __init__(self):
+        self.events: dict[str, set[asyncio.Event]] = defaultdict(set)
+        self.listener: asyncio.Task | None = None
+        self.subscribe_lock = asyncio.Lock()
+
+    async def _ensure_listening(self):
+        async with self.subscribe_lock:
+            if self.listener is not None and not self.listener.done():
+                return
+            pubsub = get_redis().pubsub(ignore_subscribe_messages=True)
+            # subscribed before returning, so no cancel published after a chat
+            # starts watching can be missed
+            await pubsub.psubscribe(chat_cancel_channel("*"))
+            self.listener = asyncio.create_task(self._listen(pubsub))
+
+    async def _listen(self, pubsub):
+        prefix, suffix = chat_cancel_channel("*").split("*")
+        try:
+            async for message in pubsub.listen():
+                if message["type"] != "pmessage":
+                    continue
+                map_id = message["channel"][len(prefix) : -len(suffix)]
+                for event in self.events.get(map_id, ()):
+                    event.set()
+        except Exception:
+            # the next chat to start re-subscribes
+            logger.exception("Chat cancellation listener stopped")
+        finally:
+            with contextlib.suppress(Exception):
+                await pubsub.aclose()
+
+    @contextlib.asynccontextmanager
+    async def watch(self, map_id: str):
+        event = asyncio.Event()
+        self.events[map_id].add(event)
+        try:
+            await self._ensure_listening()
+            yield event
+        finally:
+            self.events[map_id].discard(event)
+            if not self.events[map_id]:
+                del self.events[map_id]
+
+    async def cancel(self, map_id: str):
+        await get_redis().publish(chat_cancel_channel(map_id), "cancel")
+
+    async def close(self):
+        if self.listener is not None:
+            self.listener.cancel()
+            await asyncio.gather(self.listener, return_exceptions=True)
+            self.listener = None
+
+
+chat_cancellations = ChatCancellations()
 
 
 async def geocode_address(address: str) -> tuple[float, float] | None:
     """Resolve a text address to (latitude, longitude).
 
-    Uses Nominatim by default. Override with GEOCODER_URL and GEOCODER_USER_AGENT.
-    Returns None if not found or on error.
+    Goes through the cached geocoder, see src.dependencies.geocoder for the
+    backends. Returns None if not found or on error.
     """
     if not address or not isinstance(address, str):
         return None
-    try:
-        url = os.environ.get(
-            "GEOCODER_URL", "https://nominatim.openstreetmap.org/search"
-        )
-        headers = {
-            "User-Agent": os.environ.get(
-                "GEOCODER_USER_AGENT", "mundi.ai/1.0 (geocode)"
-            )
-        }
-        params = {"q": address, "format": "jsonv2", "limit": 1}
-        async with httpx.AsyncClient(timeout=10.0) as client:
-            resp = await client.get(url, params=params, headers=headers)
-        if resp.status_code != 200:
-            return None
-        data = resp.json()
-        if not data:
-            return None
-        lat = float(data[0]["lat"])  # type: ignore[index]
-        lon = float(data[0]["lon"])  # type: ignore[index]
-        return (lat, lon)
-    except Exception:
-        return None
+    return await get_geocoder().geocode(address)
 
 
 async def label_conversation_inline(conversation_id: int):
@@ -492,9 +568,38 @@ def check_postgis_readonly(plan: dict):
         check_postgis_readonly(child)
 
 
+class ToolCallContext:
+    """Everything a tool handler needs to know about the chat it runs in."""
+
+    def __init__(
+        self,
+        request: Request,
+        conn,
+        map_id: str,
+        project_id: str,
+        user_id: str,
+        conversation_id: int,
+        session: UserContext,
+        connection_manager: PostgresConnectionManager,
+    ):
+        self.request = request
+        self.conn = conn
+        self.map_id = map_id
+        self.project_id = project_id
+        self.user_id = user_id
+        self.conversation_id = conversation_id
+        self.session = session
+        self.connection_manager = connection_manager
+
+    def with_conn(self, conn) -> "ToolCallContext":
+        ctx = copy.copy(self)
+        ctx.conn = conn
+        return ctx
+
+
 async def run_geoprocessing_tool(
-    tool_call: ChatCompletionToolMessageParam,
-    conn,
+    tool_call: ChatCompletionMessageToolCall,
+    tool_def: dict,
     user_id: str,
     map_id: str,
     conversation_id: int,
@@ -502,13 +607,6 @@ async def run_geoprocessing_tool(
     function_name = tool_call.function.name
     tool_args = json.loads(tool_call.function.arguments)
 
-    all_tools = get_tools()
-    for tool in all_tools:
-        if function_name == tool["function"]["name"]:
-            tool_def = tool
-            break
-    assert tool_def is not None
-
     algorithm_id = tool_def["function"]["name"].replace("_", ":")
 
     mapped_args = tool_args.copy()
@@ -653,29 +751,30 @@ async def run_geoprocessing_tool(
                 created_layers = []
 
                 for param_name, layer_info in output_layer_mappings.items():
-                    # Download the output file from S3
-                    downloaded_file = await s3_client.get_object(
-                        Bucket=bucket_name, Key=layer_info["s3_key"]
-                    )
-                    file_content = await downloaded_file["Body"].read()
-
-                    # Create an UploadFile-like object
                     filename = f"{layer_info['layer_id']}{layer_info['file_extension']}"
-                    upload_file = UploadFile(
-                        filename=filename,
-                        file=io.BytesIO(file_content),
-                    )
-
-                    upload_result: InternalLayerUploadResponse = (
-                        await internal_upload_layer(
-                            map_id=map_id,
-                            file=upload_file,
-                            layer_name=filename,
-                            add_layer_to_map=False,
-                            user_id=user_id,
-                            project_id=project_id,
+                    with tempfile.TemporaryDirectory() as temp_dir:
+                        # Download the output file from S3 to disk, not memory
+                        local_output_path = os.path.join(temp_dir, filename)
+                        await s3_transfer.download_file(
+                            bucket_name, layer_info["s3_key"], local_output_path
                         )
-                    )
+
+                        with open(local_output_path, "rb") as output_file:
+                            upload_file = UploadFile(
+                                filename=filename,
+                                file=output_file,
+                            )
+
+                            upload_result: InternalLayerUploadResponse = (
+                                await internal_upload_layer(
+                                    map_id=map_id,
+                                    file=upload_file,
+                                    layer_name=filename,
+                                    add_layer_to_map=False,
+                                    user_id=user_id,
+                                    project_id=project_id,
+                                )
+                            )
 
                     created_layers.append(
                         {
@@ -727,1454 +826,1482 @@ async def run_geoprocessing_tool(
             }
 
 
-async def process_chat_interaction_task(
-    request: Request,  # Keep request for get_map_messages
-    map_id: str,
-    session: UserContext,  # Pass session for auth
-    user_id: str,  # Pass user_id directly
-    chat_args: ChatArgsProvider,
-    map_state: MapStateProvider,
-    conversation: Conversation,
-    system_prompt_provider: SystemPromptProvider,
-    connection_manager: PostgresConnectionManager,
-    pydantic_tool_calls: PydanticToolRegistry,
-):
-    # kick it off with a quick sleep, to detach from the event loop blocking /send
-    await asyncio.sleep(0.1)
+class ConversationState:
+    """In-memory view of a conversation for the lifetime of one chat task.
 
-    async with async_conn("process_chat_interaction_task") as conn:
+    messages mirrors chat_completion_messages for the conversation, and
+    map_changed marks that the unattached layers and tool payload are stale.
+    """
 
-        async def add_chat_completion_message(
-            message: Union[ChatCompletionMessage, ChatCompletionMessageParam],
-        ):
-            message_dict = (
-                message.model_dump() if isinstance(message, BaseModel) else message
-            )
+    def __init__(self, messages: List[dict]):
+        self.messages = messages
+        self.map_changed = True
 
-            await conn.execute(
-                """
-                INSERT INTO chat_completion_messages
-                (map_id, sender_id, message_json, conversation_id)
-                VALUES ($1, $2, $3, $4)
-                """,
-                map_id,
-                user_id,
-                json.dumps(message_dict),
-                conversation.id,
-            )
 
-        with tracer.start_as_current_span("app.process_chat_interaction") as span:
-            for i in range(25):
-                # Check if the message processing has been cancelled
-                if redis.get(f"messages:{map_id}:cancelled"):
-                    redis.delete(f"messages:{map_id}:cancelled")
-                    break
+async def fetch_unattached_layer_enum(conn, user_id: str) -> dict[str, str]:
+    unattached_layers = await conn.fetch(
+        """
+        SELECT ml.layer_id, ml.created_on, ml.last_edited, ml.type, ml.name
+        FROM map_layers ml
+        WHERE ml.owner_uuid = $1
+        AND NOT EXISTS (
+            SELECT 1 FROM user_mundiai_maps m
+            WHERE ml.layer_id = ANY(m.layers) AND m.owner_uuid = $2
+        )
+        ORDER BY ml.created_on DESC
+        LIMIT 10
+        """,
+        user_id,
+        user_id,
+    )
 
-                # Refresh messages to include any new system messages we just added
-                with tracer.start_as_current_span("kue.fetch_messages"):
-                    updated_messages_response = await get_all_conversation_messages(
-                        conversation.id, session
-                    )
+    layer_enum = {}
+    for layer in unattached_layers:
+        layer_name = layer.get("name") or f"Unnamed Layer ({layer['layer_id'][:8]})"
+        layer_enum[layer["layer_id"]] = (
+            f"{layer_name} (type: {layer.get('type', 'unknown')}, created: {layer['created_on']})"
+        )
+    return layer_enum
 
-                openai_messages = [
-                    msg.message_json for msg in updated_messages_response
-                ]
 
-                with tracer.start_as_current_span("kue.fetch_unattached_layers"):
-                    unattached_layers = await conn.fetch(
-                        """
-                        SELECT ml.layer_id, ml.created_on, ml.last_edited, ml.type, ml.name
-                        FROM map_layers ml
-                        WHERE ml.owner_uuid = $1
-                        AND NOT EXISTS (
-                            SELECT 1 FROM user_mundiai_maps m
-                            WHERE ml.layer_id = ANY(m.layers) AND m.owner_uuid = $2
+async def run_bloom_study_tool(
+    ctx: ToolCallContext,
+    tool_call: ChatCompletionMessageToolCall,
+    tool_args: dict,
+) -> dict:
+    address = tool_args.get("address")
+
+    async with kue_ephemeral_action(
+        ctx.conversation_id,
+        "Analyzing bloom events...",
+    ):
+        if not address or not isinstance(address, str) or not address.strip():
+            return {
+                "status": "error",
+                "error": "Missing or invalid 'address'. Provide a non-empty text address.",
+            }
+        cleaned_address = address.strip()
+
+        coords = await geocode_address(address)
+        if not coords:
+            return {
+                "status": "error",
+                "error": "Could not geocode address to coordinates",
+            }
+        latitude, longitude = coords
+
+        try:
+            study = await bloom_study(latitude, longitude)
+        except Exception as e:
+            return {
+                "status": "error",
+                "error": f"Failed to load bloom data: {str(e)}",
+            }
+        prediction = (
+            {
+                "prediction_bloom_start": study["prediction"]["predicted_bloom_start"],
+                "prediction_bloom_peak": study["prediction"]["predicted_bloom_peak"],
+                "confidence": study["prediction"]["confidence"],
+                "basis": PREDICTION_BASIS,
+            }
+            if study["prediction"]
+            else None
+        )
+        observation = (
+            {
+                "date_of_max_ebi": study["observation"]["date_of_max_ebi"],
+                "ebi_value": study["observation"]["ebi_value"],
+                "image_url": study["observation"]["image_url"],
+            }
+            if study["observation"]
+            else None
+        )
+
+        # If we have a georeferenced image URL, add it as a raster layer to the map
+        layer_add_result = None
+        ebi_url = observation["image_url"] if observation else None
+        if ebi_url and isinstance(ebi_url, str) and ebi_url.startswith("http"):
+            layer_name = "Bloom EBI"
+            if observation.get("date_of_max_ebi"):
+                layer_name = f"Bloom EBI {observation['date_of_max_ebi']}"
+
+            # Add as a remote layer on a fork so the DAG is preserved
+            try:
+                async with kue_ephemeral_action(
+                    ctx.conversation_id,
+                    "Adding bloom raster layer to map...",
+                    update_style_json=True,
+                ):
+                    layer_add_result = (
+                        await add_remote_layer(
+                            original_map_id=ctx.map_id,
+                            request=RemoteLayerRequest(
+                                url=ebi_url,
+                                name=layer_name,
+                                source_type="raster",
+                                add_layer_to_map=True,
+                            ),
+                            forked_map=await forked_map(
+                                ctx.map_id, ctx.session, ForkReason.AI_EDIT
+                            ),
+                            session=ctx.session,
                         )
-                        ORDER BY ml.created_on DESC
-                        LIMIT 10
-                        """,
-                        user_id,
-                        user_id,
-                    )
+                    ).model_dump()
+            except Exception as e:
+                print(f"Exception while adding bloom layer: {e}")
+
+        return {
+            "status": "success",
+            "address": cleaned_address,
+            "latitude": latitude,
+            "longitude": longitude,
+            "prediction": prediction,
+            "observation": observation,
+            # Surface layer addition details for the frontend to optionally switch maps
+            **(
+                {
+                    "layer_upload": layer_add_result,
+                    "dag_child_map_id": layer_add_result.get("dag_child_map_id"),
+                    "dag_parent_map_id": layer_add_result.get("dag_parent_map_id"),
+                }
+                if layer_add_result
+                else {}
+            ),
+            "message": (
+                "No recent prediction or observation found for these coordinates"
+                if not prediction and not observation
+                else "Retrieved latest prediction and/or observation"
+            ),
+        }
 
-                layer_enum = {}
-                for layer in unattached_layers:
-                    layer_name = (
-                        layer.get("name") or f"Unnamed Layer ({layer['layer_id'][:8]})"
-                    )
-                    layer_enum[layer["layer_id"]] = (
-                        f"{layer_name} (type: {layer.get('type', 'unknown')}, created: {layer['created_on']})"
-                    )
 
-                client = get_openai_client(request)
+async def run_pest_detection_tool(
+    ctx: ToolCallContext,
+    tool_call: ChatCompletionMessageToolCall,
+    tool_args: dict,
+) -> dict:
+    address = tool_args.get("address")
 
-                tools_payload = [
-                    {
-                        "type": "function",
-                        "function": {
-                            "name": "new_layer_from_postgis",
-                            "description": "Creates a new layer, given a PostGIS connection and query, and adds it to the map so the user can see it. Layer will automatically pull data from PostGIS. Modify style using the set_layer_style tool.",
-                            "strict": True,
-                            "parameters": {
-                                "type": "object",
-                                "properties": {
-                                    "postgis_connection_id": {
-                                        "type": "string",
-                                        "description": "Unique PostGIS connection ID used as source",
-                                    },
-                                    "query": {
-                                        "type": "string",
-                                        "description": "SQL query to execute against PostGIS database for this layer, should list fetched columns for attributes that might be used for symbology (+ shape geometry). This query MUST alias the geometry column as 'geom' AND have a unique numeric id aliased as 'id'. Include newlines+spaces at ~55 column wrap",
-                                    },
-                                    "layer_name": {
-                                        "type": "string",
-                                        "description": "Sets a human-readable name for this layer. This name will appear in the layer list/legend for the user.",
-                                    },
-                                },
-                                "required": [
-                                    "postgis_connection_id",
-                                    "query",
-                                    "layer_name",
-                                ],
-                                "additionalProperties": False,
-                            },
-                        },
-                    },
-                      {
-                        "type": "function",
-                        "function": {
-                            "name": "bloom_study",
-                            "description": "Analyze the last bloom event and predict the next bloom for almond crops near a given address.",
-                            "strict": True,
-                            "parameters": {
-                                "type": "object",
-                                "properties": {
-                                    "address": {
-                                        "type": "string",
-                                        "description": "Street address or location to analyze (e.g., '123 Main St, City, State').",
-                                    },
-                                },
-                                "required": ["address"],
-                                "additionalProperties": False,
-                            },
-                        },
-                    },
-                    {
-                        "type": "function",
-                        "function": {
-                            "name": "pest_detection",
-                            "description": "Analyze the most recent bloom event and predict the next bloom for almond crops",
-                            "strict": True,
-                            "parameters": {
-                                "type": "object",
-                                "properties": {
-                                    "address": {
-                                        "type": "string",
-                                        "description": "Street address or location to analyze (e.g., '123 Main St, City, State').",
-                                    },
-                                },
-                                "required": ["address"],
-                                "additionalProperties": False,
-                            },
-                        },
-                    },
-                    {
-                        "type": "function",
-                        "function": {
-                            "name": "add_layer_to_map",
-                            "description": "Shows a newly created or existing unattached layer on the user's current map and layer list. Use this after a geoprocessing step that creates a layer, or if the user asks to see an existing layer that isn't currently on their map.",
-                            "parameters": {
-                                "type": "object",
-                                "properties": {
-                                    "layer_id": {
-                                        "type": "string",
-                                        "description": "The ID of the layer to add to the map. Choose from available unattached layers.",
-                                        "enum": list(layer_enum.keys())
-                                        if layer_enum
-                                        else ["NO_UNATTACHED_LAYERS"],
-                                    },
-                                    "new_name": {
-                                        "type": "string",
-                                        "description": "Sets a new human-readable name for this layer. This name will appear in the layer list/legend for the user.",
-                                    },
-                                },
-                                "required": ["layer_id", "new_name"],
-                            },
-                        },
-                    },
-                    {
-                        "type": "function",
-                        "function": {
-                            "name": "set_layer_style",
-                            "description": "Creates a new style for a layer with MapLibre JSON layers and immediately applies it as the active style",
-                            "parameters": {
-                                "type": "object",
-                                "properties": {
-                                    "layer_id": {
-                                        "type": "string",
-                                        "description": "The ID of the layer to create and apply a style for",
-                                    },
-                                    "maplibre_json_layers_str": {
-                                        "type": "string",
-                                        "description": 'JSON string of MapLibre layer objects. Example: [{"id": "LZJ5RmuZr6qN-line", "type": "line", "source": "LZJ5RmuZr6qN", "paint": {"line-color": "#1E90FF"}}]',
-                                    },
-                                },
-                                "required": ["layer_id", "maplibre_json_layers_str"],
-                            },
-                        },
-                    },
-                    {
-                        "type": "function",
-                        "function": {
-                            "name": "query_duckdb_sql",
-                            "description": "Execute a SQL query against vector layer data using DuckDB. Use query_postgis_database for layers created from PostGIS connections instead.",
-                            "strict": True,
-                            "parameters": {
-                                "type": "object",
-                                "required": ["layer_ids", "sql_query", "head_n_rows"],
-                                "properties": {
-                                    "layer_ids": {
-                                        "type": "array",
-                                        "description": "Load these vector layer IDs as tables",
-                                        "items": {"type": "string"},
-                                    },
-                                    "sql_query": {
-                                        "type": "string",
-                                        "description": "DuckDB-flavored SELECT ... SQL query. Include newlines+spaces at ~55 column wrap for readability e.g. SELECT name_en,county\n    FROM LCH6Na2SBvJr\n    ORDER BY id",
-                                    },
-                                    "head_n_rows": {
-                                        "type": "number",
-                                        "description": "Truncate result to n rows (increase gingerly, MUST specify returned columns), n=20 is good",
-                                    },
-                                },
-                                "additionalProperties": False,
-                            },
-                        },
-                    },
-                    {
-                        "type": "function",
-                        "function": {
-                            "name": "query_postgis_database",
-                            "description": "Execute SQL queries on connected PostgreSQL/PostGIS databases. Use for data analysis, spatial queries, and exploring database tables. The query MUST include a LIMIT clause with a value less than 1000.",
-                            "parameters": {
-                                "type": "object",
-                                "properties": {
-                                    "postgis_connection_id": {
-                                        "type": "string",
-                                        "description": "User's PostGIS connection ID to query against",
-                                    },
-                                    "sql_query": {
-                                        "type": "string",
-                                        "description": "SQL query to execute. Use newlines+spaces at ~55 column wrap. Examples: 'SELECT COUNT(*) FROM table_name', 'SELECT * FROM spatial_table LIMIT 10', 'SELECT column_name FROM information_schema.columns WHERE table_name = \"my_table\"'. Use standard SQL syntax.",
-                                    },
-                                },
-                                "required": ["postgis_connection_id", "sql_query"],
-                                "additionalProperties": False,
-                            },
-                        },
-                    },
-                ]
+    async with kue_ephemeral_action(
+        ctx.conversation_id,
+        "Detecting pests events...",
+    ):
+        if not address or not isinstance(address, str) or not address.strip():
+            return {
+                "status": "error",
+                "error": "Missing or invalid 'address'. Provide a non-empty text address.",
+            }
+        cleaned_address = address.strip()
 
-                # add pydantic-defined tools to the payload
-                for name, (fn, arg_model, _mundi_model) in pydantic_tool_calls.items():
-                    tools_payload.append(tool_from_pyd(fn, arg_model))
+        coords = await geocode_address(address)
+        if not coords:
+            return {
+                "status": "error",
+                "error": "Could not geocode address to coordinates",
+            }
+        latitude, longitude = coords
 
-                all_tools = get_tools()
-                tools_payload.extend(all_tools)
-                geoprocessing_function_names = [
-                    tool["function"]["name"] for tool in all_tools
-                ]
+        try:
+            # the bloom observation puts canopy stress in seasonal context
+            detection, observation = await asyncio.gather(
+                detect_pest(latitude, longitude),
+                bloom_observation(latitude, longitude),
+            )
+        except Exception as e:
+            return {
+                "status": "error",
+                "error": f"Failed to run pest detection: {str(e)}",
+            }
 
-                if not layer_enum:
-                    add_layer_tool = next(
-                        tool
-                        for tool in tools_payload
-                        if tool["function"]["name"] == "add_layer_to_map"
-                    )
-                    add_layer_tool["function"]["parameters"]["properties"][
-                        "layer_id"
-                    ].pop("enum", None)
+        return {
+            "status": "success",
+            "address": cleaned_address,
+            "latitude": latitude,
+            "longitude": longitude,
+            "pest_detection": {
+                "detected_pest": detection["detected_pest"],
+                "confidence_score": detection["confidence_score"],
+                "affected_fraction": detection["affected_fraction"],
+                "chip_count": detection["chip_count"],
+                "error": detection["error"],
+            },
+            "observation": (
+                {
+                    "date_of_max_ebi": observation["date_of_max_ebi"],
+                    "ebi_value": observation["ebi_value"],
+                    "image_url": observation["image_url"],
+                }
+                if observation
+                else None
+            ),
+            "message": (
+                f"Pest detection unavailable: {detection['error']}"
+                if detection["error"]
+                else "Pest detection completed"
+            ),
+        }
 
-                # Replace the thinking ephemeral updates with context manager
-                async with kue_ephemeral_action(conversation.id, "Kue is thinking..."):
-                    chat_completions_args = await chat_args.get_args(
-                        user_id, "send_map_message_async"
+
+async def run_new_layer_from_postgis_tool(
+    ctx: ToolCallContext,
+    tool_call: ChatCompletionMessageToolCall,
+    tool_args: dict,
+) -> dict:
+    postgis_connection_id = tool_args.get("postgis_connection_id")
+    query = tool_args.get("query")
+    # seemingly innocuous but deeply insidious
+    query = query.rstrip().rstrip(";")
+    layer_name = tool_args.get("layer_name")
+
+    if not postgis_connection_id or not query:
+        tool_result = {
+            "status": "error",
+            "error": "Missing required parameters (postgis_connection_id or query).",
+        }
+    else:
+        # Verify the PostGIS connection exists and user has access
+        connection_result = await ctx.conn.fetchrow(
+            """
+            SELECT connection_uri FROM project_postgres_connections
+            WHERE id = $1 AND user_id = $2
+            """,
+            postgis_connection_id,
+            ctx.user_id,
+        )
+
+        if not connection_result:
+            tool_result = {
+                "status": "error",
+                "error": f"PostGIS connection '{postgis_connection_id}' not found or you do not have access to it.",
+            }
+        else:
+            async with kue_ephemeral_action(
+                ctx.conversation_id,
+                "Adding layer from PostGIS...",
+                update_style_json=True,
+            ):
+                try:
+                    # Use connection manager for PostGIS operations
+                    pg = await ctx.connection_manager.connect_to_postgres(
+                        postgis_connection_id
                     )
-                    with tracer.start_as_current_span(
-                        "kue.openai.chat.completions.create"
-                    ):
-                        # chat.completions.create fails for bad messages and tools, so
-                        # if we have orphaned tool calls then we'll get an error - but not
-                        # handling it properly makes for a horrible user experience
-                        try:
-                            response = await client.chat.completions.create(
-                                **chat_completions_args,
-                                messages=[
-                                    {
-                                        "role": "system",
-                                        "content": system_prompt_provider.get_system_prompt(),
-                                    }
-                                ]
-                                + openai_messages,
-                                tools=tools_payload if tools_payload else None,
-                                tool_choice="auto" if tools_payload else None,
+                    try:
+                        # 1. Make sure the SQL parsers and planners are happy
+                        explain_result = await pg.fetch(
+                            f"EXPLAIN (FORMAT JSON) {query}"
+                        )
+
+                        # Parse the JSON string from QUERY PLAN
+                        query_plan = json.loads(explain_result[0]["QUERY PLAN"])
+                        check_postgis_readonly(query_plan[0]["Plan"])
+
+                        # Get column names using prepared statement
+                        prepared = await pg.prepare(
+                            f"SELECT * FROM ({query}) AS sub LIMIT 1"
+                        )
+                        column_info = prepared.get_attributes()
+                        column_names = [attr.name for attr in column_info]
+
+                        # Make sure it returns a geometry column called geom and id
+                        if "geom" not in column_names:
+                            raise ValueError("Query must return a column named 'geom'")
+                        if "id" not in column_names:
+                            raise ValueError("Query must return a column named 'id'")
+
+                        attribute_names = [
+                            name for name in column_names if name not in ["geom", "id"]
+                        ]
+
+                        # Calculate feature count, bounds, and geometry type for the PostGIS layer
+                        feature_count = None
+                        bounds = None
+                        geometry_type = None
+                        metadata_dict = {}
+
+                        # Calculate feature count
+                        count_result = await pg.fetchval(
+                            f"SELECT COUNT(*) FROM ({query}) AS sub"
+                        )
+                        feature_count = (
+                            int(count_result) if count_result is not None else None
+                        )
+
+                        # Detect geometry type for styling
+                        geometry_type_result = await pg.fetchrow(
+                            f"""
+                                SELECT ST_GeometryType(geom) as geom_type, COUNT(*) as count
+                                FROM ({query}) AS sub
+                                WHERE geom IS NOT NULL
+                                GROUP BY ST_GeometryType(geom)
+                                ORDER BY count DESC
+                                LIMIT 1
+                                """
+                        )
+
+                        if geometry_type_result and geometry_type_result["geom_type"]:
+                            # Convert PostGIS geometry type to standard format
+                            geometry_type = (
+                                geometry_type_result["geom_type"]
+                                .replace("ST_", "")
+                                .lower()
                             )
-                        except APIError as e:
-                            if e.code == "context_length_exceeded":
-                                await kue_notify_error(
-                                    conversation.id,
-                                    "Maximum context length for LLM has been reached. Please create a new chat to continue using the chat feature.",
-                                )
-                            else:
-                                await kue_notify_error(
-                                    conversation.id,
-                                    "Error connecting to LLM. If trying again doesn't work, create a new chat in the top right to reset the chat history.",
+
+                            # Calculate bounds with proper SRID handling
+                            # ST_Extent returns BOX2D with SRID 0, so we need to set the SRID before transforming
+                            bounds_result = await pg.fetchrow(
+                                f"""
+                                WITH extent_data AS (
+                                    SELECT
+                                        ST_Extent(geom) as extent_geom,
+                                        (SELECT ST_SRID(geom) FROM ({query}) AS sub2 WHERE geom IS NOT NULL LIMIT 1) as original_srid
+                                    FROM ({query}) AS sub
+                                    WHERE geom IS NOT NULL
                                 )
-                            span.set_status(
-                                trace.Status(trace.StatusCode.ERROR, str(e))
-                            )
-                            span.set_attribute(
-                                "error.traceback", traceback.format_exc()
+                                SELECT
+                                    CASE
+                                        WHEN original_srid = 4326 THEN
+                                            ST_XMin(extent_geom)
+                                        ELSE
+                                            ST_XMin(ST_Transform(ST_SetSRID(extent_geom, original_srid), 4326))
+                                    END as xmin,
+                                    CASE
+                                        WHEN original_srid = 4326 THEN
+                                            ST_YMin(extent_geom)
+                                        ELSE
+                                            ST_YMin(ST_Transform(ST_SetSRID(extent_geom, original_srid), 4326))
+                                    END as ymin,
+                                    CASE
+                                        WHEN original_srid = 4326 THEN
+                                            ST_XMax(extent_geom)
+                                        ELSE
+                                            ST_XMax(ST_Transform(ST_SetSRID(extent_geom, original_srid), 4326))
+                                    END as xmax,
+                                    CASE
+                                        WHEN original_srid = 4326 THEN
+                                            ST_YMax(extent_geom)
+                                        ELSE
+                                            ST_YMax(ST_Transform(ST_SetSRID(extent_geom, original_srid), 4326))
+                                     END as ymax,
+                                     original_srid
+                                 FROM extent_data
+                                WHERE extent_geom IS NOT NULL
+                                """
                             )
-                            break
-                        except Exception as e:
-                            await kue_notify_error(
-                                conversation.id,
-                                "Error connecting to LLM. This is probably a bug with Mundi, please open a new issue on GitHub.",
+
+                            if bounds_result and all(
+                                v is not None for v in bounds_result
+                            ):
+                                bounds = [
+                                    float(bounds_result["xmin"]),
+                                    float(bounds_result["ymin"]),
+                                    float(bounds_result["xmax"]),
+                                    float(bounds_result["ymax"]),
+                                ]
+                                # Capture original SRID into metadata if available
+                                if (
+                                    "original_srid" in bounds_result
+                                    and bounds_result["original_srid"] is not None
+                                ):
+                                    try:
+                                        metadata_dict["original_srid"] = int(
+                                            bounds_result["original_srid"]
+                                        )
+                                    except (
+                                        ValueError,
+                                        TypeError,
+                                    ):
+                                        pass
+                        else:
+                            print("Warning: No geometry column found in PostGIS query")
+                    finally:
+                        await pg.close()
+
+                    # Generate a new layer ID
+                    layer_id = generate_id(prefix="L")
+
+                    # Generate default style if geometry type was detected
+                    maplibre_layers = None
+                    if geometry_type:
+                        try:
+                            maplibre_layers = generate_maplibre_layers_for_layer_id(
+                                layer_id, geometry_type
                             )
-                            span.set_status(
-                                trace.Status(trace.StatusCode.ERROR, str(e))
+                            # PostGIS layers use MVT tiles, so source-layer is 'reprojectedfgb'
+                            # This matches the expectation in the style generation function
+                            print(
+                                f"Generated default style for PostGIS layer {layer_id} with geometry type {geometry_type}"
                             )
-                            span.set_attribute(
-                                "error.traceback", traceback.format_exc()
+                        except Exception as e:
+                            print(
+                                f"Warning: Failed to generate default style for PostGIS layer: {str(e)}"
                             )
-                            break
-                assistant_message: ChatCompletionMessageParam = response.choices[
-                    0
-                ].message
+                            maplibre_layers = None
 
-                # after chat completions is a pretty common spot to get a cancelled message
-                if redis.get(f"messages:{map_id}:cancelled"):
-                    redis.delete(f"messages:{map_id}:cancelled")
-                    break
+                    # Create the layer in the database
+                    await ctx.conn.execute(
+                        """
+                        INSERT INTO map_layers
+                        (layer_id, owner_uuid, name, type, postgis_connection_id, postgis_query, metadata, feature_count, bounds, geometry_type, source_map_id, created_on, last_edited, postgis_attribute_column_list)
+                        VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9, $10, $11, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP, $12)
+                        """,
+                        layer_id,
+                        ctx.user_id,
+                        layer_name,
+                        "postgis",
+                        postgis_connection_id,
+                        query,
+                        json.dumps(metadata_dict),
+                        feature_count,
+                        bounds,
+                        geometry_type,
+                        ctx.map_id,
+                        attribute_names,
+                    )
 
-                # Store the assistant message in the database
-                await add_chat_completion_message(assistant_message)
+                    # Create default style in separate table if we have geometry type
+                    if maplibre_layers:
+                        style_id = generate_id(prefix="S")
+                        await ctx.conn.execute(
+                            """
+                            INSERT INTO layer_styles
+                            (style_id, layer_id, style_json, created_by, created_on)
+                            VALUES ($1, $2, $3, $4, CURRENT_TIMESTAMP)
+                            """,
+                            style_id,
+                            layer_id,
+                            json.dumps(maplibre_layers),
+                            ctx.user_id,
+                        )
 
-                # If no tool calls, break
-                if not assistant_message.tool_calls:
-                    break
+                        await ctx.conn.execute(
+                            """
+                            INSERT INTO map_layer_styles
+                            (map_id, layer_id, style_id)
+                            VALUES ($1, $2, $3)
+                            """,
+                            ctx.map_id,
+                            layer_id,
+                            style_id,
+                        )
 
-                # Fetch project_id for this map once for all tool calls
-                async with async_conn("tool.project_id_for_map") as proj_conn:
-                    row = await proj_conn.fetchrow(
-                        "SELECT project_id FROM user_mundiai_maps WHERE id = $1",
-                        map_id,
+                    # layers may be NULL, not necessarily initialized to []
+                    await ctx.conn.execute(
+                        """
+                        UPDATE user_mundiai_maps
+                        SET layers = CASE
+                            WHEN layers IS NULL THEN ARRAY[$1]
+                            ELSE array_append(layers, $1)
+                        END
+                        WHERE id = $2 AND (layers IS NULL OR NOT ($1 = ANY(layers)))
+                        """,
+                        layer_id,
+                        ctx.map_id,
                     )
-                    assert row is not None
-                    current_project_id: str = row["project_id"]
 
-                # Process each tool call returned by the assistant
+                    tool_result = {
+                        "status": "success",
+                        "message": f"PostGIS layer created successfully with ID: {layer_id} and added to map",
+                        "layer_id": layer_id,
+                        "query": query,
+                        "added_to_map": True,
+                    }
+                except Exception as e:
+                    tool_result = {
+                        "status": "error",
+                        "error": f"Query validation failed: {str(e)}",
+                    }
 
-                for tool_call in assistant_message.tool_calls:
-                    tool_call: ChatCompletionMessageToolCall = tool_call
-                    function_name = tool_call.function.name
-                    tool_args = json.loads(tool_call.function.arguments)
-                    tool_result = {}
+    return tool_result
 
-                    if function_name in pydantic_tool_calls:
-                        fn, ArgModel, MundiModel = pydantic_tool_calls[function_name]
-                        try:
-                            parsed_args = ArgModel(**(tool_args or {}))
 
-                        except Exception as e:
-                            tool_result = {
-                                "status": "error",
-                                "error": f"Invalid arguments for {function_name}: {e}",
-                            }
-                            await add_chat_completion_message(
-                                ChatCompletionToolMessageParam(
-                                    role="tool",
-                                    tool_call_id=tool_call.id,
-                                    content=json_dumps_safe(tool_result),
-                                ),
-                            )
-                            continue
+async def run_add_layer_to_map_tool(
+    ctx: ToolCallContext,
+    tool_call: ChatCompletionMessageToolCall,
+    tool_args: dict,
+) -> dict:
+    layer_id_to_add = tool_args.get("layer_id")
+    new_name = tool_args.get("new_name")
 
-                        try:
-                            mundi_args = MundiModel(
-                                user_uuid=user_id,
-                                conversation_id=conversation.id,
-                                map_id=map_id,
-                                project_id=current_project_id,
-                                session=session,
-                            )
-                            # Execute tool (all tools are async)
-                            tool_result = await fn(parsed_args, mundi_args)
+    async with kue_ephemeral_action(
+        ctx.conversation_id,
+        "Adding layer to map...",
+        update_style_json=True,
+    ):
+        layer_exists = await ctx.conn.fetchrow(
+            """
+            SELECT layer_id FROM map_layers
+            WHERE layer_id = $1 AND owner_uuid = $2
+            """,
+            layer_id_to_add,
+            ctx.user_id,
+        )
 
-                        except Exception:
-                            tool_result = {
-                                "status": "error",
-                                "error": "Tool execution failed. Please try again or adjust the inputs.",
-                            }
+        if not layer_exists:
+            tool_result = {
+                "status": "error",
+                "error": f"Layer ID '{layer_id_to_add}' not found or you do not have permission to use it.",
+            }
+        else:
+            await ctx.conn.execute(
+                """
+                UPDATE map_layers SET name = $1 WHERE layer_id = $2
+                """,
+                new_name,
+                layer_id_to_add,
+            )
 
-                        await add_chat_completion_message(
-                            ChatCompletionToolMessageParam(
-                                role="tool",
-                                tool_call_id=tool_call.id,
-                                content=json_dumps_safe(tool_result),
-                            ),
-                        )
-                        continue
+            await ctx.conn.execute(
+                """
+                UPDATE user_mundiai_maps
+                SET layers = CASE
+                    WHEN layers IS NULL THEN ARRAY[$1]
+                    ELSE array_append(layers, $1)
+                END
+                WHERE id = $2 AND (layers IS NULL OR NOT ($1 = ANY(layers)))
+                """,
+                layer_id_to_add,
+                ctx.map_id,
+            )
+            tool_result = {
+                "status": f"Layer '{new_name}' (ID: {layer_id_to_add}) added to map '{ctx.map_id}'.",
+                "layer_id": layer_id_to_add,
+                "name": new_name,
+            }
 
-                    span.add_event(
-                        "kue.tool_call_started",
-                        {"tool_name": function_name},
-                    )
+        return tool_result
+
+
+async def run_query_duckdb_sql_tool(
+    ctx: ToolCallContext,
+    tool_call: ChatCompletionMessageToolCall,
+    tool_args: dict,
+) -> dict:
+    layer_id = tool_args.get("layer_ids", [None])[0]  # Use first layer or None
+    sql_query = tool_args.get("sql_query")
+    head_n_rows = tool_args.get("head_n_rows", 20)
+
+    layer_exists = await ctx.conn.fetchrow(
+        """
+        SELECT layer_id FROM map_layers
+        WHERE layer_id = $1 AND owner_uuid = $2
+        """,
+        layer_id,
+        ctx.user_id,
+    )
 
-                    with tracer.start_as_current_span(f"kue.{function_name}") as span:
+    if not layer_exists:
+        tool_result = {
+            "status": "error",
+            "error": f"Layer ID '{layer_id}' not found or you do not have permission to access it.",
+        }
+        return tool_result
 
-                        if function_name == "bloom_study":
-                            address = tool_args.get("address")
-                           
+    try:
+        # Execute the query using the async function
+        async with kue_ephemeral_action(
+            ctx.conversation_id,
+            "Querying with SQL...",
+            layer_id=layer_id,
+        ):
+            result = await execute_duckdb_query(
+                sql_query=sql_query,
+                layer_id=layer_id,
+                max_n_rows=head_n_rows,
+                timeout=10,
+            )
 
-                            async with kue_ephemeral_action(
-                                conversation.id,
-                                "Analyzing bloom events...",
-                            ):
-                                if not address or not isinstance(address, str) or not address.strip():
-                                    print("Invalid or missing address")
-                                    tool_result = {
-                                        "status": "error",
-                                        "error": "Missing or invalid 'address'. Provide a non-empty text address.",
-                                    }
-                                else:
-                                    print(f"Geocoding address: {address}")
-                                    cleaned_address = address.strip()
-
-                                    coords = await geocode_address(address)
-                                    if not coords:
-                                        tool_result = {
-                                            "status": "error",
-                                            "error": "Could not geocode address to coordinates",
-                                        }
-                                    else:
-                                        latitude, longitude = coords
-                                        print(f"Geocoded address to {latitude}, {longitude}")
-                                        try:
-                                            prediction_row = await conn.fetchrow(
-                                                """
-                                                  SELECT
-                                                    predicted_bloom_start ,
-                                                    predicted_bloom_peak,
-                                                    confidence
-                                                FROM bloom_predictions
-                                                WHERE latitude = $1
-                                                  AND longitude = $2
-                                                  ORDER BY created_at DESC
-                                                LIMIT 1
-                                                """,
-                                                latitude,
-                                                longitude,
-                                            )
+        # Convert result to CSV format
+        # write header + rows to an in-memory buffer
+        buf = io.StringIO()
+        writer = csv.writer(buf)
+        writer.writerow(result["headers"])
+        writer.writerows(result["result"])
 
-                                            print(f"Prediction row: {prediction_row}")
-
-                                            observation_row = await conn.fetchrow(
-                                                """
-                                                SELECT
-                                                    date_of_max_ebi,
-                                                    ebi_value,
-                                                    image_url
-                                                FROM bloom_observations
-                                                WHERE latitude = $1
-                                                  AND longitude = $2
-                                                ORDER BY created_at DESC
-                                                LIMIT 1
-                                                """,
-                                                latitude,
-                                                longitude,
-                                            )
+        result_text = buf.getvalue()
 
-                                            print(f"Observation row: {observation_row}")
-
-                                            prediction = (
-                                                {
-                                                    "prediction_bloom_start": prediction_row["predicted_bloom_start"],
-                                                    "prediction_bloom_peak": prediction_row["predicted_bloom_peak"],
-                                                    "confidence": prediction_row["confidence"],
-                                                }
-                                                if prediction_row
-                                                else None
-                                                                                                    
-                                            )
-                                            print(f"Prediction: {prediction}")
-                                            observation = (
-                                                {
-                                                    "date_of_max_ebi": observation_row["date_of_max_ebi"],
-                                                    "ebi_value": observation_row["ebi_value"],
-                                                    "image_url": observation_row["image_url"],
-                                                }
-                                                if observation_row
-                                                else None
-                                            )
-                                            print(f"Observation: {observation}")
-
-                                            # Fallback: if DB has no data, call API endpoints (POST)
-                                            try:
-                                                if prediction is None or observation is None:
-                                                    transport = httpx.ASGITransport(app=request.app)
-                                                    async with httpx.AsyncClient(transport=transport, base_url="http://app") as client:
-                                                        # Call POST /api/bloom-prediction if missing
-                                                        if prediction is None:
-                                                            try:
-                                                                pred_resp = await client.post(
-                                                                    "/api/bloom-prediction",
-                                                                    json={"latitude": latitude, "longitude": longitude},
-                                                                )
-                                                                if pred_resp.status_code == 200:
-                                                                    pred_json = pred_resp.json()
-                                                                    prediction = {
-                                                                        "prediction_bloom_start": pred_json.get("predicted_bloom_start"),
-                                                                        "prediction_bloom_peak": pred_json.get("predicted_bloom_peak"),
-                                                                        "confidence": pred_json.get("confidence"),
-                                                                    }
-                                                                    print(f"Prediction fallback via endpoint: {prediction}")
-                                                                else:
-                                                                    print(f"Prediction endpoint error: {pred_resp.status_code} {pred_resp.text}")
-                                                            except Exception as e:
-                                                                print(f"Prediction endpoint call failed: {e}")
-
-                                                        # Call POST /api/bloom-detection if missing
-                                                        if observation is None:
-                                                            try:
-                                                                obs_resp = await client.post(
-                                                                    "/api/bloom-detection",
-                                                                    json={"latitude": latitude, "longitude": longitude},
-                                                                )
-                                                                if obs_resp.status_code == 200:
-                                                                    obs_json = obs_resp.json()
-                                                                    observation = {
-                                                                        "date_of_max_ebi": obs_json.get("date_of_max_ebi"),
-                                                                        "ebi_value": obs_json.get("ebi_value"),
-                                                                        "image_url": obs_json.get("image_url"),
-                                                                    }
-                                                                    print(f"Observation fallback via endpoint: {observation}")
-                                                                else:
-                                                                    print(f"Observation endpoint error: {obs_resp.status_code} {obs_resp.text}")
-                                                            except Exception as e:
-                                                                print(f"Observation endpoint call failed: {e}")
-                                            except Exception as e:
-                                                print(f"Bloom endpoint fallback wrapper failed: {e}")
-
-                                        except Exception as e:
-                                            tool_result = {
-                                                "status": "error",
-                                                "error": f"Failed to load bloom data: {str(e)}",
-                                            }
-
-                                # If we have a georeferenced image URL, add it as a raster layer to the map
-                                try:
-                                    ebi_url = None
-                                    layer_add_result = None
-                                    if observation and isinstance(observation, dict):
-                                        ebi_url = observation.get("image_url")
-
-                                    if ebi_url and isinstance(ebi_url, str) and ebi_url.startswith("http"):
-                                        # Name the layer using the observation date if available
-                                        layer_name = "Bloom EBI"
-                                        try:
-                                            if observation.get("date_of_max_ebi"):
-                                                layer_name = f"Bloom EBI {observation['date_of_max_ebi']}"
-                                        except Exception:
-                                            pass
-
-                                        # Add via the remote-layer endpoint so the DAG is preserved
-                                        async with kue_ephemeral_action(
-                                            conversation.id,
-                                            "Adding bloom raster layer to map...",
-                                            update_style_json=True,
-                                        ):
-                                            transport = httpx.ASGITransport(app=request.app)
-                                            async with httpx.AsyncClient(transport=transport, base_url="http://app") as client:
-                                                resp = await client.post(
-                                                    f"/api/maps/{map_id}/layers/remote",
-                                                    json={
-                                                        "url": ebi_url,
-                                                        "name": layer_name,
-                                                        "source_type": "raster",
-                                                        "add_layer_to_map": True,
-                                                    },
-                                                )
-                                            if resp.status_code == 200:
-                                                try:
-                                                    layer_add_result = resp.json()
-                                                except Exception:
-                                                    layer_add_result = None
-                                            else:
-                                                print(
-                                                    f"Failed to add bloom layer to map: {resp.status_code} {getattr(resp,'text', '')}"
-                                                )
-                                    else:
-                                        print("No valid bloom image URL to add as a layer.")
-                                except Exception as e:
-                                    print(f"Exception while adding bloom layer: {e}")
-
-                                
-                                tool_result = {
-                                    "status": "success",
-                                    "address": cleaned_address,
-                                    "latitude": latitude,
-                                    "longitude": longitude,
-                                    "prediction": prediction,
-                                    "observation": observation,
-                                    # Surface layer addition details for the frontend to optionally switch maps
-                                    **({
-                                        "layer_upload": layer_add_result,
-                                        "dag_child_map_id": layer_add_result.get("dag_child_map_id"),
-                                        "dag_parent_map_id": layer_add_result.get("dag_parent_map_id"),
-                                    } if layer_add_result else {}),
-                                    "message": (
-                                                    "No recent prediction or observation found for these coordinates"
-                                                    if not prediction and not observation
-                                                    else "Retrieved latest prediction and/or observation"
-                                                ),
-                                            }
-                                
-                                print(f"Tool result: {tool_result}")
-                                            
-
-
-                            await add_chat_completion_message(
-                                ChatCompletionToolMessageParam(
-                                    role="tool",
-                                    tool_call_id=tool_call.id,
-                                    content=json_dumps_safe(tool_result),
-                                )
-                            )
+        if len(result_text) > 25000:
+            tool_result = {
+                "status": "error",
+                "error": f"DuckDB CSV result too large: {len(result_text)} characters exceeds 25,000 character limit, try reducing columns or head_n_rows",
+            }
+        else:
+            tool_result = {
+                "status": "success",
+                "result": result_text,
+                "row_count": result["row_count"],
+                "query": sql_query,
+            }
+    except HTTPException as e:
+        tool_result = {
+            "status": "error",
+            "error": f"DuckDB query error: {e.detail}",
+        }
+    except Exception as e:
+        tool_result = {
+            "status": "error",
+            "error": f"Error executing SQL query: {str(e)}",
+        }
 
-                        elif function_name == "pest_detection":
-                            address = tool_args.get("address")
-                           
+    return tool_result
 
-                            async with kue_ephemeral_action(
-                                conversation.id,
-                                "Detecting pests events...",
-                            ):
-                                if not address or not isinstance(address, str) or not address.strip():
-                                    print("Invalid or missing address")
-                                    tool_result = {
-                                        "status": "error",
-                                        "error": "Missing or invalid 'address'. Provide a non-empty text address.",
-                                    }
-                                else:
-                                    print(f"Geocoding address: {address}")
-                                    cleaned_address = address.strip()
-
-                                    coords = await geocode_address(address)
-                                    if not coords:
-                                        tool_result = {
-                                            "status": "error",
-                                            "error": "Could not geocode address to coordinates",
-                                        }
-                                    else:
-                                        latitude, longitude = coords
-                                        print(f"Geocoded address to {latitude}, {longitude}")
-                                        try:
-
-                                            observation_row = await conn.fetchrow(
-                                                """
-                                                SELECT
-                                                    date_of_max_ebi,
-                                                    ebi_value,
-                                                    image_url
-                                                FROM bloom_observations
-                                                WHERE latitude = $1
-                                                  AND longitude = $2
-                                                ORDER BY created_at DESC
-                                                LIMIT 1
-                                                """,
-                                                latitude,
-                                                longitude,
-                                            )
 
-                                            print(f"Observation row: {observation_row}")
-
-                                         
-                                            observation = (
-                                                {
-                                                    "date_of_max_ebi": observation_row["date_of_max_ebi"],
-                                                    "ebi_value": observation_row["ebi_value"],
-                                                    "image_url": observation_row["image_url"],
-                                                }
-                                                if observation_row
-                                                else None
-                                            )
-                                            print(f"Observation: {observation}")
-
-                                            # Fallback: if DB has no data, call API endpoints (POST)
-                                            try:
-                                                if observation is None:
-                                                    transport = httpx.ASGITransport(app=request.app)
-                                                    async with httpx.AsyncClient(transport=transport, base_url="http://app") as client:
-                                                        # Call POST /api/bloom-prediction if missing
-
-                                                        if observation is None:
-                                                            try:
-                                                                obs_resp = await client.post(
-                                                                    "/api/bloom-detection",
-                                                                    json={"latitude": latitude, "longitude": longitude},
-                                                                )
-                                                                if obs_resp.status_code == 200:
-                                                                    obs_json = obs_resp.json()
-                                                                    observation = {
-                                                                        "date_of_max_ebi": obs_json.get("date_of_max_ebi"),
-                                                                        "ebi_value": obs_json.get("ebi_value"),
-                                                                        "image_url": obs_json.get("image_url"),
-                                                                    }
-                                                                    print(f"Observation fallback via endpoint: {observation}")
-                                                                else:
-                                                                    print(f"Observation endpoint error: {obs_resp.status_code} {obs_resp.text}")
-                                                            except Exception as e:
-                                                                print(f"Observation endpoint call failed: {e}")
-                                            except Exception as e:
-                                                print(f"Bloom endpoint fallback wrapper failed: {e}")
-
-                                            
-                                            tool_result = {
-                                                "status": "success",
-                                                "address": cleaned_address,
-                                                "latitude": latitude,
-                                                "longitude": longitude,
-                                                "observation": observation,
-                                                "message": (
-                                                    "No recent prediction or observation found for these coordinates"
-                                                    if observation
-                                                    else "Retrieved latest prediction and/or observation"
-                                                ),
-                                            }
-                                            print(f"Tool result: {tool_result}")
-                                            
-                                        except Exception as e:
-                                            tool_result = {
-                                                "status": "error",
-                                                "error": f"Failed to load bloom data: {str(e)}",
-                                            }
-
-                            await add_chat_completion_message(
-                                ChatCompletionToolMessageParam(
-                                    role="tool",
-                                    tool_call_id=tool_call.id,
-                                    content=json_dumps_safe(tool_result),
-                                )
-                            )                            
+async def run_set_layer_style_tool(
+    ctx: ToolCallContext,
+    tool_call: ChatCompletionMessageToolCall,
+    tool_args: dict,
+) -> dict:
+    layer_id = tool_args.get("layer_id")
+    maplibre_json_layers_str = tool_args.get("maplibre_json_layers_str")
 
-                        elif function_name == "new_layer_from_postgis":
-                            postgis_connection_id = tool_args.get(
-                                "postgis_connection_id"
-                            )
-                            query = tool_args.get("query")
-                            # seemingly innocuous but deeply insidious
-                            query = query.rstrip().rstrip(";")
-                            layer_name = tool_args.get("layer_name")
+    if not layer_id or not maplibre_json_layers_str:
+        tool_result = {
+            "status": "error",
+            "error": "Missing required parameters (layer_id or maplibre_json_layers_str).",
+        }
+    else:
+        try:
+            layers = json.loads(maplibre_json_layers_str)
 
-                            if not postgis_connection_id or not query:
-                                tool_result = {
-                                    "status": "error",
-                                    "error": "Missing required parameters (postgis_connection_id or query).",
-                                }
-                            else:
-                                # Verify the PostGIS connection exists and user has access
-                                connection_result = await conn.fetchrow(
-                                    """
-                                    SELECT connection_uri FROM project_postgres_connections
-                                    WHERE id = $1 AND user_id = $2
-                                    """,
-                                    postgis_connection_id,
-                                    user_id,
-                                )
+            layer_row = await ctx.conn.fetchrow(
+                """
+                SELECT *
+                FROM map_layers
+                WHERE layer_id = $1 AND owner_uuid = $2
+                """,
+                layer_id,
+                ctx.user_id,
+            )
+            if not layer_row:
+                raise HTTPException(404, f"Layer {layer_id} not found")
+            layer = MapLayer(**dict(layer_row))
+
+            async with kue_ephemeral_action(
+                ctx.conversation_id,
+                f"Styling layer {layer.name}...",
+                update_style_json=True,
+            ):
+                style_response = await set_layer_style_route(
+                    request=SetStyleRequest(
+                        maplibre_json_layers=layers,
+                        map_id=ctx.map_id,
+                    ),
+                    layer=layer,
+                    user_id=ctx.user_id,
+                )
 
-                                if not connection_result:
-                                    tool_result = {
-                                        "status": "error",
-                                        "error": f"PostGIS connection '{postgis_connection_id}' not found or you do not have access to it.",
-                                    }
-                                else:
-                                    async with kue_ephemeral_action(
-                                        conversation.id,
-                                        "Adding layer from PostGIS...",
-                                        update_style_json=True,
-                                    ):
-                                        try:
-                                            # Use connection manager for PostGIS operations
-                                            pg = await connection_manager.connect_to_postgres(
-                                                postgis_connection_id
-                                            )
-                                            try:
-                                                # 1. Make sure the SQL parsers and planners are happy
-                                                explain_result = await pg.fetch(
-                                                    f"EXPLAIN (FORMAT JSON) {query}"
-                                                )
-
-                                                # Parse the JSON string from QUERY PLAN
-                                                query_plan = json.loads(
-                                                    explain_result[0]["QUERY PLAN"]
-                                                )
-                                                check_postgis_readonly(
-                                                    query_plan[0]["Plan"]
-                                                )
-
-                                                # Get column names using prepared statement
-                                                prepared = await pg.prepare(
-                                                    f"SELECT * FROM ({query}) AS sub LIMIT 1"
-                                                )
-                                                column_info = prepared.get_attributes()
-                                                column_names = [
-                                                    attr.name for attr in column_info
-                                                ]
-
-                                                # Make sure it returns a geometry column called geom and id
-                                                if "geom" not in column_names:
-                                                    raise ValueError(
-                                                        "Query must return a column named 'geom'"
-                                                    )
-                                                if "id" not in column_names:
-                                                    raise ValueError(
-                                                        "Query must return a column named 'id'"
-                                                    )
-
-                                                attribute_names = [
-                                                    name
-                                                    for name in column_names
-                                                    if name not in ["geom", "id"]
-                                                ]
-
-                                                # Calculate feature count, bounds, and geometry type for the PostGIS layer
-                                                feature_count = None
-                                                bounds = None
-                                                geometry_type = None
-                                                metadata_dict = {}
-
-                                                # Calculate feature count
-                                                count_result = await pg.fetchval(
-                                                    f"SELECT COUNT(*) FROM ({query}) AS sub"
-                                                )
-                                                feature_count = (
-                                                    int(count_result)
-                                                    if count_result is not None
-                                                    else None
-                                                )
-
-                                                # Detect geometry type for styling
-                                                geometry_type_result = (
-                                                    await pg.fetchrow(
-                                                        f"""
-                                                        SELECT ST_GeometryType(geom) as geom_type, COUNT(*) as count
-                                                        FROM ({query}) AS sub
-                                                        WHERE geom IS NOT NULL
-                                                        GROUP BY ST_GeometryType(geom)
-                                                        ORDER BY count DESC
-                                                        LIMIT 1
-                                                        """
-                                                    )
-                                                )
-
-                                                if (
-                                                    geometry_type_result
-                                                    and geometry_type_result[
-                                                        "geom_type"
-                                                    ]
-                                                ):
-                                                    # Convert PostGIS geometry type to standard format
-                                                    geometry_type = (
-                                                        geometry_type_result[
-                                                            "geom_type"
-                                                        ]
-                                                        .replace("ST_", "")
-                                                        .lower()
-                                                    )
-
-                                                    # Calculate bounds with proper SRID handling
-                                                    # ST_Extent returns BOX2D with SRID 0, so we need to set the SRID before transforming
-                                                    bounds_result = await pg.fetchrow(
-                                                        f"""
-                                                        WITH extent_data AS (
-                                                            SELECT
-                                                                ST_Extent(geom) as extent_geom,
-                                                                (SELECT ST_SRID(geom) FROM ({query}) AS sub2 WHERE geom IS NOT NULL LIMIT 1) as original_srid
-                                                            FROM ({query}) AS sub
-                                                            WHERE geom IS NOT NULL
-                                                        )
-                                                        SELECT
-                                                            CASE
-                                                                WHEN original_srid = 4326 THEN
-                                                                    ST_XMin(extent_geom)
-                                                                ELSE
-                                                                    ST_XMin(ST_Transform(ST_SetSRID(extent_geom, original_srid), 4326))
-                                                            END as xmin,
-                                                            CASE
-                                                                WHEN original_srid = 4326 THEN
-                                                                    ST_YMin(extent_geom)
-                                                                ELSE
-                                                                    ST_YMin(ST_Transform(ST_SetSRID(extent_geom, original_srid), 4326))
-                                                            END as ymin,
-                                                            CASE
-                                                                WHEN original_srid = 4326 THEN
-                                                                    ST_XMax(extent_geom)
-                                                                ELSE
-                                                                    ST_XMax(ST_Transform(ST_SetSRID(extent_geom, original_srid), 4326))
-                                                            END as xmax,
-                                                            CASE
-                                                                WHEN original_srid = 4326 THEN
-                                                                    ST_YMax(extent_geom)
-                                                                ELSE
-                                                                    ST_YMax(ST_Transform(ST_SetSRID(extent_geom, original_srid), 4326))
-                                                             END as ymax,
-                                                             original_srid
-                                                         FROM extent_data
-                                                        WHERE extent_geom IS NOT NULL
-                                                        """
-                                                    )
-
-                                                    if bounds_result and all(
-                                                        v is not None
-                                                        for v in bounds_result
-                                                    ):
-                                                        bounds = [
-                                                            float(
-                                                                bounds_result["xmin"]
-                                                            ),
-                                                            float(
-                                                                bounds_result["ymin"]
-                                                            ),
-                                                            float(
-                                                                bounds_result["xmax"]
-                                                            ),
-                                                            float(
-                                                                bounds_result["ymax"]
-                                                            ),
-                                                        ]
-                                                        # Capture original SRID into metadata if available
-                                                        if (
-                                                            "original_srid"
-                                                            in bounds_result
-                                                            and bounds_result[
-                                                                "original_srid"
-                                                            ]
-                                                            is not None
-                                                        ):
-                                                            try:
-                                                                metadata_dict[
-                                                                    "original_srid"
-                                                                ] = int(
-                                                                    bounds_result[
-                                                                        "original_srid"
-                                                                    ]
-                                                                )
-                                                            except (
-                                                                ValueError,
-                                                                TypeError,
-                                                            ):
-                                                                pass
-                                                else:
-                                                    print(
-                                                        "Warning: No geometry column found in PostGIS query"
-                                                    )
-                                            finally:
-                                                await pg.close()
-
-                                            # Generate a new layer ID
-                                            layer_id = generate_id(prefix="L")
-
-                                            # Generate default style if geometry type was detected
-                                            maplibre_layers = None
-                                            if geometry_type:
-                                                try:
-                                                    maplibre_layers = generate_maplibre_layers_for_layer_id(
-                                                        layer_id, geometry_type
-                                                    )
-                                                    # PostGIS layers use MVT tiles, so source-layer is 'reprojectedfgb'
-                                                    # This matches the expectation in the style generation function
-                                                    print(
-                                                        f"Generated default style for PostGIS layer {layer_id} with geometry type {geometry_type}"
-                                                    )
-                                                except Exception as e:
-                                                    print(
-                                                        f"Warning: Failed to generate default style for PostGIS layer: {str(e)}"
-                                                    )
-                                                    maplibre_layers = None
-
-                                            # Create the layer in the database
-                                            await conn.execute(
-                                                """
-                                                INSERT INTO map_layers
-                                                (layer_id, owner_uuid, name, type, postgis_connection_id, postgis_query, metadata, feature_count, bounds, geometry_type, source_map_id, created_on, last_edited, postgis_attribute_column_list)
-                                                VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9, $10, $11, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP, $12)
-                                                """,
-                                                layer_id,
-                                                user_id,
-                                                layer_name,
-                                                "postgis",
-                                                postgis_connection_id,
-                                                query,
-                                                json.dumps(metadata_dict),
-                                                feature_count,
-                                                bounds,
-                                                geometry_type,
-                                                map_id,
-                                                attribute_names,
-                                            )
+            tool_result = {
+                "status": "success",
+                "style_id": style_response.style_id,
+                "layer_id": style_response.layer_id,
+                "message": f"Style {style_response.style_id} created and applied to layer {layer_id}",
+            }
 
-                                            # Create default style in separate table if we have geometry type
-                                            if maplibre_layers:
-                                                style_id = generate_id(prefix="S")
-                                                await conn.execute(
-                                                    """
-                                                    INSERT INTO layer_styles
-                                                    (style_id, layer_id, style_json, created_by, created_on)
-                                                    VALUES ($1, $2, $3, $4, CURRENT_TIMESTAMP)
-                                                    """,
-                                                    style_id,
-                                                    layer_id,
-                                                    json.dumps(maplibre_layers),
-                                                    user_id,
-                                                )
-
-                                                await conn.execute(
-                                                    """
-                                                    INSERT INTO map_layer_styles
-                                                    (map_id, layer_id, style_id)
-                                                    VALUES ($1, $2, $3)
-                                                    """,
-                                                    map_id,
-                                                    layer_id,
-                                                    style_id,
-                                                )
-
-                                            # layers may be NULL, not necessarily initialized to []
-                                            await conn.execute(
-                                                """
-                                                UPDATE user_mundiai_maps
-                                                SET layers = CASE
-                                                    WHEN layers IS NULL THEN ARRAY[$1]
-                                                    ELSE array_append(layers, $1)
-                                                END
-                                                WHERE id = $2 AND (layers IS NULL OR NOT ($1 = ANY(layers)))
-                                                """,
-                                                layer_id,
-                                                map_id,
-                                            )
+        except json.JSONDecodeError as e:
+            tool_result = {
+                "status": "error",
+                "error": f"Invalid JSON format: {str(e)}",
+                "layer_id": layer_id,
+            }
+        except Exception as e:
+            tool_result = {
+                "status": "error",
+                "error": f"Failed to create and apply style: {str(e)}",
+                "layer_id": layer_id,
+            }
 
-                                            tool_result = {
-                                                "status": "success",
-                                                "message": f"PostGIS layer created successfully with ID: {layer_id} and added to map",
-                                                "layer_id": layer_id,
-                                                "query": query,
-                                                "added_to_map": True,
-                                            }
-                                        except Exception as e:
-                                            tool_result = {
-                                                "status": "error",
-                                                "error": f"Query validation failed: {str(e)}",
-                                            }
-
-                            await add_chat_completion_message(
-                                ChatCompletionToolMessageParam(
-                                    role="tool",
-                                    tool_call_id=tool_call.id,
-                                    content=json_dumps_safe(tool_result),
-                                )
-                            )
-                        elif function_name == "add_layer_to_map":
-                            layer_id_to_add = tool_args.get("layer_id")
-                            new_name = tool_args.get("new_name")
+    return tool_result
 
-                            async with kue_ephemeral_action(
-                                conversation.id,
-                                "Adding layer to map...",
-                                update_style_json=True,
-                            ):
-                                layer_exists = await conn.fetchrow(
-                                    """
-                                    SELECT layer_id FROM map_layers
-                                    WHERE layer_id = $1 AND owner_uuid = $2
-                                    """,
-                                    layer_id_to_add,
-                                    user_id,
-                                )
 
-                                if not layer_exists:
-                                    tool_result = {
-                                        "status": "error",
-                                        "error": f"Layer ID '{layer_id_to_add}' not found or you do not have permission to use it.",
-                                    }
-                                else:
-                                    await conn.execute(
-                                        """
-                                        UPDATE map_layers SET name = $1 WHERE layer_id = $2
-                                        """,
-                                        new_name,
-                                        layer_id_to_add,
-                                    )
-
-                                    await conn.execute(
-                                        """
-                                        UPDATE user_mundiai_maps
-                                        SET layers = CASE
-                                            WHEN layers IS NULL THEN ARRAY[$1]
-                                            ELSE array_append(layers, $1)
-                                        END
-                                        WHERE id = $2 AND (layers IS NULL OR NOT ($1 = ANY(layers)))
-                                        """,
-                                        layer_id_to_add,
-                                        map_id,
-                                    )
-                                    tool_result = {
-                                        "status": f"Layer '{new_name}' (ID: {layer_id_to_add}) added to map '{map_id}'.",
-                                        "layer_id": layer_id_to_add,
-                                        "name": new_name,
-                                    }
-
-                                await add_chat_completion_message(
-                                    ChatCompletionToolMessageParam(
-                                        role="tool",
-                                        tool_call_id=tool_call.id,
-                                        content=json_dumps_safe(tool_result),
-                                    )
-                                )
-                        elif function_name == "query_duckdb_sql":
-                            layer_id = tool_args.get("layer_ids", [None])[
-                                0
-                            ]  # Use first layer or None
-                            sql_query = tool_args.get("sql_query")
-                            head_n_rows = tool_args.get("head_n_rows", 20)
-
-                            layer_exists = await conn.fetchrow(
-                                """
-                                SELECT layer_id FROM map_layers
-                                WHERE layer_id = $1 AND owner_uuid = $2
-                                """,
-                                layer_id,
-                                user_id,
-                            )
+async def run_query_postgis_database_tool(
+    ctx: ToolCallContext,
+    tool_call: ChatCompletionMessageToolCall,
+    tool_args: dict,
+) -> dict:
+    postgis_connection_id = tool_args.get("postgis_connection_id")
+    sql_query = tool_args.get("sql_query")
 
-                            if not layer_exists:
-                                tool_result = {
-                                    "status": "error",
-                                    "error": f"Layer ID '{layer_id}' not found or you do not have permission to access it.",
-                                }
-                                await add_chat_completion_message(
-                                    ChatCompletionToolMessageParam(
-                                        role="tool",
-                                        tool_call_id=tool_call.id,
-                                        content=json_dumps_safe(tool_result),
-                                    )
-                                )
-                                continue
+    if not postgis_connection_id or not sql_query:
+        tool_result = {
+            "status": "error",
+            "error": "Missing required parameters (postgis_connection_id or sql_query)",
+        }
+    else:
+        # Verify the PostGIS connection exists and user has access
+        connection_result = await ctx.conn.fetchrow(
+            """
+            SELECT connection_uri FROM project_postgres_connections
+            WHERE id = $1 AND user_id = $2
+            """,
+            postgis_connection_id,
+            ctx.user_id,
+        )
 
-                            try:
-                                # Execute the query using the async function
-                                async with kue_ephemeral_action(
-                                    conversation.id,
-                                    "Querying with SQL...",
-                                    layer_id=layer_id,
-                                ):
-                                    result = await execute_duckdb_query(
-                                        sql_query=sql_query,
-                                        layer_id=layer_id,
-                                        max_n_rows=head_n_rows,
-                                        timeout=10,
-                                    )
-
-                                # Convert result to CSV format
-                                # write header + rows to an in-memory buffer
-                                buf = io.StringIO()
-                                writer = csv.writer(buf)
-                                writer.writerow(result["headers"])
-                                writer.writerows(result["result"])
-
-                                result_text = buf.getvalue()
-
-                                if len(result_text) > 25000:
-                                    tool_result = {
-                                        "status": "error",
-                                        "error": f"DuckDB CSV result too large: {len(result_text)} characters exceeds 25,000 character limit, try reducing columns or head_n_rows",
-                                    }
+        if not connection_result:
+            tool_result = {
+                "status": "error",
+                "error": f"PostGIS connection '{postgis_connection_id}' not found or you do not have access to it.",
+            }
+        else:
+            try:
+                # Check if LIMIT is already present and validate it
+                limited_query = sql_query.strip()
+                limit_match = re.search(
+                    r"\bLIMIT\s+(\d+)\b",
+                    limited_query,
+                    re.IGNORECASE,
+                )
+
+                if limit_match:
+                    limit_value = int(limit_match.group(1))
+                    if limit_value > 1000:
+                        tool_result = {
+                            "status": "error",
+                            "error": f"LIMIT value {limit_value} exceeds maximum allowed limit of 1000",
+                        }
+                        return tool_result
+                else:
+                    # No LIMIT found, require explicit LIMIT
+                    tool_result = {
+                        "status": "error",
+                        "error": "Query must include a LIMIT clause with a value less than 1000",
+                    }
+                    return tool_result
+
+                async with kue_ephemeral_action(
+                    ctx.conversation_id,
+                    "Querying PostgreSQL database...",
+                ):
+                    postgres_conn = await ctx.connection_manager.connect_to_postgres(
+                        postgis_connection_id
+                    )
+                    try:
+                        # Execute the query
+                        rows = await postgres_conn.fetch(limited_query)
+
+                        if not rows:
+                            tool_result = {
+                                "status": "success",
+                                "message": "Query executed successfully but returned no rows",
+                                "row_count": 0,
+                                "query": limited_query,
+                            }
+                        else:
+                            # Convert rows to list of dicts
+                            result_data = [dict(row) for row in rows]
+
+                            # Format the result as a readable string
+                            if len(result_data) == 1 and len(result_data[0]) == 1:
+                                # Single value result
+                                single_value = list(result_data[0].values())[0]
+                                result_text = f"Query result: {single_value}"
+                            else:
+                                # Table format
+                                if result_data:
+                                    headers = list(result_data[0].keys())
+                                    result_lines = ["\t".join(headers)]
+                                    for row in result_data:
+                                        result_lines.append(
+                                            "\t".join(
+                                                str(row.get(h, "")) for h in headers
+                                            )
+                                        )
+                                    result_text = "\n".join(result_lines)
                                 else:
-                                    tool_result = {
-                                        "status": "success",
-                                        "result": result_text,
-                                        "row_count": result["row_count"],
-                                        "query": sql_query,
-                                    }
-                            except HTTPException as e:
+                                    result_text = "No results"
+
+                            # Check if result is too large
+                            if len(result_text) > 25000:
                                 tool_result = {
                                     "status": "error",
-                                    "error": f"DuckDB query error: {e.detail}",
+                                    "error": f"Query result too large: {len(result_text)} characters exceeds 25,000 character limit. Try reducing the number of columns or rows.",
                                 }
-                            except Exception as e:
+                            else:
                                 tool_result = {
-                                    "status": "error",
-                                    "error": f"Error executing SQL query: {str(e)}",
+                                    "status": "success",
+                                    "result": result_text,
+                                    "row_count": len(result_data),
+                                    "query": limited_query,
                                 }
+                    finally:
+                        await postgres_conn.close()
+
+            except Exception as e:
+                tool_result = {
+                    "status": "error",
+                    "error": f"PostgreSQL query error: {str(e)}",
+                    "query": limited_query,
+                }
 
-                            await add_chat_completion_message(
-                                ChatCompletionToolMessageParam(
-                                    role="tool",
-                                    tool_call_id=tool_call.id,
-                                    content=json_dumps_safe(tool_result),
-                                )
-                            )
-                        elif function_name == "set_layer_style":
-                            layer_id = tool_args.get("layer_id")
-                            maplibre_json_layers_str = tool_args.get(
-                                "maplibre_json_layers_str"
-                            )
+    return tool_result
 
-                            if not layer_id or not maplibre_json_layers_str:
-                                tool_result = {
-                                    "status": "error",
-                                    "error": "Missing required parameters (layer_id or maplibre_json_layers_str).",
-                                }
-                            else:
-                                try:
-                                    layers = json.loads(maplibre_json_layers_str)
-
-                                    layer_row = await conn.fetchrow(
-                                        """
-                                        SELECT *
-                                        FROM map_layers
-                                        WHERE layer_id = $1 AND owner_uuid = $2
-                                        """,
-                                        layer_id,
-                                        user_id,
-                                    )
-                                    if not layer_row:
-                                        raise HTTPException(
-                                            404, f"Layer {layer_id} not found"
-                                        )
-                                    layer = MapLayer(**dict(layer_row))
 
-                                    async with kue_ephemeral_action(
-                                        conversation.id,
-                                        f"Styling layer {layer.name}...",
-                                        update_style_json=True,
-                                    ):
-                                        style_response = await set_layer_style_route(
-                                            request=SetStyleRequest(
-                                                maplibre_json_layers=layers,
-                                                map_id=map_id,
-                                            ),
-                                            layer=layer,
-                                            user_id=user_id,
-                                        )
+def pydantic_tool_handler(
+    fn: ToolFn, ArgModel: type[BaseModel], MundiModel: type[BaseModel]
+) -> ToolHandler:
+    async def handler(
+        ctx: ToolCallContext,
+        tool_call: ChatCompletionMessageToolCall,
+        tool_args: dict,
+    ) -> dict:
+        try:
+            parsed_args = ArgModel(**(tool_args or {}))
+        except Exception as e:
+            return {
+                "status": "error",
+                "error": f"Invalid arguments for {tool_call.function.name}: {e}",
+            }
+
+        try:
+            mundi_args = MundiModel(
+                user_uuid=ctx.user_id,
+                conversation_id=ctx.conversation_id,
+                map_id=ctx.map_id,
+                project_id=ctx.project_id,
+                session=ctx.session,
+            )
+            # Execute tool (all tools are async)
+            return await fn(parsed_args, mundi_args)
+        except Exception:
+            return {
+                "status": "error",
+                "error": "Tool execution failed. Please try again or adjust the inputs.",
+            }
+
+    return handler
+
+
+def geoprocessing_tool_handler(tool_def: dict) -> ToolHandler:
+    async def handler(
+        ctx: ToolCallContext,
+        tool_call: ChatCompletionMessageToolCall,
+        tool_args: dict,
+    ) -> dict:
+        return await run_geoprocessing_tool(
+            tool_call, tool_def, ctx.user_id, ctx.map_id, ctx.conversation_id
+        )
+
+    return handler
+
+
+BUILTIN_TOOL_DEFINITIONS = [
+    {
+        "type": "function",
+        "function": {
+            "name": "new_layer_from_postgis",
+            "description": "Creates a new layer, given a PostGIS connection and query, and adds it to the map so the user can see it. Layer will automatically pull data from PostGIS. Modify style using the set_layer_style tool.",
+            "strict": True,
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "postgis_connection_id": {
+                        "type": "string",
+                        "description": "Unique PostGIS connection ID used as source",
+                    },
+                    "query": {
+                        "type": "string",
+                        "description": "SQL query to execute against PostGIS database for this layer, should list fetched columns for attributes that might be used for symbology (+ shape geometry). This query MUST alias the geometry column as 'geom' AND have a unique numeric id aliased as 'id'. Include newlines+spaces at ~55 column wrap",
+                    },
+                    "layer_name": {
+                        "type": "string",
+                        "description": "Sets a human-readable name for this layer. This name will appear in the layer list/legend for the user.",
+                    },
+                },
+                "required": [
+                    "postgis_connection_id",
+                    "query",
+                    "layer_name",
+                ],
+                "additionalProperties": False,
+            },
+        },
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "bloom_study",
+            "description": "Analyze the last bloom event and predict the next bloom for almond crops near a given address.",
+            "strict": True,
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "address": {
+                        "type": "string",
+                        "description": "Street address or location to analyze (e.g., '123 Main St, City, State').",
+                    },
+                },
+                "required": ["address"],
+                "additionalProperties": False,
+            },
+        },
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "pest_detection",
+            "description": "Detect pest damage in the almond orchard at an address from recent satellite imagery, alongside this season's bloom observation",
+            "strict": True,
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "address": {
+                        "type": "string",
+                        "description": "Street address or location to analyze (e.g., '123 Main St, City, State').",
+                    },
+                },
+                "required": ["address"],
+                "additionalProperties": False,
+            },
+        },
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "add_layer_to_map",
+            "description": "Shows a newly created or existing unattached layer on the user's current map and layer list. Use this after a geoprocessing step that creates a layer, or if the user asks to see an existing layer that isn't currently on their map.",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "layer_id": {
+                        "type": "string",
+                        "description": "The ID of the layer to add to the map. Choose from the layers listed in <UnattachedLayers>.",
+                    },
+                    "new_name": {
+                        "type": "string",
+                        "description": "Sets a new human-readable name for this layer. This name will appear in the layer list/legend for the user.",
+                    },
+                },
+                "required": ["layer_id", "new_name"],
+            },
+        },
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "set_layer_style",
+            "description": "Creates a new style for a layer with MapLibre JSON layers and immediately applies it as the active style",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "layer_id": {
+                        "type": "string",
+                        "description": "The ID of the layer to create and apply a style for",
+                    },
+                    "maplibre_json_layers_str": {
+                        "type": "string",
+                        "description": 'JSON string of MapLibre layer objects. Example: [{"id": "LZJ5RmuZr6qN-line", "type": "line", "source": "LZJ5RmuZr6qN", "paint": {"line-color": "#1E90FF"}}]',
+                    },
+                },
+                "required": ["layer_id", "maplibre_json_layers_str"],
+            },
+        },
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "query_duckdb_sql",
+            "description": "Execute a SQL query against vector layer data using DuckDB. Use query_postgis_database for layers created from PostGIS connections instead.",
+            "strict": True,
+            "parameters": {
+                "type": "object",
+                "required": ["layer_ids", "sql_query", "head_n_rows"],
+                "properties": {
+                    "layer_ids": {
+                        "type": "array",
+                        "description": "Load these vector layer IDs as tables",
+                        "items": {"type": "string"},
+                    },
+                    "sql_query": {
+                        "type": "string",
+                        "description": "DuckDB-flavored SELECT ... SQL query. Include newlines+spaces at ~55 column wrap for readability e.g. SELECT name_en,county\n    FROM LCH6Na2SBvJr\n    ORDER BY id",
+                    },
+                    "head_n_rows": {
+                        "type": "number",
+                        "description": "Truncate result to n rows (increase gingerly, MUST specify returned columns), n=20 is good",
+                    },
+                },
+                "additionalProperties": False,
+            },
+        },
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "query_postgis_database",
+            "description": "Execute SQL queries on connected PostgreSQL/PostGIS databases. Use for data analysis, spatial queries, and exploring database tables. The query MUST include a LIMIT clause with a value less than 1000.",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "postgis_connection_id": {
+                        "type": "string",
+                        "description": "User's PostGIS connection ID to query against",
+                    },
+                    "sql_query": {
+                        "type": "string",
+                        "description": "SQL query to execute. Use newlines+spaces at ~55 column wrap. Examples: 'SELECT COUNT(*) FROM table_name', 'SELECT * FROM spatial_table LIMIT 10', 'SELECT column_name FROM information_schema.columns WHERE table_name = \"my_table\"'. Use standard SQL syntax.",
+                    },
+                },
+                "required": ["postgis_connection_id", "sql_query"],
+                "additionalProperties": False,
+            },
+        },
+    },
+]
+
+BUILTIN_TOOL_HANDLERS: dict[str, ToolHandler] = {
+    "new_layer_from_postgis": run_new_layer_from_postgis_tool,
+    "bloom_study": run_bloom_study_tool,
+    "pest_detection": run_pest_detection_tool,
+    "add_layer_to_map": run_add_layer_to_map_tool,
+    "set_layer_style": run_set_layer_style_tool,
+    "query_duckdb_sql": run_query_duckdb_sql_tool,
+    "query_postgis_database": run_query_postgis_database_tool,
+}
+
+# Built-in tools that can add layers to the map or create unattached layers
+MAP_CHANGING_TOOLS = {"new_layer_from_postgis", "add_layer_to_map", "bloom_study"}
+# Built-in tools that write to the map, these never run concurrently in a turn
+MAP_MUTATING_TOOLS = MAP_CHANGING_TOOLS | {"set_layer_style"}
+
+# Process-wide limits on concurrent calls per tool, protecting the QGIS
+# service, user databases and Earth Engine from a burst of parallel calls
+TOOL_CONCURRENCY_LIMITS = {
+    "bloom_study": 2,
+    "pest_detection": 2,
+    "query_postgis_database": 4,
+    "new_layer_from_postgis": 4,
+    "query_duckdb_sql": 4,
+}
+GEOPROCESSING_CONCURRENCY_LIMIT = int(
+    os.environ.get("MUNDI_GEOPROCESSING_CONCURRENCY", "4")
+)
+# Tool calls of one turn that run at once, each holds database connections
+CHAT_TOOL_FANOUT = int(os.environ.get("MUNDI_CHAT_TOOL_FANOUT", "4"))
+# A built-in tool's own connection, plus the lookups bloom_study runs
+# concurrently with it
+TOOL_CALL_CONNECTIONS = 3
+
+
+def build_tool_registry(pydantic_tool_calls: PydanticToolRegistry) -> ToolRegistry:
+    registry = ToolRegistry()
+    for definition in BUILTIN_TOOL_DEFINITIONS:
+        name = definition["function"]["name"]
+        registry.register(
+            RegisteredTool(
+                name,
+                "builtin",
+                definition,
+                BUILTIN_TOOL_HANDLERS[name],
+                changes_map=name in MAP_CHANGING_TOOLS,
+                mutates_map=name in MAP_MUTATING_TOOLS,
+                max_concurrency=TOOL_CONCURRENCY_LIMITS.get(
+                    name, DEFAULT_TOOL_CONCURRENCY
+                ),
+            )
+        )
+
+    # pydantic tools such as download_from_openstreetmap may create layers
+    for name, (fn, arg_model, mundi_model) in pydantic_tool_calls.items():
+        registry.register(
+            RegisteredTool(
+                name,
+                "pydantic",
+                tool_from_pyd(fn, arg_model),
+                pydantic_tool_handler(fn, arg_model, mundi_model),
+                changes_map=True,
+                mutates_map=True,
+            )
+        )
+
+    # every QGIS algorithm writes a new unattached output layer
+    for tool_def in get_tools():
+        registry.register(
+            RegisteredTool(
+                tool_def["function"]["name"],
+                "geoprocessing",
+                tool_def,
+                geoprocessing_tool_handler(tool_def),
+                changes_map=True,
+                max_concurrency=GEOPROCESSING_CONCURRENCY_LIMIT,
+            )
+        )
+    return registry
+
+
+_tool_registries: dict[tuple, ToolRegistry] = {}
+
+
+def get_tool_registry(
+    pydantic_tool_calls: PydanticToolRegistry = Depends(get_pydantic_tool_calls),
+) -> ToolRegistry:
+    """Registry of every tool Kue can call, built once per set of pydantic tools."""
+    key = tuple((name, *entry) for name, entry in sorted(pydantic_tool_calls.items()))
+    registry = _tool_registries.get(key)
+    if registry is None:
+        registry = build_tool_registry(pydantic_tool_calls)
+        _tool_registries[key] = registry
+    return registry
+
+
+def unattached_layers_message(layer_enum: dict[str, str]) -> dict:
+    """Trailing system message listing layers add_layer_to_map can attach.
+
+    This used to be an enum inside the tool schema, which changed the prompt
+    prefix whenever a layer was created and defeated provider prompt caching.
+    """
+    if not layer_enum:
+        return {"role": "system", "content": "<UnattachedLayers />"}
+    lines = [
+        f"{layer_id}: {description}" for layer_id, description in layer_enum.items()
+    ]
+    return {
+        "role": "system",
+        "content": "<UnattachedLayers>\n" + "\n".join(lines) + "\n</UnattachedLayers>",
+    }
+
+
+# Minimum time between streamed progress updates sent to the client
+STREAM_UPDATE_INTERVAL_SECONDS = 0.1
+
+
+async def stream_chat_completion(
+    client, conversation_id: int, **create_args
+) -> ChatCompletionMessage:
+    """Run a streamed chat completion, relaying progress over the websocket.
+
+    Returns the assembled assistant message, the same message a non-streamed
+    request would have returned.
+    """
+    response = await client.chat.completions.create(**create_args, stream=True)
+    # providers that ignore stream=True hand back the whole completion
+    if hasattr(response, "choices"):
+        return response.choices[0].message
+
+    action_id = str(uuid.uuid4())
+    content_parts: list[str] = []
+    tool_calls: dict[int, dict] = {}
+    last_update = 0.0
+
+    def describe() -> str:
+        names = [
+            tool_call["function"]["name"]
+            for _, tool_call in sorted(tool_calls.items())
+            if tool_call["function"]["name"]
+        ]
+        if names:
+            return f"Calling {', '.join(names)}..."
+        return "Kue is writing..." if content_parts else "Kue is thinking..."
+
+    try:
+        async for chunk in response:
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta
+            if delta.content:
+                content_parts.append(delta.content)
+            for tool_call_delta in delta.tool_calls or []:
+                tool_call = tool_calls.setdefault(
+                    tool_call_delta.index,
+                    {
+                        "id": "",
+                        "type": "function",
+                        "function": {"name": "", "arguments": ""},
+                    },
+                )
+                if tool_call_delta.id:
+                    tool_call["id"] = tool_call_delta.id
+                if tool_call_delta.function is not None:
+                    tool_call["function"]["name"] += tool_call_delta.function.name or ""
+                    tool_call["function"]["arguments"] += (
+                        tool_call_delta.function.arguments or ""
+                    )
+
+            now = time.monotonic()
+            if now - last_update >= STREAM_UPDATE_INTERVAL_SECONDS:
+                last_update = now
+                await kue_stream_update(
+                    conversation_id, action_id, describe(), "".join(content_parts)
+                )
+    finally:
+        await kue_stream_update(
+            conversation_id,
+            action_id,
+            describe(),
+            "".join(content_parts),
+            status="completed",
+        )
+
+    return ChatCompletionMessage(
+        role="assistant",
+        content="".join(content_parts) or None,
+        tool_calls=[
+            ChatCompletionMessageToolCall(**tool_call)
+            for _, tool_call in sorted(tool_calls.items())
+        ]
+        or None,
+    )
+
+
+async def run_tool_call(
+    tool: RegisteredTool,
+    ctx: ToolCallContext,
+    tool_call: ChatCompletionMessageToolCall,
+    tool_args: dict,
+    map_lock: asyncio.Lock,
+    fanout: Optional[asyncio.Semaphore] = None,
+) -> dict:
+    # tools that write to the map run one at a time within a turn, the rest
+    # only wait for a free slot under their per-tool limit, and then for one
+    # of the turn's CHAT_TOOL_FANOUT slots
+    async with map_lock if tool.mutates_map else contextlib.nullcontext():
+        async with tool.semaphore, fanout or contextlib.nullcontext():
+            # the chat task's connection is busy persisting messages, so
+            # built-in tools check out their own. Pydantic and geoprocessing
+            # tools manage connections themselves.
+            async with (
+                async_conn(f"tool.{tool.name}")
+                if tool.kind == "builtin"
+                else contextlib.nullcontext()
+            ) as tool_conn:
+                with tracer.start_as_current_span(f"kue.{tool.name}"):
+                    try:
+                        return await tool.handler(
+                            ctx.with_conn(tool_conn), tool_call, tool_args
+                        )
+                    except Exception as e:
+                        # the other calls of the turn carry on, and the model
+                        # gets a result for every call it made
+                        logger.exception(f"Tool {tool.name} failed")
+                        return {
+                            "status": "error",
+                            "error": f"{tool.name} failed: {e}",
+                        }
+
+
+async def process_chat_interaction_task(
+    request: Request,  # Keep request for get_map_messages
+    map_id: str,
+    session: UserContext,  # Pass session for auth
+    user_id: str,  # Pass user_id directly
+    chat_args: ChatArgsProvider,
+    map_state: MapStateProvider,
+    conversation: Conversation,
+    system_prompt_provider: SystemPromptProvider,
+    connection_manager: PostgresConnectionManager,
+    tool_registry: ToolRegistry,
+    history_compactor: ChatHistoryCompactor,
+):
+    # kick it off with a quick sleep, to detach from the event loop blocking /send
+    await asyncio.sleep(0.1)
+
+    async with (
+        chat_cancellations.watch(map_id) as cancelled,
+        async_conn("process_chat_interaction_task") as conn,
+    ):
+        # History is loaded once, every message persisted below is also
+        # appended here so the loop never re-reads the whole conversation
+        with tracer.start_as_current_span("kue.fetch_messages"):
+            history = await get_all_conversation_messages(conversation.id, session)
+        state = ConversationState([msg.message_json for msg in history])
+        # the system prompt and tool definitions are byte-identical on every
+        # iteration so providers can reuse their cached prompt prefix
+        system_message = {
+            "role": "system",
+            "content": system_prompt_provider.get_system_prompt(),
+        }
+        tools_payload = tool_registry.definitions()
+        tools_tokens = estimate_tokens(tool_registry.definitions_json())
+
+        async def add_chat_completion_message(
+            message: Union[ChatCompletionMessage, ChatCompletionMessageParam],
+        ):
+            message_dict = (
+                message.model_dump() if isinstance(message, BaseModel) else message
+            )
+
+            await conn.execute(
+                """
+                INSERT INTO chat_completion_messages
+                (map_id, sender_id, message_json, conversation_id)
+                VALUES ($1, $2, $3, $4)
+                """,
+                map_id,
+                user_id,
+                json.dumps(message_dict),
+                conversation.id,
+            )
+            state.messages.append(message_dict)
+
+        with tracer.start_as_current_span("app.process_chat_interaction") as span:
+            for i in range(25):
+                # Check if the message processing has been cancelled
+                if cancelled.is_set():
+                    break
 
-                                    tool_result = {
-                                        "status": "success",
-                                        "style_id": style_response.style_id,
-                                        "layer_id": style_response.layer_id,
-                                        "message": f"Style {style_response.style_id} created and applied to layer {layer_id}",
-                                    }
-
-                                except json.JSONDecodeError as e:
-                                    tool_result = {
-                                        "status": "error",
-                                        "error": f"Invalid JSON format: {str(e)}",
-                                        "layer_id": layer_id,
-                                    }
-                                except Exception as e:
-                                    tool_result = {
-                                        "status": "error",
-                                        "error": f"Failed to create and apply style: {str(e)}",
-                                        "layer_id": layer_id,
-                                    }
-
-                            await add_chat_completion_message(
-                                ChatCompletionToolMessageParam(
-                                    role="tool",
-                                    tool_call_id=tool_call.id,
-                                    content=json_dumps_safe(tool_result),
-                                ),
+                client = get_openai_client(request)
+
+                # unattached layers are only re-read once a tool has touched
+                # the map's layers
+                if state.map_changed:
+                    with tracer.start_as_current_span("kue.fetch_unattached_layers"):
+                        layer_enum = await fetch_unattached_layer_enum(conn, user_id)
+                    map_state_message = unattached_layers_message(layer_enum)
+                    state.map_changed = False
+
+                # keep the request under the token budget, the persisted
+                # history itself is never modified
+                with tracer.start_as_current_span("kue.compact_history") as hspan:
+                    openai_messages = history_compactor.compact(
+                        state.messages,
+                        reserved_tokens=tools_tokens
+                        + estimate_tokens(
+                            json.dumps([system_message, map_state_message])
+                        ),
+                    )
+                    hspan.set_attribute("kue.history.messages", len(state.messages))
+                    hspan.set_attribute(
+                        "kue.history.messages_sent", len(openai_messages)
+                    )
+
+                # Replace the thinking ephemeral updates with context manager
+                async with kue_ephemeral_action(conversation.id, "Kue is thinking..."):
+                    chat_completions_args = await chat_args.get_args(
+                        user_id, "send_map_message_async"
+                    )
+                    with tracer.start_as_current_span(
+                        "kue.openai.chat.completions.create"
+                    ):
+                        # chat.completions.create fails for bad messages and tools, so
+                        # if we have orphaned tool calls then we'll get an error - but not
+                        # handling it properly makes for a horrible user experience
+                        llm_started = time.monotonic()
+                        try:
+                            assistant_message = await stream_chat_completion(
+                                client,
+                                conversation.id,
+                                **chat_completions_args,
+                                # system prompt, tools and history form a prefix
+                                # that only grows, dynamic map state goes last
+                                messages=[system_message]
+                                + openai_messages
+                                + [map_state_message],
+                                tools=tools_payload if tools_payload else None,
+                                tool_choice="auto" if tools_payload else None,
                             )
-                        elif function_name == "query_postgis_database":
-                            postgis_connection_id = tool_args.get(
-                                "postgis_connection_id"
+                            # provider latency drives admission of queued chats
+                            await get_chat_run_queue().record_llm_latency(
+                                time.monotonic() - llm_started
                             )
-                            sql_query = tool_args.get("sql_query")
-
-                            if not postgis_connection_id or not sql_query:
-                                tool_result = {
-                                    "status": "error",
-                                    "error": "Missing required parameters (postgis_connection_id or sql_query)",
-                                }
+                        except APIError as e:
+                            if e.code == "context_length_exceeded":
+                                await kue_notify_error(
+                                    conversation.id,
+                                    "Maximum context length for LLM has been reached. Please create a new chat to continue using the chat feature.",
+                                )
                             else:
-                                # Verify the PostGIS connection exists and user has access
-                                connection_result = await conn.fetchrow(
-                                    """
-                                    SELECT connection_uri FROM project_postgres_connections
-                                    WHERE id = $1 AND user_id = $2
-                                    """,
-                                    postgis_connection_id,
-                                    user_id,
+                                await kue_notify_error(
+                                    conversation.id,
+                                    "Error connecting to LLM. If trying again doesn't work, create a new chat in the top right to reset the chat history.",
                                 )
-
-                                if not connection_result:
-                                    tool_result = {
-                                        "status": "error",
-                                        "error": f"PostGIS connection '{postgis_connection_id}' not found or you do not have access to it.",
-                                    }
-                                else:
-                                    try:
-                                        # Check if LIMIT is already present and validate it
-                                        limited_query = sql_query.strip()
-                                        limit_match = re.search(
-                                            r"\bLIMIT\s+(\d+)\b",
-                                            limited_query,
-                                            re.IGNORECASE,
-                                        )
-
-                                        if limit_match:
-                                            limit_value = int(limit_match.group(1))
-                                            if limit_value > 1000:
-                                                tool_result = {
-                                                    "status": "error",
-                                                    "error": f"LIMIT value {limit_value} exceeds maximum allowed limit of 1000",
-                                                }
-                                                await add_chat_completion_message(
-                                                    ChatCompletionToolMessageParam(
-                                                        role="tool",
-                                                        tool_call_id=tool_call.id,
-                                                        content=json_dumps_safe(tool_result),
-                                                    ),
-                                                )
-                                                continue
-                                        else:
-                                            # No LIMIT found, require explicit LIMIT
-                                            tool_result = {
-                                                "status": "error",
-                                                "error": "Query must include a LIMIT clause with a value less than 1000",
-                                            }
-                                            await add_chat_completion_message(
-                                                ChatCompletionToolMessageParam(
-                                                    role="tool",
-                                                    tool_call_id=tool_call.id,
-                                                    content=json_dumps_safe(tool_result),
-                                                ),
-                                            )
-                                            continue
-
-                                        async with kue_ephemeral_action(
-                                            conversation.id,
-                                            "Querying PostgreSQL database...",
-                                        ):
-                                            postgres_conn = await connection_manager.connect_to_postgres(
-                                                postgis_connection_id
-                                            )
-                                            try:
-                                                # Execute the query
-                                                rows = await postgres_conn.fetch(
-                                                    limited_query
-                                                )
-
-                                                if not rows:
-                                                    tool_result = {
-                                                        "status": "success",
-                                                        "message": "Query executed successfully but returned no rows",
-                                                        "row_count": 0,
-                                                        "query": limited_query,
-                                                    }
-                                                else:
-                                                    # Convert rows to list of dicts
-                                                    result_data = [
-                                                        dict(row) for row in rows
-                                                    ]
-
-                                                    # Format the result as a readable string
-                                                    if (
-                                                        len(result_data) == 1
-                                                        and len(result_data[0]) == 1
-                                                    ):
-                                                        # Single value result
-                                                        single_value = list(
-                                                            result_data[0].values()
-                                                        )[0]
-                                                        result_text = f"Query result: {single_value}"
-                                                    else:
-                                                        # Table format
-                                                        if result_data:
-                                                            headers = list(
-                                                                result_data[0].keys()
-                                                            )
-                                                            result_lines = [
-                                                                "\t".join(headers)
-                                                            ]
-                                                            for row in result_data:
-                                                                result_lines.append(
-                                                                    "\t".join(
-                                                                        str(
-                                                                            row.get(
-                                                                                h, ""
-                                                                            )
-                                                                        )
-                                                                        for h in headers
-                                                                    )
-                                                                )
-                                                            result_text = "\n".join(
-                                                                result_lines
-                                                            )
-                                                        else:
-                                                            result_text = "No results"
-
-                                                    # Check if result is too large
-                                                    if len(result_text) > 25000:
-                                                        tool_result = {
-                                                            "status": "error",
-                                                            "error": f"Query result too large: {len(result_text)} characters exceeds 25,000 character limit. Try reducing the number of columns or rows.",
-                                                        }
-                                                    else:
-                                                        tool_result = {
-                                                            "status": "success",
-                                                            "result": result_text,
-                                                            "row_count": len(
-                                                                result_data
-                                                            ),
-                                                            "query": limited_query,
-                                                        }
-                                            finally:
-                                                await postgres_conn.close()
-
-                                    except Exception as e:
-                                        tool_result = {
-                                            "status": "error",
-                                            "error": f"PostgreSQL query error: {str(e)}",
-                                            "query": limited_query,
-                                        }
-
-                            await add_chat_completion_message(
-                                ChatCompletionToolMessageParam(
-                                    role="tool",
-                                    tool_call_id=tool_call.id,
-                                    content=json_dumps_safe(tool_result),
-                                ),
+                            span.set_status(
+                                trace.Status(trace.StatusCode.ERROR, str(e))
                             )
-
-                        elif function_name in geoprocessing_function_names:
-                            tool_result = await run_geoprocessing_tool(
-                                tool_call,
-                                conn,
-                                user_id,
-                                map_id,
+                            span.set_attribute(
+                                "error.traceback", traceback.format_exc()
+                            )
+                            break
+                        except Exception as e:
+                            await kue_notify_error(
                                 conversation.id,
+                                "Error connecting to LLM. This is probably a bug with Mundi, please open a new issue on GitHub.",
                             )
-                            await add_chat_completion_message(
-                                ChatCompletionToolMessageParam(
-                                    role="tool",
-                                    tool_call_id=tool_call.id,
-                                    content=json_dumps_safe(tool_result),
-                                ),
+                            span.set_status(
+                                trace.Status(trace.StatusCode.ERROR, str(e))
                             )
-                        else:
-                            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST)
+                            span.set_attribute(
+                                "error.traceback", traceback.format_exc()
+                            )
+                            break
+                # after chat completions is a pretty common spot to get a cancelled message
+                if cancelled.is_set():
+                    break
+
+                # Store the assistant message in the database
+                await add_chat_completion_message(assistant_message)
+
+                # If no tool calls, break
+                if not assistant_message.tool_calls:
+                    break
+
+                # Fetch project_id for this map once for all tool calls
+                async with async_conn("tool.project_id_for_map") as proj_conn:
+                    row = await proj_conn.fetchrow(
+                        "SELECT project_id FROM user_mundiai_maps WHERE id = $1",
+                        map_id,
+                    )
+                    assert row is not None
+                    current_project_id: str = row["project_id"]
+
+                tool_context = ToolCallContext(
+                    request=request,
+                    conn=None,
+                    map_id=map_id,
+                    project_id=current_project_id,
+                    user_id=user_id,
+                    conversation_id=conversation.id,
+                    session=session,
+                    connection_manager=connection_manager,
+                )
+
+                # Resolve every tool call up front, then run them concurrently
+                tool_calls: list[ChatCompletionMessageToolCall] = (
+                    assistant_message.tool_calls
+                )
+                resolved_tools: list[RegisteredTool] = []
+                for tool_call in tool_calls:
+                    tool = tool_registry.get(tool_call.function.name)
+                    if tool is None:
+                        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST)
+                    if tool.changes_map:
+                        state.map_changed = True
+                    resolved_tools.append(tool)
+                    span.add_event(
+                        "kue.tool_call_started",
+                        {"tool_name": tool.name},
+                    )
+
+                map_lock = asyncio.Lock()
+                fanout = asyncio.Semaphore(CHAT_TOOL_FANOUT)
+                tool_tasks = [
+                    asyncio.ensure_future(
+                        run_tool_call(
+                            tool,
+                            tool_context,
+                            tool_call,
+                            json.loads(tool_call.function.arguments),
+                            map_lock,
+                            fanout,
+                        )
+                    )
+                    for tool, tool_call in zip(resolved_tools, tool_calls)
+                ]
+
+                # results are persisted in call order, each as soon as it and
+                # every call before it have finished
+                try:
+                    for tool_call, task in zip(tool_calls, tool_tasks):
+                        tool_result = await task
+                        await add_chat_completion_message(
+                            ChatCompletionToolMessageParam(
+                                role="tool",
+                                tool_call_id=tool_call.id,
+                                content=json_dumps_safe(tool_result),
+                            ),
+                        )
+                except BaseException:
+                    for task in tool_tasks:
+                        task.cancel()
+                    await asyncio.gather(*tool_tasks, return_exceptions=True)
+                    raise
 
             # Async connections auto-commit, no need for explicit commit
 
@@ -2182,8 +2309,61 @@ async def process_chat_interaction_task(
         # if conversation.title == "title pending":
         #     await label_conversation_inline(conversation.id)
 
-        # Unlock the map when processing is complete
-        redis.delete(f"chat_lock:{conversation.id}")
+
+async def execute_chat_run(
+    run: ChatRun,
+    request: Request,
+    session: UserContext,
+    chat_args: ChatArgsProvider,
+    map_state: MapStateProvider,
+    conversation: Conversation,
+    system_prompt_provider: SystemPromptProvider,
+    connection_manager: PostgresConnectionManager,
+    tool_registry: ToolRegistry,
+    history_compactor: ChatHistoryCompactor,
+):
+    # the conversation stays locked until the run finishes, however long
+    async with get_chat_run_queue().lease(run):
+        await process_chat_interaction_task(
+            request,
+            run.map_id,
+            session,
+            run.user_id,
+            chat_args,
+            map_state,
+            conversation,
+            system_prompt_provider,
+            connection_manager,
+            tool_registry,
+            history_compactor,
+        )
+
+
+async def run_queued_chat(run: ChatRun, app):
+    """Execute a run taken off the chat queue by a chat worker.
+
+    Resolves the same providers send_map_message would, honouring the app's
+    dependency overrides.
+    """
+
+    def resolve(dependency):
+        return app.dependency_overrides.get(dependency, dependency)()
+
+    session = StaticUserContext(run.user_id)
+    conversation = await get_conversation(run.conversation_id, session)
+    request = Request({"type": "http", "method": "POST", "headers": [], "app": app})
+    await execute_chat_run(
+        run,
+        request,
+        session,
+        resolve(get_chat_args_provider),
+        resolve(get_map_state_provider),
+        conversation,
+        resolve(get_system_prompt_provider),
+        resolve(get_postgres_connection_manager),
+        get_tool_registry(resolve(get_pydantic_tool_calls)),
+        resolve(get_chat_history_compactor),
+    )
 
 
 class MessageSendRequest(BaseModel):
@@ -2198,43 +2378,20 @@ class MessageSendResponse(BaseModel):
     status: str
 
 
-@router.post(
-    "/conversations/{conversation_id}/maps/{map_id}/send",
-    response_model=MessageSendResponse,
-    operation_id="send_map_message",
-)
-async def send_map_message(
+async def add_user_message(
     request: Request,
     map_id: str,
     body: MessageSendRequest,
-    background_tasks: BackgroundTasks,
-    await_end: bool = False,
-    conversation: Conversation = Depends(get_or_create_conversation),
-    session: UserContext = Depends(verify_session_required),
-    postgis_provider: Callable = Depends(get_postgis_provider),
-    layer_describer: LayerDescriber = Depends(get_layer_describer),
-    chat_args: ChatArgsProvider = Depends(get_chat_args_provider),
-    map_state: MapStateProvider = Depends(get_map_state_provider),
-    system_prompt_provider: SystemPromptProvider = Depends(get_system_prompt_provider),
-    connection_manager: PostgresConnectionManager = Depends(
-        get_postgres_connection_manager
-    ),
-    pydantic_tool_calls: PydanticToolRegistry = Depends(get_pydantic_tool_calls),
-):
-    # get_conversation authenticates
+    conversation: Conversation,
+    session: UserContext,
+    postgis_provider: Callable,
+    layer_describer: LayerDescriber,
+    map_state: MapStateProvider,
+    connection_manager: PostgresConnectionManager,
+) -> tuple[SanitizedMessage, str]:
+    """Store the user's message, preceded by any map state system messages."""
     user_id = session.get_user_id()
 
-    # Check if map is already being processed
-    lock_key = f"chat_lock:{conversation.id}"
-    if redis.get(lock_key):
-        raise HTTPException(
-            status_code=status.HTTP_409_CONFLICT,
-            detail="Conversation is currently being processed by another request",
-        )
-
-    # Lock the conversation for processing
-    redis.set(lock_key, "locked", ex=30)  # 30 second expiry
-
     # Use map state provider to generate system messages
     messages_response = await get_all_conversation_messages(conversation.id, session)
     current_messages = [msg.message_json for msg in messages_response]
@@ -2294,39 +2451,94 @@ async def send_map_message(
         user_msg = MundiChatCompletionMessage(**user_msg_dict)
         sanitized_user_msg = convert_mundi_message_to_sanitized(user_msg)
 
-    # Start processing either synchronously (await_end=True) or in background
-    if await_end:
-        await process_chat_interaction_task(
+    return sanitized_user_msg, str(user_msg_db["id"])
+
+
+@router.post(
+    "/conversations/{conversation_id}/maps/{map_id}/send",
+    response_model=MessageSendResponse,
+    operation_id="send_map_message",
+)
+async def send_map_message(
+    request: Request,
+    map_id: str,
+    body: MessageSendRequest,
+    background_tasks: BackgroundTasks,
+    await_end: bool = False,
+    conversation: Conversation = Depends(get_or_create_conversation),
+    session: UserContext = Depends(verify_session_required),
+    postgis_provider: Callable = Depends(get_postgis_provider),
+    layer_describer: LayerDescriber = Depends(get_layer_describer),
+    chat_args: ChatArgsProvider = Depends(get_chat_args_provider),
+    map_state: MapStateProvider = Depends(get_map_state_provider),
+    system_prompt_provider: SystemPromptProvider = Depends(get_system_prompt_provider),
+    connection_manager: PostgresConnectionManager = Depends(
+        get_postgres_connection_manager
+    ),
+    tool_registry: ToolRegistry = Depends(get_tool_registry),
+    history_compactor: ChatHistoryCompactor = Depends(get_chat_history_compactor),
+):
+    # get_conversation authenticates
+    user_id = session.get_user_id()
+
+    # Lock the conversation and take one of the user's chat slots, this
+    # rejects the message if either is busy or the chat queue is full
+    run = ChatRun.new(map_id, conversation.id, user_id)
+    queued = chat_execution_mode() == "queue" and not await_end
+    chat_run_queue = get_chat_run_queue()
+    await chat_run_queue.admit(run, queued=queued)
+    try:
+        sanitized_user_msg, user_msg_id = await add_user_message(
             request,
             map_id,
+            body,
+            conversation,
+            session,
+            postgis_provider,
+            layer_describer,
+            map_state,
+            connection_manager,
+        )
+    except BaseException:
+        await chat_run_queue.release(run)
+        raise
+
+    # Start processing either synchronously (await_end=True), on a chat
+    # worker (MUNDI_CHAT_EXECUTION=queue) or in the background of this process
+    if await_end:
+        await execute_chat_run(
+            run,
+            request,
             session,
-            user_id,
             chat_args,
             map_state,
             conversation,
             system_prompt_provider,
             connection_manager,
-            pydantic_tool_calls,
+            tool_registry,
+            history_compactor,
         )
+    elif queued:
+        await chat_run_queue.enqueue(run)
     else:
         background_tasks.add_task(
-            process_chat_interaction_task,
+            execute_chat_run,
+            run,
             request,
-            map_id,
             session,
-            user_id,
             chat_args,
             map_state,
             conversation,
             system_prompt_provider,
             connection_manager,
-            pydantic_tool_calls,
+            tool_registry,
+            history_compactor,
         )
 
     return MessageSendResponse(
         conversation_id=conversation.id,
         sent_message=sanitized_user_msg,
-        message_id=str(user_msg_db["id"]),
+        message_id=user_msg_id,
         status="processing_started",
     )
 
@@ -2360,6 +2572,6 @@ async def cancel_map_message(
                 headers={"WWW-Authenticate": "Bearer"},
             )
 
-        redis.set(f"messages:{map_id}:cancelled", "true", ex=300)  # 5 minute expiry
+        await chat_cancellations.cancel(map_id)
 
         return JSONResponse(content={"status": "cancelled"})
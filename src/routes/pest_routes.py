@@ -1,8 +1,9 @@
-from fastapi import APIRouter, Depends
-from pydantic import BaseModel, Field
-from typing import Optional
+from fastapi import APIRouter, Depends, HTTPException, status
+from pydantic import BaseModel, Field, model_validator
+from typing import Any, Dict, List, Optional
 from src.dependencies.session import UserContext, verify_session_required
-from src.services.pest import detect_pest
+from src.services.earth_engine import Region, region_from_geojson
+from src.services.pest import NO_IMAGERY_ERROR, detect_pest, get_pest_detector
 
 
 router = APIRouter()
@@ -24,6 +25,77 @@ async def pest_detection(
     request: PestDetectionRequest,
     session: UserContext = Depends(verify_session_required),
 ):
-    # Dummy implementation via service stub
-    return await detect_pest(request.latitude, request.longitude)
+    """Detect pests in the orchard around a location.
 
+    404 when no clear imagery covers the location, 503 when detection
+    itself failed and a retry may succeed.
+    """
+    result = await detect_pest(request.latitude, request.longitude)
+    if result["error"] == NO_IMAGERY_ERROR:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, detail=result["error"]
+        )
+    if result["error"] is not None:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail=result["error"]
+        )
+    return result
+
+
+class PestBatchField(BaseModel):
+    latitude: Optional[float] = Field(None, description="Latitude of a point location")
+    longitude: Optional[float] = Field(
+        None, description="Longitude of a point location"
+    )
+    geometry: Optional[Dict[str, Any]] = Field(
+        None, description="GeoJSON Polygon or MultiPolygon of an orchard block"
+    )
+
+    @model_validator(mode="after")
+    def point_or_geometry(self):
+        if self.geometry is None and (self.latitude is None or self.longitude is None):
+            raise ValueError("Each field needs latitude and longitude, or a geometry")
+        return self
+
+
+class PestBatchDetectionRequest(BaseModel):
+    fields: List[PestBatchField] = Field(..., min_length=1, max_length=5000)
+
+
+class PestBatchDetectionResult(BaseModel):
+    index: int
+    latitude: float
+    longitude: float
+    detected_pest: bool
+    confidence_score: Optional[float] = None
+    affected_fraction: Optional[float] = None
+    chip_count: int = 0
+    model_version: str
+    error: Optional[str] = None
+
+
+@router.post("/pest-detection/batch", response_model=List[PestBatchDetectionResult])
+async def pest_detection_batch(
+    request: PestBatchDetectionRequest,
+    session: UserContext = Depends(verify_session_required),
+):
+    """Detect pests over many orchard fields at once.
+
+    Chips of every field are scored together with those of concurrent
+    requests, so one call with many fields costs about as much model time
+    as the chips it contains. Results are in input order, a field without
+    clear imagery gets an `error` instead of failing the whole batch.
+    """
+    regions: List[Region] = []
+    for i, field in enumerate(request.fields):
+        if field.geometry is None:
+            regions.append(Region(field.latitude, field.longitude))
+            continue
+        try:
+            regions.append(region_from_geojson(field.geometry))
+        except (ValueError, KeyError, IndexError, TypeError) as e:
+            raise HTTPException(
+                status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                detail=f"Invalid geometry for field {i}: {e}",
+            )
+    return await get_pest_detector().detect_many(regions)
@@ -20,7 +20,7 @@ import secrets
 import json
 import csv
 import datetime
-from io import StringIO, BytesIO
+from io import StringIO
 from pathlib import Path
 from urllib.parse import urlparse
 import aiohttp
@@ -47,17 +47,16 @@ import logging
 from pyproj import Transformer
 from osgeo import osr
 from fastapi import File, UploadFile, Form
-from redis import Redis
 import tempfile
 from starlette.responses import (
     JSONResponse as StarletteJSONResponse,
 )
 import asyncio
-from boto3.s3.transfer import TransferConfig
 from src.utils import (
     get_bucket_name,
     process_zip_with_shapefile,
     get_async_s3_client,
+    get_presigned_get_url,
     process_kmz_to_kml,
 )
 from osgeo import gdal
@@ -67,7 +66,7 @@ import socket
 import laspy
 import shutil
 from src.symbology.llm import generate_maplibre_layers_for_layer_id
-from src.routes.layer_router import describe_layer_internal
+from src.routes.layer_router import create_cog, describe_layer_internal
 from src.structures import get_async_db_connection, async_conn
 from src.dependencies.base_map import BaseMapProvider, get_base_map_provider
 from src.dependencies.postgis import get_postgis_provider
@@ -80,6 +79,13 @@ from typing import Callable
 from opentelemetry import trace
 from opentelemetry.trace import Status, StatusCode
 from src.dag import DAGEditOperationResponse
+from src import s3_transfer
+from src.map_style_cache import (
+    MAP_STYLE_FINGERPRINT_SQL,
+    CachedMapStyle,
+    etag_matches,
+    map_style_cache,
+)
 
 fiona.drvsupport.supported_drivers["WFS"] = "r"  # type: ignore[attr-defined]
 fiona.drvsupport.supported_drivers["PMTiles"] = "r"  # type: ignore[attr-defined]
@@ -89,12 +95,6 @@ fiona.drvsupport.supported_drivers["KML"] = "r"  # type: ignore[attr-defined]
 logger = logging.getLogger(__name__)
 tracer = trace.get_tracer(__name__)
 
-redis = Redis(
-    host=os.environ["REDIS_HOST"],
-    port=int(os.environ["REDIS_PORT"]),
-    decode_responses=True,
-)
-
 
 class MetadataUpdates(BaseModel):
     original_srid: Optional[int] = None
@@ -377,8 +377,6 @@ router = APIRouter()
 # Create separate router for basemap endpoints
 basemap_router = APIRouter()
 
-one_shot_config = TransferConfig(multipart_threshold=5 * 1024**3)  # 5 GiB
-
 
 def generate_id(length=12, prefix=""):
     """Generate a unique ID for the map or layer.
@@ -901,8 +899,21 @@ async def get_map_style(
     basemap: Optional[str] = None,
     base_map: BaseMapProvider = Depends(get_base_map_provider),
 ):
-    return await get_map_style_internal(
-        str(map.id), base_map, only_show_inline_sources, override_layers, basemap
+    if override_layers is not None:
+        return await get_map_style_internal(
+            str(map.id), base_map, only_show_inline_sources, override_layers, basemap
+        )
+
+    cached_style = await get_cached_map_style(
+        str(map.id), base_map, only_show_inline_sources, basemap
+    )
+    # no-cache lets browsers keep the body but forces revalidation on every load
+    headers = {"ETag": cached_style.etag, "Cache-Control": "no-cache"}
+    if etag_matches(request.headers.get("if-none-match"), cached_style.etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+    return Response(
+        content=cached_style.body, media_type="application/json", headers=headers
     )
 
 
@@ -972,6 +983,48 @@ async def render_basemap(
     return response
 
 
+# styles with inline sources embed presigned URLs that are handed out with at
+# least 5 minutes left, so they must leave the cache well before those expire
+INLINE_SOURCES_STYLE_TTL_SECONDS = 120
+
+
+async def fetch_map_style_fingerprint(map_id: str):
+    async with async_conn("get_map_style_internal.fingerprint") as conn:
+        map_result = await conn.fetchrow(MAP_STYLE_FINGERPRINT_SQL, map_id)
+
+    if map_result is None:
+        raise HTTPException(status_code=404, detail="Map not found")
+    return map_result
+
+
+async def get_cached_map_style(
+    map_id: str,
+    base_map: BaseMapProvider,
+    only_show_inline_sources: bool = False,
+    basemap: Optional[str] = None,
+) -> CachedMapStyle:
+    map_result = await fetch_map_style_fingerprint(map_id)
+    fingerprint = map_result["style_fingerprint"]
+
+    cache = map_style_cache()
+    cache_key = (map_id, type(base_map).__name__, basemap, only_show_inline_sources)
+    cached_style = cache.get(cache_key, fingerprint)
+    if cached_style is not None:
+        return cached_style
+
+    style_json = await build_map_style(
+        map_id, map_result, base_map, only_show_inline_sources, None, basemap
+    )
+    return cache.set(
+        cache_key,
+        fingerprint,
+        style_json,
+        ttl_seconds=(
+            INLINE_SOURCES_STYLE_TTL_SECONDS if only_show_inline_sources else None
+        ),
+    )
+
+
 async def get_map_style_internal(
     map_id: str,
     base_map: BaseMapProvider,
@@ -979,21 +1032,34 @@ async def get_map_style_internal(
     override_layers: Optional[str] = None,
     basemap: Optional[str] = None,
 ):
-    # Get vector layers for this map from the database
-    async with async_conn("get_map_style_internal.fetch_layers") as conn:
-        # Get layers and basemap from the map
-        map_result = await conn.fetchrow(
-            """
-            SELECT layers, basemap
-            FROM user_mundiai_maps
-            WHERE id = $1 AND soft_deleted_at IS NULL
-            """,
+    # override_layers previews are one-off, so don't let them into the cache
+    if override_layers is not None:
+        map_result = await fetch_map_style_fingerprint(map_id)
+        return await build_map_style(
             map_id,
+            map_result,
+            base_map,
+            only_show_inline_sources,
+            override_layers,
+            basemap,
         )
 
-        if map_result is None:
-            raise HTTPException(status_code=404, detail="Map not found")
+    cached_style = await get_cached_map_style(
+        map_id, base_map, only_show_inline_sources, basemap
+    )
+    return cached_style.style_json()
 
+
+async def build_map_style(
+    map_id: str,
+    map_result,
+    base_map: BaseMapProvider,
+    only_show_inline_sources: bool = False,
+    override_layers: Optional[str] = None,
+    basemap: Optional[str] = None,
+):
+    # Get vector layers for this map from the database
+    async with async_conn("get_map_style_internal.fetch_layers") as conn:
         # Get layers from the layer list
         layer_ids = map_result["layers"]
         if not layer_ids:
@@ -1135,14 +1201,7 @@ async def get_map_style_internal(
             pmtiles_key = metadata.get("pmtiles_key")
             assert pmtiles_key is not None
 
-            bucket_name = get_bucket_name()
-            s3_client = await get_async_s3_client()
-
-            presigned_url = await s3_client.generate_presigned_url(
-                "get_object",
-                Params={"Bucket": bucket_name, "Key": pmtiles_key},
-                ExpiresIn=180,  # URL valid for 3 minutes
-            )
+            presigned_url = await get_presigned_get_url(get_bucket_name(), pmtiles_key)
 
             style_json["sources"][layer_id] = {
                 "type": "vector",
@@ -1317,6 +1376,61 @@ async def upload_layer(
     )
 
 
+async def insert_map_layer(
+    conn,
+    layer_id: str,
+    user_id: str,
+    name: str,
+    layer_type: str,
+    metadata: dict,
+    bounds,
+    s3_key: str,
+    size_bytes: int,
+    map_id: str,
+    geometry_type: str | None = None,
+    feature_count: int | None = None,
+) -> None:
+    await conn.execute(
+        """
+        INSERT INTO map_layers
+        (layer_id, owner_uuid, name, type, metadata, bounds, geometry_type, feature_count, s3_key, size_bytes, source_map_id)
+        VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9, $10, $11)
+        """,
+        layer_id,
+        user_id,
+        name,
+        layer_type,
+        json.dumps(metadata),
+        bounds,
+        geometry_type,
+        feature_count,
+        s3_key,
+        size_bytes,
+        map_id,
+    )
+
+
+async def append_layers_to_map(conn, map_id: str, layer_ids: list[str]) -> None:
+    map_data = await conn.fetchrow(
+        """
+        SELECT layers FROM user_mundiai_maps
+        WHERE id = $1
+        """,
+        map_id,
+    )
+    current_layers = map_data["layers"] if map_data and map_data["layers"] else []
+    await conn.execute(
+        """
+        UPDATE user_mundiai_maps
+        SET layers = $1,
+            last_edited = CURRENT_TIMESTAMP
+        WHERE id = $2
+        """,
+        current_layers + layer_ids,
+        map_id,
+    )
+
+
 async def internal_upload_layer(
     map_id: str,
     file: UploadFile,
@@ -1361,8 +1475,6 @@ async def internal_upload_layer(
         # Generate S3 key using user UUID, project ID and layer ID
         s3_key = f"uploads/{user_id}/{project_id}/{layer_id}{file_ext}"
 
-        # Create S3 client
-        s3_client = await get_async_s3_client()
         bucket_name = get_bucket_name()
 
         # Save uploaded file to a temporary location
@@ -1532,9 +1644,7 @@ async def internal_upload_layer(
                 temp_dir = pc.temp_dir
 
             # Upload file to S3/MinIO
-            await s3_client.upload_file(
-                temp_file_path, bucket_name, s3_key, Config=one_shot_config
-            )
+            await s3_transfer.upload_file(temp_file_path, bucket_name, s3_key)
 
             # Unify: always handle as a list of layers and return the first
             created_layer_ids: list[str] = []
@@ -1573,23 +1683,19 @@ async def internal_upload_layer(
                         **lr.metadata.model_dump(exclude_none=True),
                     }
 
-                    await conn.execute(
-                        """
-                        INSERT INTO map_layers
-                        (layer_id, owner_uuid, name, type, metadata, bounds, geometry_type, feature_count, s3_key, size_bytes, source_map_id)
-                        VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9, $10, $11)
-                        """,
+                    await insert_map_layer(
+                        conn,
                         this_layer_id,
                         user_id,
                         display_name,
                         layer_type,
-                        json.dumps(per_md),
+                        per_md,
                         lr.bounds,
-                        lr.geometry_type,
-                        lr.feature_count,
                         s3_key,
                         file_size_bytes,
                         map_id,
+                        geometry_type=lr.geometry_type,
+                        feature_count=lr.feature_count,
                     )
 
                     if lr.geometry_type and lr.geometry_type != "unknown":
@@ -1626,20 +1732,14 @@ async def internal_upload_layer(
                 # raster/point cloud as single item
                 if layer_type == "raster":
                     bounds = preprocess_raster(temp_file_path, metadata_dict)
-                await conn.execute(
-                    """
-                    INSERT INTO map_layers
-                    (layer_id, owner_uuid, name, type, metadata, bounds, geometry_type, feature_count, s3_key, size_bytes, source_map_id)
-                    VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9, $10, $11)
-                    """,
+                await insert_map_layer(
+                    conn,
                     layer_id,
                     user_id,
                     layer_name,
                     layer_type,
-                    json.dumps(metadata_dict),
+                    metadata_dict,
                     bounds,
-                    None,
-                    None,
                     s3_key,
                     file_size_bytes,
                     map_id,
@@ -1654,26 +1754,7 @@ async def internal_upload_layer(
 
         # Update map layers if requested
         if add_layer_to_map and created_layer_ids:
-            map_data = await conn.fetchrow(
-                """
-                SELECT layers FROM user_mundiai_maps
-                WHERE id = $1
-                """,
-                map_id,
-            )
-            current_layers = (
-                map_data["layers"] if map_data and map_data["layers"] else []
-            )
-            await conn.execute(
-                """
-                UPDATE user_mundiai_maps
-                SET layers = $1,
-                    last_edited = CURRENT_TIMESTAMP
-                WHERE id = $2
-                """,
-                current_layers + created_layer_ids,
-                map_id,
-            )
+            await append_layers_to_map(conn, map_id, created_layer_ids)
 
         # Cleanup temp_dir if it exists
         if temp_dir:
@@ -1698,6 +1779,98 @@ async def internal_upload_layer(
         )
 
 
+def remote_download_max_bytes() -> int:
+    return int(os.environ.get("MUNDI_REMOTE_DOWNLOAD_MAX_MB", "2048")) * 2**20
+
+
+async def stream_download(url: str, path: str) -> str:
+    """Stream a remote file to `path` in 1 MiB chunks, so memory use does not
+    grow with the file. Returns the response's lowercased Content-Type."""
+    max_bytes = remote_download_max_bytes()
+    written = 0
+    async with aiohttp.ClientSession() as http_session:
+        async with http_session.get(url) as resp:
+            if resp.status != 200:
+                raise HTTPException(
+                    status_code=status.HTTP_400_BAD_REQUEST,
+                    detail=f"Unable to download remote file: HTTP {resp.status}",
+                )
+            with open(path, "wb") as f:
+                async for chunk in resp.content.iter_chunked(2**20):
+                    written += len(chunk)
+                    if written > max_bytes:
+                        raise HTTPException(
+                            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                            detail=f"Remote file is larger than {max_bytes // 2**20} MB",
+                        )
+                    f.write(chunk)
+            return resp.headers.get("Content-Type", "").lower()
+
+
+async def internal_upload_raster_as_cog(
+    map_id: str,
+    local_path: str,
+    layer_name: str,
+    add_layer_to_map: bool,
+    user_id: str,
+    project_id: str,
+) -> InternalLayerUploadResponse:
+    """Upload a raster already on disk together with its COG, without auth
+    checks.
+
+    The COG is built right away and uploaded concurrently with the original,
+    so the layer's first view needs no download and conversion pass. If
+    building it fails, the original is uploaded alone and converted on first
+    view instead.
+    """
+    filename = os.path.basename(local_path)
+    file_basename, file_ext = os.path.splitext(filename)
+    layer_name = layer_name or file_basename
+    layer_id = generate_id(prefix="L")
+    s3_key = f"uploads/{user_id}/{project_id}/{layer_id}{file_ext.lower()}"
+    cog_key = f"cog/layer/{layer_id}.cog.tif"
+    bucket_name = get_bucket_name()
+
+    metadata_dict = {"original_filename": filename}
+    bounds = await asyncio.to_thread(preprocess_raster, local_path, metadata_dict)
+    local_cog_file = os.path.join(
+        os.path.dirname(local_path), f"layer_{layer_id}.cog.tif"
+    )
+    uploads = [s3_transfer.upload_file(local_path, bucket_name, s3_key)]
+    try:
+        await create_cog(local_path, local_cog_file, layer_id, metadata_dict)
+    except HTTPException as e:
+        # without cog_key the first view converts it, as for other uploads
+        logger.warning(f"Creating the COG of layer {layer_id} failed: {e.detail}")
+    else:
+        metadata_dict["cog_key"] = cog_key
+        uploads.append(s3_transfer.upload_file(local_cog_file, bucket_name, cog_key))
+    await asyncio.gather(*uploads)
+
+    async with get_async_db_connection() as conn:
+        await insert_map_layer(
+            conn,
+            layer_id,
+            user_id,
+            layer_name,
+            "raster",
+            metadata_dict,
+            bounds,
+            s3_key,
+            os.path.getsize(local_path),
+            map_id,
+        )
+        if add_layer_to_map:
+            await append_layers_to_map(conn, map_id, [layer_id])
+
+    return InternalLayerUploadResponse(
+        id=layer_id,
+        name=layer_name,
+        type="raster",
+        url=f"/api/layer/{layer_id}.cog.tif",
+    )
+
+
 CLOUD_NATIVE_EXTS = {".pmtiles", ".tif"}
 RASTER_EXTS = {".tif", ".jpg", ".jpeg", ".png", ".dem"}
 VECTOR_EXTS = {".pmtiles", ".geojson", ".fgb", ".gpkg", ".shp", ".csv"}
@@ -1790,49 +1963,60 @@ async def add_remote_layer(
     elif is_cloud_native:
         ogr_source = f"/vsicurl/{url}"
     else:
-        # regular HTTP file: download and use internal upload
-        async with aiohttp.ClientSession() as http_session:
-            async with http_session.get(url) as resp:
-                if resp.status != 200:
-                    raise HTTPException(
-                        status_code=status.HTTP_400_BAD_REQUEST,
-                        detail=f"Unable to download remote file: HTTP {resp.status}",
-                    )
-                content = await resp.read()
-
-        # Choose a filename with an extension that hints the correct type
-        # Many services (e.g., Earth Engine getPixels) return files without extensions
-        # If the caller declared 'raster' and the URL lacks a raster extension, default to .tif
-        filename_only = Path(parsed.path).name or "remote_file"
-        chosen_ext = ext
-        if declared == "raster" and (not chosen_ext or chosen_ext.lower() not in RASTER_EXTS):
-            # Try infer from Content-Type header first
-            ct = resp.headers.get("Content-Type", "").lower() if 'resp' in locals() else ""
-            if "tif" in ct or "geotiff" in ct or "geotif" in ct:
-                chosen_ext = ".tif"
-            elif "png" in ct:
-                chosen_ext = ".png"
-            elif "jpeg" in ct or "jpg" in ct:
-                chosen_ext = ".jpg"
-            else:
-                # Default to GeoTIFF so GDAL can compute bounds/CRS
-                chosen_ext = ".tif"
-
-        filename = filename_only if filename_only.lower().endswith(chosen_ext) else f"{filename_only}{chosen_ext}"
-        file_obj = UploadFile(
-            file=BytesIO(content),
-            filename=filename,
-            headers={"content-type": "application/octet-stream"},
-        )
+        # regular HTTP file: stream to disk and use internal upload
+        with tempfile.TemporaryDirectory() as download_dir:
+            download_path = os.path.join(download_dir, "download")
+            content_type = await stream_download(url, download_path)
+
+            # Choose a filename with an extension that hints the correct type
+            # Many services (e.g., Earth Engine getPixels) return files without extensions
+            # If the caller declared 'raster' and the URL lacks a raster extension, default to .tif
+            filename_only = Path(parsed.path).name or "remote_file"
+            chosen_ext = ext
+            if declared == "raster" and (
+                not chosen_ext or chosen_ext.lower() not in RASTER_EXTS
+            ):
+                # Try infer from Content-Type header first
+                if "png" in content_type:
+                    chosen_ext = ".png"
+                elif "jpeg" in content_type or "jpg" in content_type:
+                    chosen_ext = ".jpg"
+                else:
+                    # Default to GeoTIFF so GDAL can compute bounds/CRS
+                    chosen_ext = ".tif"
+
+            filename = (
+                filename_only
+                if filename_only.lower().endswith(chosen_ext)
+                else f"{filename_only}{chosen_ext}"
+            )
+            local_path = os.path.join(download_dir, filename)
+            os.rename(download_path, local_path)
 
-        internal_response = await internal_upload_layer(
-            forked_map.id,
-            file_obj,
-            request.name,
-            request.add_layer_to_map,
-            session.get_user_id(),
-            forked_map.project_id,
-        )
+            if layer_type == "raster":
+                # convert while the file is on disk, not lazily on first view
+                internal_response = await internal_upload_raster_as_cog(
+                    forked_map.id,
+                    local_path,
+                    request.name,
+                    request.add_layer_to_map,
+                    session.get_user_id(),
+                    forked_map.project_id,
+                )
+            else:
+                with open(local_path, "rb") as downloaded:
+                    internal_response = await internal_upload_layer(
+                        forked_map.id,
+                        UploadFile(
+                            file=downloaded,
+                            filename=filename,
+                            headers={"content-type": "application/octet-stream"},
+                        ),
+                        request.name,
+                        request.add_layer_to_map,
+                        session.get_user_id(),
+                        forked_map.project_id,
+                    )
         assert internal_response is not None
 
         return LayerUploadResponse(
@@ -2284,10 +2468,7 @@ async def generate_pmtiles_from_ogr_source(
         else:
             # Fallback to old path if user_id/project_id not available
             pmtiles_key = f"pmtiles/layer/{layer_id}.pmtiles"
-        s3 = await get_async_s3_client()
-        await s3.upload_file(
-            local_output_file, bucket_name, pmtiles_key, Config=one_shot_config
-        )
+        await s3_transfer.upload_file(local_output_file, bucket_name, pmtiles_key)
 
         # Update the database with the PMTiles key
         async with get_async_db_connection() as conn:
@@ -25,7 +25,7 @@ from fastapi import (
     BackgroundTasks,
 )
 from fastapi.responses import Response, HTMLResponse
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from src.dependencies.session import (
     verify_session_required,
     UserContext,
@@ -36,7 +36,7 @@ from typing import List, Optional, Sequence, cast
 import logging
 from datetime import datetime
 from PIL import Image
-from redis import Redis
+from src.dependencies.redis_pool import get_redis
 import asyncio
 from botocore.exceptions import ClientError
 
@@ -77,11 +77,6 @@ SOCIAL_RENDER_SEMAPHORE = asyncio.Semaphore(2)  # Max 2 concurrent renders
 logger = logging.getLogger(__name__)
 tracer = trace.get_tracer(__name__)
 
-redis = Redis(
-    host=os.environ["REDIS_HOST"],
-    port=int(os.environ["REDIS_PORT"]),
-    decode_responses=True,
-)
 
 project_router = APIRouter()
 
@@ -279,12 +274,12 @@ async def list_project_sources(
                 processed_tables_count: Optional[int] = None
             else:
                 friendly_name = postgres_conn_result["connection_name"] or "Loading..."
-                table_count = int(
-                    redis.get(f"dbdocumenter:{connection_id}:total_tables") or 0
-                )
-                processed_tables_count = int(
-                    redis.get(f"dbdocumenter:{connection_id}:processed_tables") or 0
+                total_tables, processed_tables = await get_redis().mget(
+                    f"dbdocumenter:{connection_id}:total_tables",
+                    f"dbdocumenter:{connection_id}:processed_tables",
                 )
+                table_count = int(total_tables or 0)
+                processed_tables_count = int(processed_tables or 0)
 
             # Get error details recorded for this connection attempt
             connection_details = await connection_manager.get_connection(connection_id)
@@ -645,6 +640,150 @@ class SocialImageCacheBustedError(Exception):
     pass
 
 
+class MonitoredFieldRequest(BaseModel):
+    latitude: float = Field(..., ge=-90, le=90)
+    longitude: float = Field(..., ge=-180, le=180)
+    name: Optional[str] = None
+
+
+class AddMonitoredFieldsRequest(BaseModel):
+    fields: List[MonitoredFieldRequest] = Field(..., min_length=1, max_length=5000)
+
+
+class MonitoredFieldResponse(BaseModel):
+    id: str
+    name: Optional[str] = None
+    latitude: float
+    longitude: float
+    created_at: datetime
+    refreshed_at: Optional[datetime] = None
+
+
+class MonitoredFieldsResponse(BaseModel):
+    fields: List[MonitoredFieldResponse]
+
+
+def max_fields_per_project() -> int:
+    return int(os.environ.get("MUNDI_MAX_FIELDS_PER_PROJECT", "5000"))
+
+
+@project_router.get(
+    "/{project_id}/fields",
+    response_model=MonitoredFieldsResponse,
+    operation_id="list_monitored_fields",
+)
+async def list_monitored_fields(
+    project: MundiProject = Depends(get_project),
+    session: UserContext = Depends(verify_session_required),
+):
+    """
+    List the fields whose bloom results are precomputed off-peak.
+    """
+    async with get_async_db_connection() as conn:
+        rows = await conn.fetch(
+            """
+            SELECT id, name, latitude, longitude, created_at, refreshed_at
+            FROM monitored_fields
+            WHERE project_id = $1 AND soft_deleted_at IS NULL
+            ORDER BY created_at, id
+            """,
+            project.id,
+        )
+    return MonitoredFieldsResponse(
+        fields=[MonitoredFieldResponse(**dict(row)) for row in rows]
+    )
+
+
+@project_router.post(
+    "/{project_id}/fields",
+    response_model=MonitoredFieldsResponse,
+    operation_id="add_monitored_fields",
+)
+async def add_monitored_fields(
+    body: AddMonitoredFieldsRequest,
+    project: MundiProject = Depends(edit_project),
+    session: UserContext = Depends(verify_session_required),
+):
+    """
+    Register fields for monitoring. The field scheduler precomputes their
+    bloom observations and predictions during its next off-peak window.
+    """
+    user_id = session.get_user_id()
+    field_ids = [generate_id(prefix="F") for _ in body.fields]
+
+    async with get_async_db_connection() as conn:
+        async with conn.transaction():
+            # serialize concurrent registrations so the limit holds
+            await conn.execute(
+                "SELECT 1 FROM user_mundiai_projects WHERE id = $1 FOR UPDATE",
+                project.id,
+            )
+            existing = await conn.fetchval(
+                """
+                SELECT COUNT(*) FROM monitored_fields
+                WHERE project_id = $1 AND soft_deleted_at IS NULL
+                """,
+                project.id,
+            )
+            if existing + len(body.fields) > max_fields_per_project():
+                raise HTTPException(
+                    status_code=status.HTTP_400_BAD_REQUEST,
+                    detail=f"Projects can monitor at most {max_fields_per_project()} fields.",
+                )
+            rows = await conn.fetch(
+                """
+                INSERT INTO monitored_fields
+                (id, project_id, user_id, name, latitude, longitude)
+                SELECT f.id, $2, $3, f.name, f.latitude, f.longitude
+                FROM unnest($1::text[], $4::text[], $5::float8[], $6::float8[])
+                    AS f(id, name, latitude, longitude)
+                RETURNING id, name, latitude, longitude, created_at, refreshed_at
+                """,
+                field_ids,
+                project.id,
+                user_id,
+                [field.name for field in body.fields],
+                [field.latitude for field in body.fields],
+                [field.longitude for field in body.fields],
+            )
+    return MonitoredFieldsResponse(
+        fields=[MonitoredFieldResponse(**dict(row)) for row in rows]
+    )
+
+
+@project_router.delete(
+    "/{project_id}/fields/{field_id}",
+    response_model=PostgresConnectionResponse,
+    operation_id="delete_monitored_field",
+)
+async def delete_monitored_field(
+    field_id: str,
+    project: MundiProject = Depends(edit_project),
+    session: UserContext = Depends(verify_session_required),
+):
+    """
+    Stop monitoring a field. Results already computed for it are kept.
+    """
+    async with get_async_db_connection() as conn:
+        result = await conn.execute(
+            """
+            UPDATE monitored_fields
+            SET soft_deleted_at = CURRENT_TIMESTAMP
+            WHERE id = $1 AND project_id = $2 AND soft_deleted_at IS NULL
+            """,
+            field_id,
+            project.id,
+        )
+    if result == "UPDATE 0":
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Field {field_id} not found in project {project.id}.",
+        )
+    return PostgresConnectionResponse(
+        success=True, message="Field is no longer monitored"
+    )
+
+
 @project_router.get("/{project_id}/social.webp", response_class=Response)
 async def get_project_social_preview(
     project: MundiProject = Depends(get_project),
@@ -59,6 +59,8 @@ class EphemeralNotificationPayload(ConversationRelatedPayload):
     status: str
     bounds: list[float] | None
     updates: dict[str, Any]
+    # partial assistant text while a completion is being streamed
+    content: str | None = None
 
     model_config = ConfigDict(
         json_encoders={datetime: lambda v: v.isoformat() if v else None}
@@ -94,6 +96,13 @@ MAX_MISSED_MESSAGES = 100  # Limit buffer size per user per conversation
 
 CHAT_CH = "chat_completion_messages_notify"
 chat_q: asyncio.Queue[str] = asyncio.Queue()
+# NOTIFY payloads must be shorter than 8000 bytes
+PG_NOTIFY_MAX_BYTES = 7900
+
+# Chat workers run apart from the web processes holding the websockets, so they
+# publish ephemeral events on the same channel as persisted messages and let
+# every web process's listener fan them out
+publish_ephemeral_via_pg_notify = False
 # Initialize listener task at module level
 listener_task = None
 
@@ -346,6 +355,12 @@ async def _broadcast_payload(payload: str):
         assert parsed_payload.conversation_id, "conversation_id is required"
 
         now = time.time()
+        # streamed completions are not replayed, see kue_stream_update
+        replayable = not (
+            isinstance(parsed_payload, EphemeralNotificationPayload)
+            and parsed_payload.status in ("streaming", "completed")
+            and parsed_payload.content is not None
+        )
 
         # Store messages for recently disconnected users who might reconnect to this specific conversation
         users_to_remove = []
@@ -359,7 +374,10 @@ async def _broadcast_payload(payload: str):
                 continue
 
             # Only store messages for users who were disconnected from this specific conversation
-            if disconnected_conversation_id == parsed_payload.conversation_id:
+            if (
+                replayable
+                and disconnected_conversation_id == parsed_payload.conversation_id
+            ):
                 # Add message to their missed messages buffer
                 missed_messages = user_data["missed_messages"]
                 missed_messages.append((now, parsed_payload))
@@ -385,6 +403,20 @@ async def _broadcast_payload(payload: str):
         logger.exception("Error broadcasting payload")
 
 
+async def _pg_notify_ephemeral(
+    payload: EphemeralNotificationPayload | EphemeralErrorNotificationPayload,
+):
+    data = payload.model_dump(mode="json")
+    body = json.dumps(data)
+    while len(body.encode("utf-8")) > PG_NOTIFY_MAX_BYTES and data.get("content"):
+        # streamed text is cumulative, keep its most recent part
+        overflow = len(body.encode("utf-8")) - PG_NOTIFY_MAX_BYTES
+        data["content"] = "…" + data["content"][overflow + 1 :]
+        body = json.dumps(data)
+    async with get_async_db_connection() as conn:
+        await conn.execute("SELECT pg_notify($1, $2)", CHAT_CH, body)
+
+
 @asynccontextmanager
 async def kue_ephemeral_action(
     conversation_id: int,
@@ -416,6 +448,17 @@ async def kue_ephemeral_action(
     # Put it on the event loop to prevent race conditions
     await asyncio.sleep(0.05)
 
+    if publish_ephemeral_via_pg_notify:
+        await _pg_notify_ephemeral(payload)
+        try:
+            yield payload
+        finally:
+            finished_payload = payload.model_copy()
+            finished_payload.status = "completed"
+            finished_payload.completed_at = datetime.now(timezone.utc)
+            await _pg_notify_ephemeral(finished_payload)
+        return
+
     try:
         # Store for recently disconnected users from this specific conversation
         now = time.time()
@@ -505,6 +548,10 @@ async def kue_notify_error(conversation_id: int, error_message: str):
         status="error",
     )
 
+    if publish_ephemeral_via_pg_notify:
+        await _pg_notify_ephemeral(payload)
+        return
+
     # Store for recently disconnected users from this specific conversation
     now = time.time()
     users_to_remove = []
@@ -536,3 +583,43 @@ async def kue_notify_error(conversation_id: int, error_message: str):
         queues = list(subscribers_by_conversation.get(conversation_id, []))
     for q in queues:
         q.put_nowait(payload)
+
+
+async def kue_stream_update(
+    conversation_id: int,
+    action_id: str,
+    action_description: str,
+    content: str | None,
+    status: str = "streaming",
+):
+    """
+    Send the progress of a streamed completion to the client.
+    Every update carries the full text so far, so a client that misses one
+    only falls behind until the next. Updates go to live subscribers only,
+    replaying them after a reconnect would just push real events out of the
+    missed message buffer.
+    """
+    payload = EphemeralNotificationPayload(
+        conversation_id=conversation_id,
+        ephemeral=True,
+        action_id=action_id,
+        layer_id=None,
+        action=action_description,
+        timestamp=datetime.now(timezone.utc),
+        completed_at=datetime.now(timezone.utc) if status == "completed" else None,
+        status=status,
+        bounds=None,
+        updates={
+            "style_json": False,
+        },
+        content=content,
+    )
+
+    if publish_ephemeral_via_pg_notify:
+        await _pg_notify_ephemeral(payload)
+        return
+
+    async with subscribers_lock:
+        queues = list(subscribers_by_conversation.get(conversation_id, []))
+    for q in queues:
+        q.put_nowait(payload)
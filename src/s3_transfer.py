@@ -0,0 +1,272 @@
+# Copyright (C) 2025 Bunting Labs, Inc.
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import asyncio
+import base64
+import hashlib
+import logging
+import os
+import time
+from typing import Literal, Optional
+
+from opentelemetry import trace
+from pydantic import BaseModel
+
+from src.utils import get_async_s3_client
+
+logger = logging.getLogger(__name__)
+tracer = trace.get_tracer(__name__)
+
+# S3 requires parts of at least 5 MiB, except the last one
+MIN_PART_SIZE = 5 * 1024**2
+HASH_CHUNK_SIZE = 8 * 1024**2
+
+
+class TransferChecksumError(Exception):
+    """Downloaded bytes do not match the checksum stored with the object."""
+
+
+class TransferStats(BaseModel):
+    direction: Literal["upload", "download"]
+    bucket: str
+    key: str
+    size_bytes: int
+    parts: int
+    seconds: float
+    sha256: Optional[str] = None
+
+    @property
+    def throughput_mib_s(self) -> float:
+        return self.size_bytes / 1024**2 / self.seconds if self.seconds else 0.0
+
+
+def get_part_size() -> int:
+    part_size = int(os.environ.get("MUNDI_S3_PART_SIZE_MB", "16")) * 1024**2
+    return max(part_size, MIN_PART_SIZE)
+
+
+def get_max_concurrency() -> int:
+    return max(int(os.environ.get("MUNDI_S3_MAX_CONCURRENCY", "8")), 1)
+
+
+def _file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(HASH_CHUNK_SIZE):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _read_range(path: str, offset: int, length: int) -> bytes:
+    with open(path, "rb") as f:
+        f.seek(offset)
+        return f.read(length)
+
+
+def _write_range(path: str, offset: int, data: bytes):
+    with open(path, "r+b") as f:
+        f.seek(offset)
+        f.write(data)
+
+
+def _write_bytes(path: str, data: bytes):
+    with open(path, "wb") as f:
+        f.write(data)
+
+
+def _allocate(path: str, size: int):
+    with open(path, "wb") as f:
+        f.truncate(size)
+
+
+def _content_md5(data: bytes) -> str:
+    return base64.b64encode(hashlib.md5(data).digest()).decode("ascii")
+
+
+def _part_ranges(size: int, part_size: int) -> list[tuple[int, int]]:
+    return [
+        (offset, min(part_size, size - offset)) for offset in range(0, size, part_size)
+    ]
+
+
+async def _gather_or_cancel(coros) -> list:
+    # a failed part cancels its siblings instead of letting them run on
+    tasks = [asyncio.ensure_future(coro) for coro in coros]
+    try:
+        return await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+
+
+def _record(stats: TransferStats):
+    span = trace.get_current_span()
+    span.set_attribute("s3.transfer.bytes", stats.size_bytes)
+    span.set_attribute("s3.transfer.parts", stats.parts)
+    span.set_attribute("s3.transfer.seconds", stats.seconds)
+    span.set_attribute("s3.transfer.throughput_mib_s", stats.throughput_mib_s)
+    logger.info(
+        f"S3 {stats.direction} {stats.bucket}/{stats.key}: {stats.size_bytes} bytes "
+        f"in {stats.parts} part(s), {stats.seconds:.2f}s, "
+        f"{stats.throughput_mib_s:.1f} MiB/s"
+    )
+
+
+async def upload_file(local_path: str, bucket: str, key: str) -> TransferStats:
+    """Upload a local file, using parallel multipart uploads above the part size.
+
+    Every part is sent with Content-MD5 so S3 rejects corrupted parts, and the
+    SHA-256 of the whole file is stored in the object's metadata so downloads
+    can verify it.
+    """
+    with tracer.start_as_current_span("s3.upload_file"):
+        s3 = await get_async_s3_client()
+        size = os.path.getsize(local_path)
+        part_size = get_part_size()
+        start = time.monotonic()
+
+        if size <= part_size:
+            data = await asyncio.to_thread(_read_range, local_path, 0, size)
+            sha256 = hashlib.sha256(data).hexdigest()
+            await s3.put_object(
+                Bucket=bucket,
+                Key=key,
+                Body=data,
+                ContentMD5=_content_md5(data),
+                Metadata={"sha256": sha256},
+            )
+            parts = 1
+        else:
+            sha256 = await asyncio.to_thread(_file_sha256, local_path)
+            multipart = await s3.create_multipart_upload(
+                Bucket=bucket, Key=key, Metadata={"sha256": sha256}
+            )
+            upload_id = multipart["UploadId"]
+            semaphore = asyncio.Semaphore(get_max_concurrency())
+
+            async def upload_part(part_number: int, offset: int, length: int):
+                async with semaphore:
+                    data = await asyncio.to_thread(
+                        _read_range, local_path, offset, length
+                    )
+                    response = await s3.upload_part(
+                        Bucket=bucket,
+                        Key=key,
+                        UploadId=upload_id,
+                        PartNumber=part_number,
+                        Body=data,
+                        ContentMD5=_content_md5(data),
+                    )
+                    return {"PartNumber": part_number, "ETag": response["ETag"]}
+
+            ranges = _part_ranges(size, part_size)
+            try:
+                completed = await _gather_or_cancel(
+                    upload_part(i, offset, length)
+                    for i, (offset, length) in enumerate(ranges, 1)
+                )
+                await s3.complete_multipart_upload(
+                    Bucket=bucket,
+                    Key=key,
+                    UploadId=upload_id,
+                    MultipartUpload={"Parts": completed},
+                )
+            except BaseException:
+                await s3.abort_multipart_upload(
+                    Bucket=bucket, Key=key, UploadId=upload_id
+                )
+                raise
+            parts = len(ranges)
+
+        stats = TransferStats(
+            direction="upload",
+            bucket=bucket,
+            key=key,
+            size_bytes=size,
+            parts=parts,
+            seconds=time.monotonic() - start,
+            sha256=sha256,
+        )
+        _record(stats)
+        return stats
+
+
+async def download_file(bucket: str, key: str, local_path: str) -> TransferStats:
+    """Download an object to a local file with parallel ranged GETs.
+
+    If the object was written by upload_file its SHA-256 is verified and a
+    TransferChecksumError is raised on mismatch.
+    """
+    with tracer.start_as_current_span("s3.download_file"):
+        s3 = await get_async_s3_client()
+        start = time.monotonic()
+        head = await s3.head_object(Bucket=bucket, Key=key)
+        size = head["ContentLength"]
+        expected_sha256 = (head.get("Metadata") or {}).get("sha256")
+        part_size = get_part_size()
+
+        if size <= part_size:
+            response = await s3.get_object(Bucket=bucket, Key=key)
+            data = await response["Body"].read()
+            await asyncio.to_thread(_write_bytes, local_path, data)
+            sha256 = hashlib.sha256(data).hexdigest()
+            parts = 1
+        else:
+            await asyncio.to_thread(_allocate, local_path, size)
+            semaphore = asyncio.Semaphore(get_max_concurrency())
+
+            async def download_part(offset: int, length: int):
+                async with semaphore:
+                    response = await s3.get_object(
+                        Bucket=bucket,
+                        Key=key,
+                        Range=f"bytes={offset}-{offset + length - 1}",
+                    )
+                    data = await response["Body"].read()
+                    if len(data) != length:
+                        raise TransferChecksumError(
+                            f"Short read for {key} at {offset}: {len(data)} of {length} bytes"
+                        )
+                    await asyncio.to_thread(_write_range, local_path, offset, data)
+
+            ranges = _part_ranges(size, part_size)
+            await _gather_or_cancel(
+                download_part(offset, length) for offset, length in ranges
+            )
+            sha256 = (
+                await asyncio.to_thread(_file_sha256, local_path)
+                if expected_sha256
+                else None
+            )
+            parts = len(ranges)
+
+        if expected_sha256 and sha256 != expected_sha256:
+            raise TransferChecksumError(
+                f"SHA-256 mismatch for {bucket}/{key}: expected {expected_sha256}, got {sha256}"
+            )
+
+        stats = TransferStats(
+            direction="download",
+            bucket=bucket,
+            key=key,
+            size_bytes=size,
+            parts=parts,
+            seconds=time.monotonic() - start,
+            sha256=sha256,
+        )
+        _record(stats)
+        return stats
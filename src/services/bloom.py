@@ -1,205 +1,119 @@
-from datetime import date, timedelta, datetime as dt
-from typing import Dict, Any
-import ee
+import asyncio
+import logging
 import os
+import time
+from datetime import date, datetime as dt
+from typing import AsyncIterator, Dict, Any, List, Optional, Sequence, Tuple
 
-# Como hacemos para que se llame una sola vez al iniciar la app?
-def initialize_earth_engine():
-    """Initialize Earth Engine with service account credentials"""    
-    try:
-        service_account = 'gee-farmane@vaulted-channel-234121.iam.gserviceaccount.com'
-        project_root = os.path.dirname(os.path.dirname(os.path.dirname(__file__)))
-        credentials_path = os.path.join(project_root, 'src', 'services', 'vaulted-channel-234121-376df8d2d29a.json')
-        credentials = ee.ServiceAccountCredentials(service_account, credentials_path)
-        ee.Initialize(credentials)
-        return True
-    except Exception as e:
-        # print(f"Earth Engine initialization failed: {e}")
-        return False
-
-def filter_cloudy_images(s2_collection, cloud_threshold=90):
-    """Filter out images with high cloud percentage"""
-    return s2_collection.filter(ee.Filter.lt('CLOUDY_PIXEL_PERCENTAGE', cloud_threshold))
-
-def mask_clouds(img):
-    """Cloud mask for S2"""
-    qa = img.select('QA60')
-    cloud_mask = qa.bitwiseAnd(1 << 10).neq(0).Or(qa.bitwiseAnd(1 << 11).neq(0)).Not()
-    return img.updateMask(cloud_mask).copyProperties(img, ['system:time_start'])
-
-def calculate_ebi(img):
-    """Calculate Enhanced Bloom Index (EBI)"""
-    # Scale bands to reflectance
-    R = img.select('B4').multiply(1e-4)
-    G = img.select('B3').multiply(1e-4) 
-    B = img.select('B2').multiply(1e-4).max(1e-6)  # Prevent division by zero
-    
-    # EBI calculation
-    brightness = R.add(G).add(B)
-    greenness = G.divide(B)
-    soil_sig = R.subtract(B).add(1.0)  # EPS = 1.0
-    ebi = brightness.divide(greenness.multiply(soil_sig)).rename('EBI')
-    
-    return img.addBands(ebi).copyProperties(img, ['system:time_start'])
-
-def extract_ebi_mean(img, roi):
-    """Extract mean EBI for each image"""
-    mean_ebi = img.select('EBI').reduceRegion(
-        reducer=ee.Reducer.mean(),
-        geometry=roi,
-        scale=10,
-        maxPixels=1e10,
-        bestEffort=True
-    ).get('EBI')
-    
-    date = img.date().format('YYYY-MM-dd')
-    return ee.Feature(None, {
-        'date': date,
-        'mean_ebi': mean_ebi,
-        'timestamp': img.date().millis()
-    })
-
-def get_ebi_geotiff_url(s2_collection, peak_date, roi):
-    """Peak EBI GeoTIFF URL from GEE"""
-    try:                
-        # Filter collection
-        peak_date_str = peak_date.strftime('%Y-%m-%d')
-        peak_day_start = ee.Date(peak_date_str)
-        peak_day_end = peak_day_start.advance(1, 'day')
-        
-        peak_image = s2_collection.filterDate(peak_day_start, peak_day_end).first()
-        
-        export_image = peak_image.select('EBI').clip(roi)
-        # Get min/max values for scaling
-        minMax = export_image.reduceRegion(
-            reducer=ee.Reducer.minMax(),
-            geometry=roi,
-            scale=10,
-            maxPixels=1e10,
-            bestEffort=True
-        )
-        
-        ebi_min = minMax.get('EBI_min')
-        ebi_max = minMax.get('EBI_max')
-        
-        color_palette = ['0d0887', '6300a7', 'ab2494', 'e34f6f', 'fb9f3a', 'f0f921']
-        
-        # Create scaled visualization
-        rgb_image = export_image.visualize(
-            min=ebi_min,
-            max=ebi_max,
-            palette=color_palette
-        )
-        
-        # Get download URL
-        url = rgb_image.getDownloadURL({
-            'scale': 10,
-            'crs': 'EPSG:4326',
-            'region': roi,
-            'format': 'GEO_TIFF'
-        })
-        
-        return url
+import numpy as np
+
+from src.services.bloom_store import (
+    find_cached_detection,
+    find_nearest_observation,
+    find_nearest_prediction,
+    load_peak_history,
+    store_detections,
+    store_predictions,
+)
+from src.services.earth_engine import (
+    CLOUD_THRESHOLD,
+    ROI_BUFFER_M,
+    EarthEngineBackend,
+    EbiSeries,
+    Region,
+    get_earth_engine,
+    summarize_ebi_series,
+)
+from src.services.phenology import PhenologyModel, to_date
+from src.structures import async_conn
+
+logger = logging.getLogger(__name__)
 
-    except Exception as e:
-        # print(f"    Download failed: {e}")
-        return None
 
-async def detect_bloom(latitude: float, longitude: float) -> Dict[str, Any]:
+def detection_parameters(
+    earth_engine: EarthEngineBackend, polygon: bool = False
+) -> Dict[str, Any]:
+    """How a detection was computed, stored detections are only reused by
+    requests with the same parameters."""
+    return {
+        "backend": earth_engine.name,
+        "region": "polygon" if polygon else f"square_{ROI_BUFFER_M}m",
+        "cloud_threshold": CLOUD_THRESHOLD,
+    }
+
+
+async def detect_bloom(
+    latitude: float,
+    longitude: float,
+    earth_engine: Optional[EarthEngineBackend] = None,
+    use_cache: bool = True,
+) -> Dict[str, Any]:
     """Detect bloom peak date and EBI value for a given lat/lon using Sentinel-2 data
 
+    Computed detections are written through to bloom_observations, and a
+    stored one near the point is returned instead while no newer imagery
+    can have arrived, see bloom_store.detection_valid_until.
+
     Args:
         latitude: Latitude coordinate
         longitude: Longitude coordinate
+        earth_engine: Backend to query, defaults to the process wide one
+        use_cache: Read and write stored detections
 
     Returns:
         Dictionary containing:
         - latitude: Input latitude
-        - longitude: Input longitude 
+        - longitude: Input longitude
         - date_of_max_ebi: Date of peak bloom
         - ebi_value: Peak EBI value
         - image_url: Peak EBI GeoTIFF URL from GEE
     """
+    if earth_engine is None:
+        earth_engine = get_earth_engine()
+    parameters = detection_parameters(earth_engine)
+
+    if use_cache:
+        try:
+            async with async_conn("bloom.cache_lookup") as conn:
+                cached = await find_cached_detection(
+                    conn, latitude, longitude, parameters
+                )
+            if cached is not None:
+                return {
+                    "latitude": latitude,
+                    "longitude": longitude,
+                    "date_of_max_ebi": cached["date_of_max_ebi"],
+                    "ebi_value": cached["ebi_value"],
+                    "image_url": cached["image_url"],
+                }
+        except Exception as e:
+            logger.warning(f"Bloom detection cache lookup failed: {e}")
+
     try:
-        # Initialize Earth Engine
-        if not initialize_earth_engine():
-            raise Exception("Failed to initialize Earth Engine")
-        
-        # Create ROI from lat/lon (100 hectares square around the center point)
-        point = ee.Geometry.Point([longitude, latitude])
-        roi = point.buffer(500).bounds()  # Creates a 100-hectare square
-        
-        # Get current year and define bloom season
+        # This season, or last season's bloom early in the year
         current_year = dt.now().year
-        start_date = ee.Date.fromYMD(current_year, 1, 15)
-        end_date = ee.Date.fromYMD(current_year, 4, 15)
-        
-        # Load Sentinel-2 data
-        s2_collection = (ee.ImageCollection("COPERNICUS/S2_SR_HARMONIZED")
-                        .filterBounds(roi)
-                        .filterDate(start_date, end_date)
-                        .map(mask_clouds)
-                        .map(calculate_ebi)
-                        .map(lambda img: img.clip(roi)))
-        
-        num_images = s2_collection.size().getInfo()
-        if num_images == 0:
-            # If no data for current year, try previous year
-            current_year = current_year - 1
-            start_date = ee.Date.fromYMD(current_year, 1, 15)
-            end_date = ee.Date.fromYMD(current_year, 4, 15)
-            
-            s2_collection = (ee.ImageCollection("COPERNICUS/S2_SR_HARMONIZED")
-                            .filterBounds(roi)
-                            .filterDate(start_date, end_date)
-                            .map(mask_clouds)
-                            .map(calculate_ebi)
-                            .map(lambda img: img.clip(roi)))
-            
-            num_images = s2_collection.size().getInfo()
-            
-            if num_images == 0:
-                raise Exception("No Sentinel-2 data available for the location")
-
-        #Filter out cloudy images
-        s2_collection = filter_cloudy_images(s2_collection, cloud_threshold=75)
-        
-        # Extract time series
-        time_series_fc = s2_collection.map(lambda img: extract_ebi_mean(img, roi)).filter(ee.Filter.notNull(['mean_ebi']))
-        time_series_data = time_series_fc.getInfo()
-        
-        if not time_series_data['features']:
+        summary = await earth_engine.ebi_summary(
+            latitude, longitude, [current_year, current_year - 1]
+        )
+        if summary is None:
             raise Exception("No valid EBI data extracted")
-        
-        # Find peak bloom
-        max_ebi = 0
-        peak_date = None
-        
-        for feature in time_series_data['features']:
-            props = feature['properties']
-            ebi_val = props['mean_ebi']
-            date_str = props['date']
-            
-            if ebi_val and ebi_val > max_ebi:
-                max_ebi = ebi_val
-                peak_date = dt.strptime(date_str, '%Y-%m-%d').date()
-        
-        if peak_date is None:
-            raise Exception("Could not determine peak bloom date")
-        
+
         # Get EBI GeoTIFF URL
-        image_url = get_ebi_geotiff_url(s2_collection, peak_date, roi)
-        
-        return {
+        image_url = await earth_engine.ebi_image_url(
+            latitude, longitude, summary.peak_date
+        )
+
+        result = {
             "latitude": latitude,
             "longitude": longitude,
-            "date_of_max_ebi": peak_date,
-            "ebi_value": round(max_ebi, 3),
+            "date_of_max_ebi": summary.peak_date,
+            "ebi_value": round(summary.peak_ebi, 3),
             "image_url": image_url,
         }
-        
+
     except Exception as e:
-        # print(f"Bloom detection failed: {e}")
+        logger.warning(f"Bloom detection failed: {e}")
+        # placeholders are never stored
         return {
             "latitude": latitude,
             "longitude": longitude,
@@ -208,20 +122,289 @@ async def detect_bloom(latitude: float, longitude: float) -> Dict[str, Any]:
             "image_url": "https://example.com/tiles/ebi/mock.png",
         }
 
+    if use_cache:
+        await _store_detections(
+            [
+                {
+                    **result,
+                    "season": summary.season,
+                    "imagery_date": summary.imagery_date,
+                }
+            ],
+            parameters,
+        )
+    return result
 
-async def predict_bloom(latitude: float, longitude: float) -> Dict[str, Any]:
-    """Return dummy bloom prediction data for a given lat/lon.
 
-    This is a placeholder. Replace with real logic that uses
-    historical phenology and a predictive model.
+async def _store_detections(detections: List[Dict[str, Any]], parameters):
+    try:
+        async with async_conn("bloom.cache_store") as conn:
+            await store_detections(conn, detections, parameters)
+    except Exception as e:
+        # the caller still gets its result, the next request recomputes
+        logger.warning(f"Storing bloom detections failed: {e}")
+
+
+# error of regions whose chunk failed, as opposed to having no data
+BATCH_FAILED_ERROR = "Bloom detection failed"
+
+
+def batch_chunk_size() -> int:
+    """Regions per Earth Engine reduction in detect_bloom_many, larger
+    chunks mean fewer round trips but a longer wait for the first result."""
+    return int(os.environ.get("MUNDI_BLOOM_BATCH_CHUNK_SIZE", "100"))
+
+
+async def detect_bloom_many(
+    regions: Sequence[Region],
+    earth_engine: Optional[EarthEngineBackend] = None,
+    use_cache: bool = True,
+) -> AsyncIterator[Dict[str, Any]]:
+    """Bloom peak and EBI statistics for many points or polygons.
+
+    Regions are reduced together in chunks, one Earth Engine computation per
+    chunk instead of several round trips per region. Results are yielded
+    as their chunk finishes, so not in input order, each tagged with the
+    `index` of its region. No GeoTIFF is exported per region, request one
+    through detect_bloom for the blocks worth a closer look.
+
+    Successful results are written through to bloom_observations like
+    detect_bloom's.
     """
-    start = date.today() + timedelta(days=10)
-    peak = date.today() + timedelta(days=14)
-    return {
-        "latitude": latitude,
-        "longitude": longitude,
-        "predicted_bloom_start": start,
-        "predicted_bloom_peak": peak,
-        "confidence": 0.82,
+    if earth_engine is None:
+        earth_engine = get_earth_engine()
+    current_year = dt.now().year
+    seasons = [current_year, current_year - 1]
+    chunk_size = batch_chunk_size()
+    # queueing for a pool thread counts against the call's timeout, so only
+    # hand the pool as many chunks as it has threads
+    in_flight = asyncio.Semaphore(earth_engine.max_workers)
+
+    async def run_chunk(start: int) -> List[Dict[str, Any]]:
+        chunk = regions[start : start + chunk_size]
+        try:
+            async with in_flight:
+                series = await earth_engine.ebi_time_series_many(chunk, seasons)
+        except Exception as e:
+            logger.warning(f"Batch bloom detection failed: {e}")
+            return [
+                _batch_result(start + i, region, None, BATCH_FAILED_ERROR)
+                for i, region in enumerate(chunk)
+            ]
+        results = [
+            _batch_result(start + i, region, result, None)
+            for i, (region, result) in enumerate(zip(chunk, series))
+        ]
+        if use_cache:
+            for polygon in (False, True):
+                detections = [
+                    result
+                    for region, result in zip(chunk, results)
+                    if result["error"] is None
+                    and (region.geometry is not None) == polygon
+                ]
+                if detections:
+                    await _store_detections(
+                        detections, detection_parameters(earth_engine, polygon)
+                    )
+        return results
+
+    tasks = [
+        asyncio.create_task(run_chunk(start))
+        for start in range(0, len(regions), chunk_size)
+    ]
+    try:
+        for next_chunk in asyncio.as_completed(tasks):
+            for result in await next_chunk:
+                yield result
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+def _batch_result(
+    index: int,
+    region: Region,
+    result: Optional[Tuple[int, EbiSeries]],
+    error: Optional[str],
+) -> Dict[str, Any]:
+    out: Dict[str, Any] = {
+        "index": index,
+        "latitude": region.latitude,
+        "longitude": region.longitude,
+        "season": None,
+        "imagery_date": None,
+        "date_of_max_ebi": None,
+        "ebi_value": None,
+        "mean_ebi": None,
+        "image_count": 0,
+        "error": error,
     }
+    if error is not None:
+        return out
+    if result is None:
+        out["error"] = "No Sentinel-2 data available for the location"
+        return out
+
+    summary = summarize_ebi_series(*result)
+    if summary is None:
+        out["error"] = "Could not determine peak bloom date"
+        return out
+    out.update(
+        season=summary.season,
+        imagery_date=summary.imagery_date,
+        date_of_max_ebi=summary.peak_date,
+        ebi_value=round(summary.peak_ebi, 3),
+        mean_ebi=round(summary.mean_ebi, 3),
+        image_count=summary.image_count,
+    )
+    return out
+
+
+def _phenology_refit_seconds() -> float:
+    return float(os.environ.get("MUNDI_PHENOLOGY_REFIT_SECONDS", "3600"))
+
+
+# (expires at, model), refitted from bloom_observations once expired
+_phenology_model: Optional[Tuple[float, PhenologyModel]] = None
+PHENOLOGY_HISTORY_YEARS = 5
+
+
+async def get_phenology_model() -> PhenologyModel:
+    """GDD model fitted to the observed bloom peaks of recent seasons."""
+    global _phenology_model
+    if _phenology_model is not None and _phenology_model[0] > time.monotonic():
+        return _phenology_model[1]
+    try:
+        since = date(date.today().year - PHENOLOGY_HISTORY_YEARS, 1, 1)
+        async with async_conn("bloom.phenology_history") as conn:
+            rows = await load_peak_history(conn, since)
+    except Exception as e:
+        # not cached, the next prediction retries the fit
+        logger.warning(f"Loading bloom history failed: {e}")
+        return PhenologyModel()
+
+    latitudes = np.array([row["latitude"] for row in rows], dtype="float64")
+    peak_days = np.array(
+        [row["date_of_max_ebi"].timetuple().tm_yday for row in rows], dtype="int64"
+    )
+    model = await asyncio.to_thread(PhenologyModel.fit, latitudes, peak_days)
+    _phenology_model = (time.monotonic() + _phenology_refit_seconds(), model)
+    return model
+
+
+async def predict_bloom_many(
+    points: Sequence[Tuple[float, float]],
+    store: bool = True,
+    map_id: Optional[str] = None,
+) -> List[Dict[str, Any]]:
+    """Predict the upcoming bloom start and peak for many (latitude,
+    longitude) points in one vectorized pass. Once a location's peak has
+    passed, the prediction is for its next season.
+
+    Predictions are written to bloom_predictions in a single statement.
+    Points that never accumulate enough heat, or lie within 20 degrees of
+    the equator, get no dates and are not stored.
+    """
+    model = await get_phenology_model()
+    latitudes = np.array([p[0] for p in points], dtype="float64")
+    longitudes = np.array([p[1] for p in points], dtype="float64")
+    starts, peaks = await asyncio.to_thread(
+        model.predict_upcoming, latitudes, date.today()
+    )
+    confidence = round(model.confidence, 2)
+
+    reached = ~np.isnat(peaks)
+    if store and reached.any():
+        try:
+            async with async_conn("bloom.store_predictions") as conn:
+                await store_predictions(
+                    conn,
+                    latitudes[reached].tolist(),
+                    longitudes[reached].tolist(),
+                    starts[reached].tolist(),
+                    peaks[reached].tolist(),
+                    confidence,
+                    model.version,
+                    map_id,
+                )
+        except Exception as e:
+            logger.warning(f"Storing bloom predictions failed: {e}")
+
+    return [
+        {
+            "latitude": latitude,
+            "longitude": longitude,
+            "predicted_bloom_start": start,
+            "predicted_bloom_peak": peak,
+            "confidence": confidence if peak is not None else None,
+        }
+        for latitude, longitude, start, peak in zip(
+            latitudes.tolist(),
+            longitudes.tolist(),
+            starts.tolist(),
+            peaks.tolist(),
+        )
+    ]
+
+
+async def predict_bloom(latitude: float, longitude: float) -> Dict[str, Any]:
+    """Predict the upcoming bloom start and peak for a given lat/lon from
+    accumulated growing degree days, see predict_bloom_many."""
+    return (await predict_bloom_many([(latitude, longitude)]))[0]
+
+
+async def _stored_or_computed(lookup, compute, latitude, longitude, season):
+    try:
+        async with async_conn(f"bloom.{lookup.__name__}") as conn:
+            stored = await lookup(conn, latitude, longitude, season)
+        if stored is not None:
+            return stored
+    except Exception as e:
+        logger.warning(f"Bloom lookup {lookup.__name__} failed: {e}")
+    try:
+        return await compute(latitude, longitude)
+    except Exception as e:
+        logger.warning(f"Computing {compute.__name__} failed: {e}")
+        return None
+
+
+async def bloom_observation(
+    latitude: float, longitude: float
+) -> Optional[Dict[str, Any]]:
+    """This season's bloom observation stored for a nearby orchard, else a
+    fresh detect_bloom. None if neither is available."""
+    return await _stored_or_computed(
+        find_nearest_observation,
+        detect_bloom,
+        latitude,
+        longitude,
+        date.today().year,
+    )
+
+
+async def bloom_prediction(
+    latitude: float, longitude: float
+) -> Optional[Dict[str, Any]]:
+    """The upcoming season's bloom prediction stored for a nearby orchard,
+    else a fresh predict_bloom. None if neither is available."""
+    model = await get_phenology_model()
+    _, peaks = model.predict_upcoming(np.array([latitude]), date.today())
+    peak = to_date(peaks[0])
+    return await _stored_or_computed(
+        find_nearest_prediction,
+        predict_bloom,
+        latitude,
+        longitude,
+        peak.year if peak else date.today().year,
+    )
+
 
+async def bloom_study(latitude: float, longitude: float) -> Dict[str, Any]:
+    """Bloom prediction and observation for a lat/lon, loaded or computed
+    concurrently. Returns a dict with "prediction" and "observation"."""
+    prediction, observation = await asyncio.gather(
+        bloom_prediction(latitude, longitude),
+        bloom_observation(latitude, longitude),
+    )
+    return {"prediction": prediction, "observation": observation}
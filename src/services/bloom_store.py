@@ -0,0 +1,245 @@
+import json
+import os
+from datetime import date, datetime, time, timedelta, timezone
+from typing import Any, Dict, Optional
+
+import asyncpg
+
+from src.services.earth_engine import bloom_season
+
+EARTH_RADIUS_M = 6371008.8
+METERS_PER_DEGREE_LAT = 111320.0
+
+
+def lookup_tolerance_m() -> float:
+    """Default search radius for stored bloom results.
+
+    detect_bloom reduces over a 1 km square around the point, so results
+    computed within a few hundred meters cover nearly the same orchard.
+    """
+    return float(os.environ.get("MUNDI_BLOOM_LOOKUP_TOLERANCE_M", "250"))
+
+
+# Great circle distance in meters from ($1, $2) to the row's latitude/longitude
+_DISTANCE_SQL = f"""
+    2 * {EARTH_RADIUS_M} * asin(sqrt(
+        power(sin(radians(latitude - $1) / 2), 2)
+        + cos(radians($1)) * cos(radians(latitude))
+        * power(sin(radians(longitude - $2) / 2), 2)
+    ))
+"""
+
+# Rows store `location`, point(longitude * cos(latitude), latitude), see
+# BLOOM_LOCATION_SQL. Over the few hundred meters searched a unit of it is
+# the same distance along both axes, METERS_PER_DEGREE_LAT meters, so its
+# GiST index serves both the radius filter and the nearest-first order.
+_LOCATION_SQL = "point($2 * cos(radians($1)), $1)"
+_NEAREST_SQL = f"""
+    location <@ circle({_LOCATION_SQL}, $3)
+    AND {_DISTANCE_SQL} <= $4
+"""
+_NEAREST_ORDER_SQL = f"location <-> {_LOCATION_SQL}, created_at DESC"
+
+
+def _nearest_args(latitude: float, longitude: float, tolerance_m: Optional[float]):
+    """($1, $2, $3, $4) of the _NEAREST_SQL queries."""
+    if tolerance_m is None:
+        tolerance_m = lookup_tolerance_m()
+    # the scaled point is a little off the great circle distance, search a
+    # slightly wider circle and cut it with the exact distance
+    radius = 1.01 * tolerance_m / METERS_PER_DEGREE_LAT
+    return latitude, longitude, radius, tolerance_m
+
+
+async def find_nearest_observation(
+    conn: asyncpg.Connection,
+    latitude: float,
+    longitude: float,
+    season: int,
+    tolerance_m: Optional[float] = None,
+) -> Optional[Dict[str, Any]]:
+    """Nearest stored bloom observation within `tolerance_m` meters whose peak
+    falls in the `season` (calendar year) bloom."""
+    row = await conn.fetchrow(
+        f"""
+        SELECT date_of_max_ebi, ebi_value, image_url, latitude, longitude,
+            {_DISTANCE_SQL} AS distance_m
+        FROM bloom_observations
+        WHERE {_NEAREST_SQL}
+          AND date_of_max_ebi >= $5 AND date_of_max_ebi < $6
+        ORDER BY {_NEAREST_ORDER_SQL}
+        LIMIT 1
+        """,
+        *_nearest_args(latitude, longitude, tolerance_m),
+        date(season, 1, 1),
+        date(season + 1, 1, 1),
+    )
+    return dict(row) if row else None
+
+
+async def find_nearest_prediction(
+    conn: asyncpg.Connection,
+    latitude: float,
+    longitude: float,
+    season: int,
+    tolerance_m: Optional[float] = None,
+) -> Optional[Dict[str, Any]]:
+    """Nearest stored bloom prediction within `tolerance_m` meters whose
+    predicted peak falls in the `season` (calendar year) bloom."""
+    row = await conn.fetchrow(
+        f"""
+        SELECT predicted_bloom_start, predicted_bloom_peak, confidence,
+            latitude, longitude, {_DISTANCE_SQL} AS distance_m
+        FROM bloom_predictions
+        WHERE {_NEAREST_SQL}
+          AND predicted_bloom_peak >= $5 AND predicted_bloom_peak < $6
+        ORDER BY {_NEAREST_ORDER_SQL}
+        LIMIT 1
+        """,
+        *_nearest_args(latitude, longitude, tolerance_m),
+        date(season, 1, 1),
+        date(season + 1, 1, 1),
+    )
+    return dict(row) if row else None
+
+
+def _start_of_day(day: date) -> datetime:
+    return datetime.combine(day, time.min, tzinfo=timezone.utc)
+
+
+def detection_valid_until(imagery_date: Optional[date], now: datetime) -> datetime:
+    """Until when a bloom detection computed `now` can be reused.
+
+    New imagery can only change the answer while this year's bloom season
+    window is open. Before it opens the previous season's result stands
+    until the first acquisition of the new season, after it closes the
+    result is final until next year's window. While it is open, Sentinel-2
+    revisits a tile every MUNDI_BLOOM_REVISIT_DAYS (5) days, so the result
+    holds until the acquisition after `imagery_date` is due, and at least
+    MUNDI_BLOOM_MIN_CACHE_HOURS (12) as cloudy acquisitions are skipped.
+    """
+    season_start, season_end = bloom_season(now.year)
+    if now.date() < season_start:
+        return _start_of_day(season_start)
+    if now.date() >= season_end:
+        return _start_of_day(bloom_season(now.year + 1)[0])
+
+    revisit = timedelta(days=float(os.environ.get("MUNDI_BLOOM_REVISIT_DAYS", "5")))
+    min_ttl = timedelta(
+        hours=float(os.environ.get("MUNDI_BLOOM_MIN_CACHE_HOURS", "12"))
+    )
+    valid_until = now + min_ttl
+    if imagery_date is not None:
+        valid_until = max(valid_until, _start_of_day(imagery_date) + revisit)
+    return min(valid_until, _start_of_day(season_end))
+
+
+async def find_cached_detection(
+    conn: asyncpg.Connection,
+    latitude: float,
+    longitude: float,
+    parameters: Dict[str, Any],
+    tolerance_m: Optional[float] = None,
+) -> Optional[Dict[str, Any]]:
+    """Nearest still valid detection within `tolerance_m` meters that was
+    computed with the same `parameters`."""
+    row = await conn.fetchrow(
+        f"""
+        SELECT date_of_max_ebi, ebi_value, image_url, season, imagery_date,
+            latitude, longitude, {_DISTANCE_SQL} AS distance_m
+        FROM bloom_observations
+        WHERE {_NEAREST_SQL}
+          AND valid_until > now()
+          AND parameters = $5::jsonb
+        ORDER BY {_NEAREST_ORDER_SQL}
+        LIMIT 1
+        """,
+        *_nearest_args(latitude, longitude, tolerance_m),
+        json.dumps(parameters),
+    )
+    return dict(row) if row else None
+
+
+async def store_detections(
+    conn: asyncpg.Connection,
+    detections: list[Dict[str, Any]],
+    parameters: Dict[str, Any],
+    map_id: Optional[str] = None,
+):
+    """Write computed detections through to bloom_observations.
+
+    Each detection has latitude, longitude, date_of_max_ebi, ebi_value,
+    image_url, season and imagery_date.
+    """
+    now = datetime.now(timezone.utc)
+    await conn.executemany(
+        """
+        INSERT INTO bloom_observations (
+            map_id, latitude, longitude, date_of_max_ebi, ebi_value, image_url,
+            season, imagery_date, parameters, valid_until
+        )
+        VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9::jsonb, $10)
+        """,
+        [
+            (
+                map_id,
+                d["latitude"],
+                d["longitude"],
+                d["date_of_max_ebi"],
+                d["ebi_value"],
+                d.get("image_url"),
+                d["season"],
+                d["imagery_date"],
+                json.dumps(parameters),
+                detection_valid_until(d["imagery_date"], now),
+            )
+            for d in detections
+        ],
+    )
+
+
+async def load_peak_history(
+    conn: asyncpg.Connection, since: date
+) -> list[asyncpg.Record]:
+    """Observed bloom peaks since `since`, one row per map or cached
+    detection, placeholders from failed detections excluded."""
+    return await conn.fetch(
+        """
+        SELECT latitude, longitude, date_of_max_ebi
+        FROM bloom_observations
+        WHERE date_of_max_ebi >= $1
+          AND ebi_value > 0
+        """,
+        since,
+    )
+
+
+async def store_predictions(
+    conn: asyncpg.Connection,
+    latitudes: list[float],
+    longitudes: list[float],
+    starts: list[date],
+    peaks: list[date],
+    confidence: float,
+    model_version: str,
+    map_id: Optional[str] = None,
+):
+    """Bulk insert predictions, one statement for any number of rows."""
+    await conn.execute(
+        """
+        INSERT INTO bloom_predictions (
+            map_id, latitude, longitude, predicted_bloom_start,
+            predicted_bloom_peak, confidence, model_version
+        )
+        SELECT $1, p.latitude, p.longitude, p.bloom_start, p.bloom_peak, $6, $7
+        FROM unnest($2::float8[], $3::float8[], $4::date[], $5::date[])
+            AS p(latitude, longitude, bloom_start, bloom_peak)
+        """,
+        map_id,
+        latitudes,
+        longitudes,
+        starts,
+        peaks,
+        confidence,
+        model_version,
+    )
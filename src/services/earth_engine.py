@@ -0,0 +1,663 @@
+import asyncio
+import hashlib
+import json
+import logging
+import math
+import os
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from datetime import date, datetime as dt, timedelta, timezone
+from functools import lru_cache
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple, TypeVar
+
+import ee
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# (acquisition date, mean EBI over the region of interest)
+EbiSeries = List[Tuple[date, float]]
+
+# half width of the square analysed around a point, 500 m gives 100 hectares
+ROI_BUFFER_M = 500
+CLOUD_THRESHOLD = 75
+
+
+class EarthEngineTimeout(Exception):
+    pass
+
+
+@dataclass(frozen=True)
+class Region:
+    """Area to analyse: the square around a point, or a GeoJSON polygon.
+
+    For polygons latitude/longitude are a representative point, used to
+    label results.
+    """
+
+    latitude: float
+    longitude: float
+    geometry: Optional[Dict[str, Any]] = None
+
+
+def region_from_geojson(geometry: Dict[str, Any]) -> Region:
+    """Region for a GeoJSON Polygon or MultiPolygon, labelled with the mean
+    of its exterior ring vertices."""
+    if geometry.get("type") == "Polygon":
+        rings = [geometry["coordinates"][0]]
+    elif geometry.get("type") == "MultiPolygon":
+        rings = [polygon[0] for polygon in geometry["coordinates"]]
+    else:
+        raise ValueError(f"Unsupported geometry type {geometry.get('type')!r}")
+    # closed rings repeat the first vertex at the end
+    vertices = [v for ring in rings for v in ring[:-1]]
+    if not vertices:
+        raise ValueError("Polygon has no vertices")
+    return Region(
+        latitude=sum(v[1] for v in vertices) / len(vertices),
+        longitude=sum(v[0] for v in vertices) / len(vertices),
+        geometry=geometry,
+    )
+
+
+def region_key(region: Region) -> str:
+    """Stable identifier of a region, for caches keyed by area."""
+    if region.geometry is not None:
+        geometry = json.dumps(region.geometry, sort_keys=True).encode()
+        return hashlib.sha256(geometry).hexdigest()
+    return f"{region.latitude:.5f},{region.longitude:.5f}"
+
+
+@dataclass(frozen=True)
+class EbiSummary:
+    """Bloom statistics of one season's EBI series."""
+
+    season: int
+    peak_date: date
+    peak_ebi: float
+    mean_ebi: float
+    image_count: int
+    # most recent acquisition with a valid EBI
+    imagery_date: date
+
+
+def summarize_ebi_series(season: int, series: EbiSeries) -> Optional[EbiSummary]:
+    """Summary of a series, None if it has no positive EBI to peak at."""
+    values = [(day, ebi) for day, ebi in series if ebi is not None]
+    peak_date, peak_ebi = max(values, key=lambda v: v[1], default=(None, 0))
+    if peak_date is None or not peak_ebi > 0:
+        return None
+    return EbiSummary(
+        season=season,
+        peak_date=peak_date,
+        peak_ebi=peak_ebi,
+        mean_ebi=sum(ebi for _, ebi in values) / len(values),
+        image_count=len(values),
+        imagery_date=max(day for day, _ in values),
+    )
+
+
+def bloom_season(year: int) -> Tuple[date, date]:
+    """Window searched for the bloom peak, the end date is exclusive."""
+    return date(year, 1, 15), date(year, 4, 15)
+
+
+# elements a getInfo of a collection returns before Earth Engine aborts it
+MAX_GETINFO_ROWS = 5000
+
+
+def image_date_ranges(
+    timestamps: Sequence[int], max_images: int
+) -> List[Tuple[int, int]]:
+    """Split acquisition times in epoch millis into [start, end) ranges of
+    at most `max_images` images each. Images acquired at the same time are
+    never split across ranges, so a range can exceed `max_images` when that
+    many share a timestamp."""
+    counts: Dict[int, int] = defaultdict(int)
+    for timestamp in timestamps:
+        counts[timestamp] += 1
+    ranges: List[Tuple[int, int]] = []
+    in_range = 0
+    for timestamp in sorted(counts):
+        if ranges and in_range + counts[timestamp] <= max_images:
+            ranges[-1] = (ranges[-1][0], timestamp + 1)
+            in_range += counts[timestamp]
+        else:
+            ranges.append((timestamp, timestamp + 1))
+            in_range = counts[timestamp]
+    return ranges
+
+
+def filter_cloudy_images(s2_collection, cloud_threshold=90):
+    """Filter out images with high cloud percentage"""
+    return s2_collection.filter(
+        ee.Filter.lt("CLOUDY_PIXEL_PERCENTAGE", cloud_threshold)
+    )
+
+
+def mask_clouds(img):
+    """Cloud mask for S2"""
+    qa = img.select("QA60")
+    cloud_mask = qa.bitwiseAnd(1 << 10).neq(0).Or(qa.bitwiseAnd(1 << 11).neq(0)).Not()
+    return img.updateMask(cloud_mask).copyProperties(img, ["system:time_start"])
+
+
+def calculate_ebi(img):
+    """Calculate Enhanced Bloom Index (EBI)"""
+    # Scale bands to reflectance
+    R = img.select("B4").multiply(1e-4)
+    G = img.select("B3").multiply(1e-4)
+    B = img.select("B2").multiply(1e-4).max(1e-6)  # Prevent division by zero
+
+    # EBI calculation
+    brightness = R.add(G).add(B)
+    greenness = G.divide(B)
+    soil_sig = R.subtract(B).add(1.0)  # EPS = 1.0
+    ebi = brightness.divide(greenness.multiply(soil_sig)).rename("EBI")
+
+    return img.addBands(ebi).copyProperties(img, ["system:time_start"])
+
+
+def extract_ebi_mean(img, roi):
+    """Extract mean EBI for each image"""
+    mean_ebi = (
+        img.select("EBI")
+        .reduceRegion(
+            reducer=ee.Reducer.mean(),
+            geometry=roi,
+            scale=10,
+            maxPixels=1e10,
+            bestEffort=True,
+        )
+        .get("EBI")
+    )
+
+    date = img.date().format("YYYY-MM-dd")
+    return ee.Feature(
+        None, {"date": date, "mean_ebi": mean_ebi, "timestamp": img.date().millis()}
+    )
+
+
+def get_ebi_geotiff_url(s2_collection, peak_date, roi):
+    """Peak EBI GeoTIFF URL from GEE"""
+    try:
+        # Filter collection
+        peak_date_str = peak_date.strftime("%Y-%m-%d")
+        peak_day_start = ee.Date(peak_date_str)
+        peak_day_end = peak_day_start.advance(1, "day")
+
+        peak_image = s2_collection.filterDate(peak_day_start, peak_day_end).first()
+
+        export_image = peak_image.select("EBI").clip(roi)
+        # Get min/max values for scaling
+        minMax = export_image.reduceRegion(
+            reducer=ee.Reducer.minMax(),
+            geometry=roi,
+            scale=10,
+            maxPixels=1e10,
+            bestEffort=True,
+        )
+
+        ebi_min = minMax.get("EBI_min")
+        ebi_max = minMax.get("EBI_max")
+
+        color_palette = ["0d0887", "6300a7", "ab2494", "e34f6f", "fb9f3a", "f0f921"]
+
+        # Create scaled visualization
+        rgb_image = export_image.visualize(
+            min=ebi_min, max=ebi_max, palette=color_palette
+        )
+
+        # Get download URL
+        url = rgb_image.getDownloadURL(
+            {"scale": 10, "crs": "EPSG:4326", "region": roi, "format": "GEO_TIFF"}
+        )
+
+        return url
+
+    except Exception as e:
+        logger.warning(f"EBI GeoTIFF export failed: {e}")
+        return None
+
+
+class EarthEngineBackend(ABC):
+    """Earth Engine access that never blocks the event loop.
+
+    Every call into the Earth Engine client library is synchronous, often a
+    multi-second HTTP round trip, so it runs on a dedicated pool of at most
+    `max_workers` threads and is abandoned after `timeout` seconds. Time
+    spent queueing for a free thread counts against the timeout, so a burst
+    of requests degrades into timeouts instead of an ever-growing backlog.
+    """
+
+    name: str
+
+    def __init__(self, max_workers: int = 4, timeout: float = 60.0):
+        self.timeout = timeout
+        self.max_workers = max_workers
+        self.executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix=f"ee-{self.name}"
+        )
+        self.init_lock = threading.Lock()
+        self.initialized = False
+
+    def _initialize(self) -> None:
+        """Authenticate the session, blocking. Raises on failure."""
+        pass
+
+    def _ensure_initialized(self) -> None:
+        if self.initialized:
+            return
+        with self.init_lock:
+            if not self.initialized:
+                self._initialize()
+                self.initialized = True
+
+    async def run(
+        self, fn: Callable[..., T], *args, timeout: Optional[float] = None
+    ) -> T:
+        def call():
+            self._ensure_initialized()
+            return fn(*args)
+
+        loop = asyncio.get_running_loop()
+        timeout = self.timeout if timeout is None else timeout
+        try:
+            return await asyncio.wait_for(
+                loop.run_in_executor(self.executor, call), timeout=timeout
+            )
+        except asyncio.TimeoutError:
+            name = getattr(fn, "__name__", repr(fn))
+            raise EarthEngineTimeout(
+                f"Earth Engine call {name} timed out after {timeout} seconds"
+            )
+
+    async def start(self) -> bool:
+        """Initialize the session up front, called from the app lifespan.
+
+        A failure is logged rather than raised so the rest of the app still
+        starts, the next call retries the initialization.
+        """
+        try:
+            await self.run(lambda: None)
+            return True
+        except Exception as e:
+            logger.warning(f"Earth Engine ({self.name}) initialization failed: {e}")
+            return False
+
+    def close(self) -> None:
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+    async def ebi_time_series(
+        self, latitude: float, longitude: float, seasons: Sequence[int]
+    ) -> Tuple[int, EbiSeries]:
+        """Mean EBI per cloud-filtered image around the point, for the first
+        of `seasons` that has any imagery. Returns (season, series)."""
+        return await self.run(self._ebi_time_series, latitude, longitude, seasons)
+
+    async def ebi_summary(
+        self, latitude: float, longitude: float, seasons: Sequence[int]
+    ) -> Optional[EbiSummary]:
+        """Peak and mean EBI around the point for the first of `seasons`
+        with valid EBI values, None if none has any."""
+        return await self.run(self._ebi_summary, latitude, longitude, seasons)
+
+    async def ebi_time_series_many(
+        self, regions: Sequence[Region], seasons: Sequence[int]
+    ) -> List[Optional[Tuple[int, EbiSeries]]]:
+        """Like ebi_time_series for every region at once, computed in one
+        reduction per season. None for regions without imagery in any of
+        `seasons`."""
+        return await self.run(self._ebi_time_series_many, regions, seasons)
+
+    async def ebi_image_url(
+        self, latitude: float, longitude: float, peak_date: date
+    ) -> Optional[str]:
+        """Download URL of the colorized EBI GeoTIFF on `peak_date`, if any."""
+        return await self.run(self._ebi_image_url, latitude, longitude, peak_date)
+
+    @abstractmethod
+    def _ebi_time_series(
+        self, latitude: float, longitude: float, seasons: Sequence[int]
+    ) -> Tuple[int, EbiSeries]:
+        pass
+
+    def _ebi_summary(
+        self, latitude: float, longitude: float, seasons: Sequence[int]
+    ) -> Optional[EbiSummary]:
+        return summarize_ebi_series(
+            *self._ebi_time_series(latitude, longitude, seasons)
+        )
+
+    @abstractmethod
+    def _ebi_time_series_many(
+        self, regions: Sequence[Region], seasons: Sequence[int]
+    ) -> List[Optional[Tuple[int, EbiSeries]]]:
+        pass
+
+    @abstractmethod
+    def _ebi_image_url(
+        self, latitude: float, longitude: float, peak_date: date
+    ) -> Optional[str]:
+        pass
+
+
+class GoogleEarthEngineBackend(EarthEngineBackend):
+    """Sentinel-2 surface reflectance from Google Earth Engine."""
+
+    name = "google"
+
+    def __init__(
+        self,
+        service_account: str,
+        credentials_path: str,
+        max_workers: int = 4,
+        timeout: float = 60.0,
+    ):
+        super().__init__(max_workers=max_workers, timeout=timeout)
+        self.service_account = service_account
+        self.credentials_path = credentials_path
+
+    def _initialize(self) -> None:
+        credentials = ee.ServiceAccountCredentials(
+            self.service_account, self.credentials_path
+        )
+        ee.Initialize(credentials)
+
+    def _roi(self, latitude: float, longitude: float):
+        return ee.Geometry.Point([longitude, latitude]).buffer(ROI_BUFFER_M).bounds()
+
+    def _collection(self, roi, start: date, end: date):
+        return (
+            ee.ImageCollection("COPERNICUS/S2_SR_HARMONIZED")
+            .filterBounds(roi)
+            .filterDate(start.isoformat(), end.isoformat())
+            .map(mask_clouds)
+            .map(calculate_ebi)
+            .map(lambda img: img.clip(roi))
+        )
+
+    def _ebi_time_series(
+        self, latitude: float, longitude: float, seasons: Sequence[int]
+    ) -> Tuple[int, EbiSeries]:
+        roi = self._roi(latitude, longitude)
+        for season in seasons:
+            s2_collection = self._collection(roi, *bloom_season(season))
+            if s2_collection.size().getInfo() == 0:
+                continue
+
+            s2_collection = filter_cloudy_images(s2_collection, CLOUD_THRESHOLD)
+            time_series_fc = s2_collection.map(
+                lambda img: extract_ebi_mean(img, roi)
+            ).filter(ee.Filter.notNull(["mean_ebi"]))
+            features = time_series_fc.getInfo()["features"]
+            return season, [
+                (
+                    dt.strptime(f["properties"]["date"], "%Y-%m-%d").date(),
+                    f["properties"]["mean_ebi"],
+                )
+                for f in features
+            ]
+        raise Exception("No Sentinel-2 data available for the location")
+
+    def _season_stats(self, roi, season: int):
+        start, end = bloom_season(season)
+        s2_collection = filter_cloudy_images(
+            self._collection(roi, start, end), CLOUD_THRESHOLD
+        )
+        time_series_fc = s2_collection.map(
+            lambda img: extract_ebi_mean(img, roi)
+        ).filter(ee.Filter.notNull(["mean_ebi"]))
+        image_count = time_series_fc.size()
+        # max with a tie input returns the timestamp of the peak image
+        peak = time_series_fc.reduceColumns(
+            ee.Reducer.max(2).setOutputs(["peak_ebi", "peak_timestamp"]),
+            ["mean_ebi", "timestamp"],
+        )
+        return ee.Dictionary(
+            ee.Algorithms.If(
+                image_count.gt(0),
+                peak.combine(
+                    {
+                        "season": season,
+                        "image_count": image_count,
+                        "mean_ebi": time_series_fc.aggregate_mean("mean_ebi"),
+                        "imagery_timestamp": time_series_fc.aggregate_max("timestamp"),
+                    }
+                ),
+                {"season": season, "image_count": 0},
+            )
+        )
+
+    def _ebi_summary(
+        self, latitude: float, longitude: float, seasons: Sequence[int]
+    ) -> Optional[EbiSummary]:
+        # counting, falling back to earlier seasons and the peak/mean
+        # reductions are one server side expression, fetched with a single
+        # getInfo instead of a round trip per step
+        roi = self._roi(latitude, longitude)
+        chosen = self._season_stats(roi, seasons[-1])
+        for season in reversed(seasons[:-1]):
+            stats = self._season_stats(roi, season)
+            chosen = ee.Algorithms.If(
+                ee.Number(stats.get("image_count")).gt(0), stats, chosen
+            )
+        result = ee.Dictionary(chosen).getInfo()
+        if not result["image_count"] or not result["peak_ebi"] > 0:
+            return None
+
+        def to_date(millis):
+            return dt.fromtimestamp(millis / 1000, tz=timezone.utc).date()
+
+        return EbiSummary(
+            season=result["season"],
+            peak_date=to_date(result["peak_timestamp"]),
+            peak_ebi=result["peak_ebi"],
+            mean_ebi=result["mean_ebi"],
+            image_count=result["image_count"],
+            imagery_date=to_date(result["imagery_timestamp"]),
+        )
+
+    def _ebi_time_series_many(
+        self, regions: Sequence[Region], seasons: Sequence[int]
+    ) -> List[Optional[Tuple[int, EbiSeries]]]:
+        results: List[Optional[Tuple[int, EbiSeries]]] = [None] * len(regions)
+        pending = list(range(len(regions)))
+        for season in seasons:
+            if not pending:
+                break
+            # one feature per region, reduceRegions computes every region's
+            # mean for an image in a single pass
+            regions_fc = ee.FeatureCollection(
+                [
+                    ee.Feature(self._region_geometry(regions[i]), {"idx": i})
+                    for i in pending
+                ]
+            )
+            start, end = bloom_season(season)
+            s2_collection = filter_cloudy_images(
+                ee.ImageCollection("COPERNICUS/S2_SR_HARMONIZED")
+                .filterBounds(regions_fc.geometry())
+                .filterDate(start.isoformat(), end.isoformat())
+                .map(mask_clouds)
+                .map(calculate_ebi),
+                CLOUD_THRESHOLD,
+            )
+
+            # getInfo gives up on collections of more than MAX_GETINFO_ROWS
+            # elements, each image yields up to one row per region
+            timestamps = s2_collection.aggregate_array("system:time_start").getInfo()
+            ranges = image_date_ranges(
+                timestamps, max(MAX_GETINFO_ROWS // len(pending), 1)
+            )
+
+            def reduce_image(img):
+                acquired = img.date().format("YYYY-MM-dd")
+                return (
+                    img.select("EBI")
+                    .reduceRegions(
+                        collection=regions_fc,
+                        reducer=ee.Reducer.mean().setOutputs(["mean_ebi"]),
+                        scale=10,
+                    )
+                    .filter(ee.Filter.notNull(["mean_ebi"]))
+                    .map(lambda f: f.set("date", acquired))
+                )
+
+            rows = []
+            for range_start, range_end in ranges:
+                rows += (
+                    s2_collection.filterDate(range_start, range_end)
+                    .map(reduce_image)
+                    .flatten()
+                    .select(["idx", "date", "mean_ebi"], None, False)
+                    .getInfo()["features"]
+                )
+
+            series: Dict[int, EbiSeries] = defaultdict(list)
+            for row in rows:
+                props = row["properties"]
+                series[props["idx"]].append(
+                    (dt.strptime(props["date"], "%Y-%m-%d").date(), props["mean_ebi"])
+                )
+            for idx, points in series.items():
+                results[idx] = (season, sorted(points))
+            pending = [i for i in pending if i not in series]
+        return results
+
+    def _region_geometry(self, region: Region):
+        if region.geometry is not None:
+            return ee.Geometry(region.geometry)
+        return self._roi(region.latitude, region.longitude)
+
+    def _ebi_image_url(
+        self, latitude: float, longitude: float, peak_date: date
+    ) -> Optional[str]:
+        roi = self._roi(latitude, longitude)
+        s2_collection = filter_cloudy_images(
+            self._collection(roi, peak_date, peak_date + timedelta(days=1)),
+            CLOUD_THRESHOLD,
+        )
+        return get_ebi_geotiff_url(s2_collection, peak_date, roi)
+
+
+class FakeEarthEngineBackend(EarthEngineBackend):
+    """Deterministic synthetic imagery, no network or credentials needed.
+
+    Every point gets a five-day revisit series with a single bloom bump
+    whose timing and height depend only on the coordinates, so results are
+    reproducible across runs. `latency` seconds of sleep per call stand in
+    for the Earth Engine round trip when benchmarking the thread pool.
+    """
+
+    name = "fake"
+
+    def __init__(
+        self, latency: float = 0.0, max_workers: int = 4, timeout: float = 60.0
+    ):
+        super().__init__(max_workers=max_workers, timeout=timeout)
+        self.latency = latency
+
+    def _seed(self, latitude: float, longitude: float) -> int:
+        key = f"{latitude:.4f},{longitude:.4f}".encode()
+        return int.from_bytes(hashlib.sha256(key).digest()[:4], "big")
+
+    def _ebi_time_series(
+        self, latitude: float, longitude: float, seasons: Sequence[int]
+    ) -> Tuple[int, EbiSeries]:
+        if self.latency:
+            time.sleep(self.latency)
+        return self._synthetic_series(latitude, longitude, seasons[0])
+
+    def _synthetic_series(
+        self, latitude: float, longitude: float, season: int
+    ) -> Tuple[int, EbiSeries]:
+        start, end = bloom_season(season)
+        seed = self._seed(latitude, longitude)
+        peak_offset = 20 + seed % 50
+        peak_height = 0.8 + (seed >> 8) % 100 / 100
+
+        series = []
+        day = start
+        while day < end:
+            offset = (day - start).days
+            bump = math.exp(-(((offset - peak_offset) / 12) ** 2))
+            series.append((day, round(0.4 + peak_height * bump, 4)))
+            day += timedelta(days=5)
+        return season, series
+
+    def _ebi_time_series_many(
+        self, regions: Sequence[Region], seasons: Sequence[int]
+    ) -> List[Optional[Tuple[int, EbiSeries]]]:
+        if self.latency:
+            time.sleep(self.latency)
+        return [
+            self._synthetic_series(region.latitude, region.longitude, seasons[0])
+            for region in regions
+        ]
+
+    def _ebi_image_url(
+        self, latitude: float, longitude: float, peak_date: date
+    ) -> Optional[str]:
+        if self.latency:
+            time.sleep(self.latency)
+        # nothing to download, callers skip adding a map layer
+        return None
+
+
+def get_earth_engine_backend() -> EarthEngineBackend:
+    # MUNDI_EARTH_ENGINE=fake serves synthetic imagery, for offline
+    # development, tests and benchmarks. MUNDI_EARTH_ENGINE=local computes
+    # from Sentinel-2 scenes cached under MUNDI_S2_CACHE_DIR
+    max_workers = int(os.environ.get("MUNDI_EE_MAX_WORKERS", "4"))
+    timeout = float(os.environ.get("MUNDI_EE_TIMEOUT_SECONDS", "60"))
+    backend = os.environ.get("MUNDI_EARTH_ENGINE", "google")
+    if backend == "local":
+        from src.services.ebi_stack import EbiStackStore
+        from src.services.local_ebi import LocalSentinel2Backend
+
+        # MUNDI_EBI_STACK_DIR keeps per region EBI stacks, so a season's
+        # series is one read instead of one computation per scene
+        stack_dir = os.environ.get("MUNDI_EBI_STACK_DIR")
+        stacks = None
+        if stack_dir:
+            cache_mb = int(os.environ.get("MUNDI_EBI_STACK_CACHE_MB", "256"))
+            stacks = EbiStackStore(stack_dir, cache_bytes=cache_mb * 2**20)
+        return LocalSentinel2Backend(
+            root=os.environ["MUNDI_S2_CACHE_DIR"],
+            boa_offset=float(os.environ.get("MUNDI_S2_BOA_OFFSET", "0")),
+            max_workers=max_workers,
+            timeout=timeout,
+            stacks=stacks,
+            rescan_seconds=float(os.environ.get("MUNDI_S2_RESCAN_SECONDS", "300")),
+        )
+    if backend == "fake":
+        return FakeEarthEngineBackend(
+            latency=float(os.environ.get("MUNDI_FAKE_EE_LATENCY_SECONDS", "0")),
+            max_workers=max_workers,
+            timeout=timeout,
+        )
+    return GoogleEarthEngineBackend(
+        service_account=os.environ.get(
+            "EE_SERVICE_ACCOUNT",
+            "gee-farmane@vaulted-channel-234121.iam.gserviceaccount.com",
+        ),
+        credentials_path=os.environ.get(
+            "EE_CREDENTIALS_PATH",
+            os.path.join(
+                os.path.dirname(__file__), "vaulted-channel-234121-376df8d2d29a.json"
+            ),
+        ),
+        max_workers=max_workers,
+        timeout=timeout,
+    )
+
+
+@lru_cache(maxsize=1)
+def get_earth_engine() -> EarthEngineBackend:
+    return get_earth_engine_backend()
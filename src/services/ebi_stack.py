@@ -0,0 +1,322 @@
+import fcntl
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from dataclasses import dataclass
+from datetime import date
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+from affine import Affine
+from rasterio.features import geometry_mask
+from rasterio.transform import rowcol
+from rasterio.warp import transform
+
+from src.services.earth_engine import EbiSeries
+
+# 64 x 64 px of 10 m pixels, 16 KiB of float32 per date and tile
+TILE_SIZE = 64
+
+
+@dataclass(frozen=True)
+class StackGrid:
+    crs: str
+    transform: Affine
+    width: int
+    height: int
+
+
+def _write_meta(path: str, grid: StackGrid, dates: List[date]) -> None:
+    """Replace the stack's meta.json atomically, readers never see half of
+    it."""
+    meta = {
+        "crs": grid.crs,
+        "transform": list(grid.transform)[:6],
+        "width": grid.width,
+        "height": grid.height,
+        "dates": [d.isoformat() for d in dates],
+    }
+    tmp = os.path.join(path, "meta.json.tmp")
+    with open(tmp, "w") as f:
+        json.dump(meta, f)
+    os.replace(tmp, os.path.join(path, "meta.json"))
+
+
+@contextmanager
+def _flock(path: str) -> Iterator[None]:
+    """Exclusive lock on the stack directory `path`, across processes."""
+    with open(os.path.join(path, "lock"), "a") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+class TileCache:
+    """In-memory LRU of tile arrays, bounded by their total size in bytes.
+
+    Entries remember how many dates they hold, an append makes them stale.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.entries: OrderedDict[Tuple, np.ndarray] = OrderedDict()
+        self.total = 0
+        self.lock = threading.Lock()
+
+    def get(self, key: Tuple) -> Optional[np.ndarray]:
+        with self.lock:
+            tile = self.entries.get(key)
+            if tile is not None:
+                self.entries.move_to_end(key)
+            return tile
+
+    def set(self, key: Tuple, tile: np.ndarray) -> None:
+        with self.lock:
+            if key in self.entries:
+                self.total -= self.entries.pop(key).nbytes
+            self.entries[key] = tile
+            self.total += tile.nbytes
+            while self.total > self.max_bytes and self.entries:
+                self.total -= self.entries.popitem(last=False)[1].nbytes
+
+
+class EbiStack:
+    """Date-indexed stack of EBI rasters over one area of interest.
+
+    The AOI's grid is cut into TILE_SIZE tiles, each stored as one file of
+    float32 planes appended in date order, NaN where masked. Reading any
+    window over any range of dates is then one contiguous read per tile it
+    touches, however many dates it spans, so a season-long curve for a
+    block costs a handful of reads instead of one computation per image.
+
+    Dates are append-only and strictly increasing. Web, chat worker and
+    scheduler processes share the stacks, so appends and the dates a read
+    sees are serialized with a lock file in the stack directory, and the
+    dates are reloaded from meta.json each time it is taken.
+    """
+
+    def __init__(self, path: str, cache: TileCache):
+        self.path = path
+        self.cache = cache
+        # reentrant so appends can run inside locked()
+        self.lock = threading.RLock()
+        self.held = False
+        meta = self._load_meta()
+        self.grid = StackGrid(
+            crs=meta["crs"],
+            transform=Affine(*meta["transform"]),
+            width=meta["width"],
+            height=meta["height"],
+        )
+        self.dates: List[date] = [date.fromisoformat(d) for d in meta["dates"]]
+
+    def _load_meta(self) -> Dict:
+        with open(os.path.join(self.path, "meta.json")) as f:
+            return json.load(f)
+
+    @contextmanager
+    def locked(self) -> Iterator[None]:
+        """Hold the stack against every other thread and process, with the
+        dates as another process may have appended them."""
+        with self.lock:
+            if self.held:
+                yield
+                return
+            with _flock(self.path):
+                self.held = True
+                try:
+                    self.dates = [
+                        date.fromisoformat(d) for d in self._load_meta()["dates"]
+                    ]
+                    yield
+                finally:
+                    self.held = False
+
+    @property
+    def last_date(self) -> Optional[date]:
+        with self.locked():
+            return self.dates[-1] if self.dates else None
+
+    def _tiles(self) -> Tuple[int, int]:
+        return (
+            -(-self.grid.height // TILE_SIZE),
+            -(-self.grid.width // TILE_SIZE),
+        )
+
+    def _tile_path(self, row: int, col: int) -> str:
+        return os.path.join(self.path, "tiles", f"{row}_{col}.f32")
+
+    def append(self, day: date, ebi: np.ndarray) -> None:
+        """Append the (height, width) EBI raster of `day`, blocking."""
+        if ebi.shape != (self.grid.height, self.grid.width):
+            raise ValueError(f"Expected shape {self.grid.height, self.grid.width}")
+        with self.locked():
+            if self.dates and day <= self.dates[-1]:
+                raise ValueError(f"{day} is not after the last date {self.dates[-1]}")
+            n = len(self.dates)
+            rows, cols = self._tiles()
+            padded = np.full(
+                (rows * TILE_SIZE, cols * TILE_SIZE), np.nan, dtype="float32"
+            )
+            padded[: ebi.shape[0], : ebi.shape[1]] = ebi
+            for row in range(rows):
+                for col in range(cols):
+                    plane = padded[
+                        row * TILE_SIZE : (row + 1) * TILE_SIZE,
+                        col * TILE_SIZE : (col + 1) * TILE_SIZE,
+                    ]
+                    with open(self._tile_path(row, col), "r+b") as f:
+                        # overwrite whatever a failed append left behind
+                        f.seek(n * plane.nbytes)
+                        f.write(plane.tobytes())
+                        f.truncate()
+            # the date only becomes visible once every tile holds it
+            _write_meta(self.path, self.grid, self.dates + [day])
+            self.dates = self.dates + [day]
+
+    @staticmethod
+    def _date_range(dates: List[date], start: date, end: date) -> Tuple[int, int]:
+        dates = np.array(dates, dtype="datetime64[D]")
+        return (
+            int(np.searchsorted(dates, np.datetime64(start, "D"))),
+            int(np.searchsorted(dates, np.datetime64(end, "D"))),
+        )
+
+    def _read_tile(self, row: int, col: int, n: int) -> np.ndarray:
+        key = (self.path, row, col, n)
+        tile = self.cache.get(key)
+        if tile is None:
+            tile = np.fromfile(
+                self._tile_path(row, col),
+                dtype="float32",
+                count=n * TILE_SIZE * TILE_SIZE,
+            ).reshape(n, TILE_SIZE, TILE_SIZE)
+            self.cache.set(key, tile)
+        return tile
+
+    def read(
+        self,
+        start: date,
+        end: date,
+        window: Optional[Tuple[int, int, int, int]] = None,
+    ) -> Tuple[List[date], np.ndarray]:
+        """Dates in [start, end) and their (dates, rows, cols) EBI over
+        `window`, (row_start, row_stop, col_start, col_stop), whole grid by
+        default."""
+        with self.locked():
+            dates = list(self.dates)
+        # planes before n never change, they are read without the lock
+        n = len(dates)
+        i0, i1 = self._date_range(dates, start, end)
+        r0, r1, c0, c1 = window or (0, self.grid.height, 0, self.grid.width)
+        r0, c0 = max(r0, 0), max(c0, 0)
+        r1, c1 = min(r1, self.grid.height), min(c1, self.grid.width)
+        out = np.full((i1 - i0, max(r1 - r0, 0), max(c1 - c0, 0)), np.nan, "float32")
+        if i0 == i1 or r0 >= r1 or c0 >= c1:
+            return dates[i0:i1], out
+
+        for row in range(r0 // TILE_SIZE, (r1 - 1) // TILE_SIZE + 1):
+            for col in range(c0 // TILE_SIZE, (c1 - 1) // TILE_SIZE + 1):
+                tile = self._read_tile(row, col, n)
+                tr0, tc0 = row * TILE_SIZE, col * TILE_SIZE
+                ar0, ar1 = max(r0, tr0), min(r1, tr0 + TILE_SIZE)
+                ac0, ac1 = max(c0, tc0), min(c1, tc0 + TILE_SIZE)
+                out[:, ar0 - r0 : ar1 - r0, ac0 - c0 : ac1 - c0] = tile[
+                    i0:i1, ar0 - tr0 : ar1 - tr0, ac0 - tc0 : ac1 - tc0
+                ]
+        return dates[i0:i1], out
+
+    def point_series(
+        self, latitude: float, longitude: float, start: date, end: date
+    ) -> EbiSeries:
+        """EBI of the pixel under a lat/lon per date, masked dates left out."""
+        xs, ys = transform("EPSG:4326", self.grid.crs, [longitude], [latitude])
+        row, col = rowcol(self.grid.transform, xs[0], ys[0])
+        dates, values = self.read(start, end, (row, row + 1, col, col + 1))
+        if values.size == 0:
+            return []
+        return [
+            (day, float(v)) for day, v in zip(dates, values[:, 0, 0]) if np.isfinite(v)
+        ]
+
+    def region_series(
+        self,
+        geometry,
+        start: date,
+        end: date,
+        max_masked_percent: float = 100.0,
+    ) -> EbiSeries:
+        """Mean EBI inside a polygon in the stack's CRS per date. Dates with
+        more than `max_masked_percent` of the polygon masked are left out."""
+        inside = geometry_mask(
+            [geometry],
+            out_shape=(self.grid.height, self.grid.width),
+            transform=self.grid.transform,
+            invert=True,
+        )
+        rows = np.flatnonzero(inside.any(axis=1))
+        cols = np.flatnonzero(inside.any(axis=0))
+        if rows.size == 0:
+            return []
+        r0, r1, c0, c1 = rows[0], rows[-1] + 1, cols[0], cols[-1] + 1
+        dates, values = self.read(start, end, (r0, r1, c0, c1))
+        inside = inside[r0:r1, c0:c1]
+
+        valid = np.isfinite(values) & inside
+        counts = valid.sum(axis=(1, 2))
+        sums = np.where(valid, values, 0).sum(axis=(1, 2), dtype="float64")
+        masked = 100 * (1 - counts / inside.sum())
+        return [
+            (day, float(total / count))
+            for day, total, count, pct in zip(dates, sums, counts, masked)
+            if count and pct <= max_masked_percent
+        ]
+
+
+class EbiStackStore:
+    """EBI stacks of many AOIs under `root`, one directory per AOI."""
+
+    def __init__(self, root: str, cache_bytes: int = 256 * 2**20):
+        self.root = root
+        self.cache = TileCache(cache_bytes)
+        self.stacks: Dict[str, EbiStack] = {}
+        self.lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+
+    def _path(self, aoi: str) -> str:
+        return os.path.join(self.root, hashlib.sha256(aoi.encode()).hexdigest()[:32])
+
+    def _open(self, aoi: str) -> Optional[EbiStack]:
+        stack = self.stacks.get(aoi)
+        if stack is None and os.path.exists(os.path.join(self._path(aoi), "meta.json")):
+            stack = self.stacks[aoi] = EbiStack(self._path(aoi), self.cache)
+        return stack
+
+    def open(self, aoi: str) -> Optional[EbiStack]:
+        with self.lock:
+            return self._open(aoi)
+
+    def create(self, aoi: str, grid: StackGrid) -> EbiStack:
+        """Open the AOI's stack, creating an empty one on `grid` if it does
+        not exist yet."""
+        with self.lock:
+            stack = self._open(aoi)
+            if stack is not None:
+                return stack
+            path = self._path(aoi)
+            os.makedirs(os.path.join(path, "tiles"), exist_ok=True)
+            with _flock(path):
+                # another process may have created it in the meantime
+                if not os.path.exists(os.path.join(path, "meta.json")):
+                    for row in range(-(-grid.height // TILE_SIZE)):
+                        for col in range(-(-grid.width // TILE_SIZE)):
+                            tile = os.path.join(path, "tiles", f"{row}_{col}.f32")
+                            open(tile, "wb").close()
+                    _write_meta(path, grid, [])
+            stack = self.stacks[aoi] = EbiStack(path, self.cache)
+            return stack
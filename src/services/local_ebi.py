@@ -0,0 +1,599 @@
+import logging
+import math
+import os
+import threading
+import time
+from dataclasses import dataclass
+from datetime import date
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import rasterio
+from affine import Affine
+from rasterio.enums import Resampling
+from rasterio.errors import WindowError
+from rasterio.features import geometry_mask
+from rasterio.vrt import WarpedVRT
+from rasterio.warp import transform, transform_bounds, transform_geom
+from rasterio.windows import Window, from_bounds
+
+from src.services.earth_engine import (
+    CLOUD_THRESHOLD,
+    ROI_BUFFER_M,
+    EarthEngineBackend,
+    EbiSeries,
+    Region,
+    bloom_season,
+    region_key,
+)
+from src.services.ebi_stack import EbiStack, EbiStackStore, StackGrid
+from src.services.pest import CHIP_SIZE, PIXEL_SIZE_M, ChipSource, tile_chips
+
+logger = logging.getLogger(__name__)
+
+BANDS = ("B02", "B03", "B04", "SCL")
+
+# Sentinel-2 L2A scene classification: no data, saturated, cloud shadow,
+# cloud medium/high probability, thin cirrus
+MASKED_SCL_CLASSES = np.array([0, 1, 3, 8, 9, 10])
+# regions of a scene are read in windows of at most this many 10 m pixels,
+# 16 MiB per float32 band
+MAX_WINDOW_PIXELS = 2048 * 2048
+
+
+@dataclass(frozen=True)
+class Scene:
+    tile: str
+    acquired: date
+    paths: Dict[str, str]
+    crs: str
+    # (west, south, east, north) in EPSG:4326
+    bounds: Tuple[float, float, float, float]
+
+
+def scan_scenes(root: str) -> List[Scene]:
+    """Scenes cached under `root` with all of BANDS present, blocking."""
+    scenes = []
+    for tile in sorted(os.listdir(root)):
+        tile_dir = os.path.join(root, tile)
+        if not os.path.isdir(tile_dir):
+            continue
+        for day in sorted(os.listdir(tile_dir)):
+            scene_dir = os.path.join(tile_dir, day)
+            paths = {b: os.path.join(scene_dir, f"{b}.tif") for b in BANDS}
+            if not all(os.path.exists(p) for p in paths.values()):
+                continue
+            try:
+                acquired = date.fromisoformat(day)
+            except ValueError:
+                continue
+            with rasterio.open(paths["B04"]) as src:
+                crs = src.crs.to_string()
+                bounds = transform_bounds(src.crs, "EPSG:4326", *src.bounds)
+            scenes.append(Scene(tile, acquired, paths, crs, bounds))
+    return scenes
+
+
+class SceneIndex:
+    """Scenes cached under `root`, rescanned when older than
+    `rescan_seconds` so scenes synced while the process runs are used."""
+
+    def __init__(self, root: str, rescan_seconds: float = 300.0):
+        self.root = root
+        self.rescan_seconds = rescan_seconds
+        self.scenes: List[Scene] = []
+        self.scanned_at: Optional[float] = None
+        self.lock = threading.Lock()
+        # reentrant, get() rescans through refresh()
+        self.scan_lock = threading.RLock()
+
+    def _stale(self) -> bool:
+        with self.lock:
+            return (
+                self.scanned_at is None
+                or time.monotonic() - self.scanned_at > self.rescan_seconds
+            )
+
+    def refresh(self) -> None:
+        """Rescan the cache directory, blocking."""
+        with self.scan_lock:
+            scenes = scan_scenes(self.root)
+            with self.lock:
+                self.scenes = scenes
+                self.scanned_at = time.monotonic()
+        logger.info(f"Found {len(scenes)} cached Sentinel-2 scenes in {self.root}")
+
+    def get(self) -> List[Scene]:
+        """Current scenes, blocking while a stale index is rescanned."""
+        if self._stale():
+            with self.scan_lock:
+                # another thread may have rescanned while this one waited
+                if self._stale():
+                    self.refresh()
+        with self.lock:
+            return self.scenes
+
+
+def calculate_ebi(
+    red: np.ndarray, green: np.ndarray, blue: np.ndarray, offset: float = 0.0
+) -> np.ndarray:
+    """Enhanced Bloom Index of reflectance DN arrays, same formula as the
+    Earth Engine backend"""
+    r = (red + offset) * 1e-4
+    g = (green + offset) * 1e-4
+    b = np.maximum((blue + offset) * 1e-4, 1e-6)  # Prevent division by zero
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return (r + g + b) / ((g / b) * (r - b + 1.0))
+
+
+class LocalSentinel2Backend(EarthEngineBackend):
+    """EBI computed with NumPy over locally cached Sentinel-2 L2A COGs.
+
+    Scenes live under `root` as {tile}/{YYYY-MM-DD}/{B02,B03,B04,SCL}.tif,
+    e.g. as synced from a STAC catalogue. Regions are batched per scene:
+    nearby regions share one windowed read per band, of at most
+    MAX_WINDOW_PIXELS, the EBI is computed once per window and each region
+    only masks its own slice of it. Pixels the SCL band classifies as cloud,
+    cloud shadow, cirrus or no data are excluded, and a scene is skipped for
+    a region when more than CLOUD_THRESHOLD percent of it is masked.
+
+    `boa_offset` is added to the DNs before scaling, -1000 for scenes of
+    processing baseline 04.00 or later that have not been harmonized.
+
+    With `stacks`, each region's EBI is instead kept as a date-indexed
+    stack: scenes newer than the stack's last date are computed once and
+    appended, and a series is a single chunked read of the stack. Scenes
+    added to the cache out of date order are not backfilled into existing
+    stacks.
+
+    The cache directory is rescanned every `rescan_seconds`, so scenes
+    synced while the process runs are used without a restart.
+    """
+
+    name = "local"
+
+    def __init__(
+        self,
+        root: str,
+        boa_offset: float = 0.0,
+        max_workers: int = 4,
+        timeout: float = 60.0,
+        stacks: Optional[EbiStackStore] = None,
+        rescan_seconds: float = 300.0,
+    ):
+        super().__init__(max_workers=max_workers, timeout=timeout)
+        self.root = root
+        self.boa_offset = boa_offset
+        self.stacks = stacks
+        self.index = SceneIndex(root, rescan_seconds)
+
+    def _initialize(self) -> None:
+        self.refresh()
+
+    def refresh(self) -> None:
+        """Rescan the cache directory for scenes, blocking."""
+        self.index.refresh()
+
+    def _scenes_between(self, start: date, end: date) -> List[Scene]:
+        return [s for s in self.index.get() if start <= s.acquired < end]
+
+    def _scene_means(
+        self, scene: Scene, regions: Sequence[Region]
+    ) -> List[Optional[float]]:
+        """Mean clear-sky EBI of each region on one scene, None where more
+        than CLOUD_THRESHOLD percent of the region is masked."""
+        geometries = [_region_geometry(r, scene.crs) for r in regions]
+        region_bounds = [_geometry_bounds(g) for g in geometries]
+        means: List[Optional[float]] = [None] * len(regions)
+        for group in _window_groups(region_bounds):
+            group_means = self._window_means(
+                scene,
+                [geometries[i] for i in group],
+                [region_bounds[i] for i in group],
+            )
+            for i, mean in zip(group, group_means):
+                means[i] = mean
+        return means
+
+    def _window_means(
+        self,
+        scene: Scene,
+        geometries: Sequence[Dict],
+        region_bounds: Sequence[Tuple[float, float, float, float]],
+    ) -> List[Optional[float]]:
+        """_scene_means of regions that share one window read per band."""
+        bounds = (
+            min(b[0] for b in region_bounds),
+            min(b[1] for b in region_bounds),
+            max(b[2] for b in region_bounds),
+            max(b[3] for b in region_bounds),
+        )
+
+        with rasterio.open(scene.paths["B04"]) as src:
+            try:
+                window = (
+                    from_bounds(*bounds, transform=src.transform)
+                    .round_offsets()
+                    .round_lengths()
+                    .intersection(Window(0, 0, src.width, src.height))
+                )
+            except WindowError:
+                # inside the scene's bounding box but off its raster
+                return [None] * len(geometries)
+            window_transform = src.window_transform(window)
+            shape = (int(window.height), int(window.width))
+            red = src.read(1, window=window).astype("float32")
+        window_bounds = rasterio.transform.array_bounds(
+            shape[0], shape[1], window_transform
+        )
+
+        def read_band(band: str) -> np.ndarray:
+            # SCL is 20 m, resample every band onto the 10 m red grid
+            with rasterio.open(scene.paths[band]) as src:
+                band_window = from_bounds(*window_bounds, transform=src.transform)
+                return src.read(
+                    1,
+                    window=band_window,
+                    out_shape=shape,
+                    boundless=True,
+                    fill_value=0,
+                )
+
+        green = read_band("B03").astype("float32")
+        blue = read_band("B02").astype("float32")
+        clear = ~np.isin(read_band("SCL"), MASKED_SCL_CLASSES)
+        ebi = calculate_ebi(red, green, blue, self.boa_offset)
+        valid = clear & np.isfinite(ebi)
+
+        means: List[Optional[float]] = []
+        for geometry, (minx, miny, maxx, maxy) in zip(geometries, region_bounds):
+            # only rasterize the region's own slice of the window
+            try:
+                sub = (
+                    from_bounds(minx, miny, maxx, maxy, transform=window_transform)
+                    .round_offsets()
+                    .round_lengths()
+                    .intersection(Window(0, 0, shape[1], shape[0]))
+                )
+            except WindowError:
+                means.append(None)
+                continue
+            rows, cols = sub.toslices()
+            inside = geometry_mask(
+                [geometry],
+                out_shape=(int(sub.height), int(sub.width)),
+                transform=rasterio.windows.transform(sub, window_transform),
+                invert=True,
+                all_touched=False,
+            )
+            selected = inside & valid[rows, cols]
+            # as the stacks do, against the region's pixels on the raster
+            count = selected.sum()
+            if not count or 100 * (1 - count / inside.sum()) > CLOUD_THRESHOLD:
+                means.append(None)
+                continue
+            means.append(float(ebi[rows, cols][selected].mean()))
+        return means
+
+    def _synced_stack(self, region: Region) -> Optional[EbiStack]:
+        """The region's EBI stack with every newer cached scene appended,
+        None when no scene covers the region."""
+        key = region_key(region)
+        scenes = self.index.get()
+        bounds = _region_bounds_4326(region)
+        scenes = sorted(
+            (s for s in scenes if _intersects(bounds, s.bounds)),
+            key=lambda s: s.acquired,
+        )
+        stack = self.stacks.open(key)
+        if stack is None:
+            if not scenes:
+                return None
+            stack = self.stacks.create(key, _stack_grid(region, scenes[0].crs))
+        # one process computes the new dates, the others wait and reuse them
+        with stack.locked():
+            last = stack.last_date
+            by_day: Dict[date, List[Scene]] = {}
+            for scene in scenes:
+                if last is None or scene.acquired > last:
+                    by_day.setdefault(scene.acquired, []).append(scene)
+            for day, day_scenes in by_day.items():
+                stack.append(day, self._stack_plane(stack.grid, day_scenes))
+        return stack
+
+    def _stack_plane(self, grid: StackGrid, scenes: Sequence[Scene]) -> np.ndarray:
+        """EBI of one day's scenes on the stack grid, NaN where masked or off
+        every scene. Overlapping tiles are merged, the first clear one wins."""
+        plane = np.full((grid.height, grid.width), np.nan, dtype="float32")
+        for scene in scenes:
+            red, green, blue = (
+                _warp_band(scene.paths[band], grid).astype("float32")
+                for band in ("B04", "B03", "B02")
+            )
+            ebi = calculate_ebi(red, green, blue, self.boa_offset)
+            scl = _warp_band(scene.paths["SCL"], grid)
+            ebi[np.isin(scl, MASKED_SCL_CLASSES) | ~np.isfinite(ebi)] = np.nan
+            plane = np.where(np.isnan(plane), ebi, plane)
+        return plane
+
+    def _stacked_time_series(
+        self, region: Region, seasons: Sequence[int]
+    ) -> Optional[Tuple[int, EbiSeries]]:
+        try:
+            stack = self._synced_stack(region)
+        except Exception as e:
+            logger.warning(f"Syncing the EBI stack of {region_key(region)} failed: {e}")
+            return None
+        if stack is None:
+            return None
+        geometry = _region_geometry(region, stack.grid.crs)
+        for season in seasons:
+            series = stack.region_series(
+                geometry, *bloom_season(season), max_masked_percent=CLOUD_THRESHOLD
+            )
+            if series:
+                return season, series
+        return None
+
+    def _ebi_time_series_many(
+        self, regions: Sequence[Region], seasons: Sequence[int]
+    ) -> List[Optional[Tuple[int, EbiSeries]]]:
+        if self.stacks is not None:
+            return [self._stacked_time_series(r, seasons) for r in regions]
+        results: List[Optional[Tuple[int, EbiSeries]]] = [None] * len(regions)
+        pending = list(range(len(regions)))
+        region_bounds = [_region_bounds_4326(r) for r in regions]
+        for season in seasons:
+            if not pending:
+                break
+            series: Dict[int, EbiSeries] = {}
+            for scene in self._scenes_between(*bloom_season(season)):
+                on_scene = [
+                    i for i in pending if _intersects(region_bounds[i], scene.bounds)
+                ]
+                if not on_scene:
+                    continue
+                try:
+                    means = self._scene_means(scene, [regions[i] for i in on_scene])
+                except Exception as e:
+                    logger.warning(
+                        f"Reading scene {scene.tile} {scene.acquired} failed: {e}"
+                    )
+                    continue
+                for i, mean in zip(on_scene, means):
+                    if mean is not None:
+                        series.setdefault(i, []).append((scene.acquired, mean))
+            for i, points in series.items():
+                results[i] = (season, sorted(points))
+            pending = [i for i in pending if i not in series]
+        return results
+
+    def _ebi_time_series(
+        self, latitude: float, longitude: float, seasons: Sequence[int]
+    ) -> Tuple[int, EbiSeries]:
+        result = self._ebi_time_series_many([Region(latitude, longitude)], seasons)[0]
+        if result is None:
+            raise Exception("No cached Sentinel-2 data available for the location")
+        return result
+
+    def _ebi_image_url(
+        self, latitude: float, longitude: float, peak_date: date
+    ) -> Optional[str]:
+        # scenes are local files, there is no URL to hand out
+        return None
+
+
+def _exterior_rings(geometry) -> List:
+    if geometry["type"] == "Polygon":
+        return [geometry["coordinates"][0]]
+    return [polygon[0] for polygon in geometry["coordinates"]]
+
+
+def _geometry_bounds(geometry) -> Tuple[float, float, float, float]:
+    coords = np.array([v for ring in _exterior_rings(geometry) for v in ring])
+    return (
+        coords[:, 0].min(),
+        coords[:, 1].min(),
+        coords[:, 0].max(),
+        coords[:, 1].max(),
+    )
+
+
+def _window_groups(
+    region_bounds: Sequence[Tuple[float, float, float, float]],
+) -> List[List[int]]:
+    """Indices of regions grouped so that each group's bounding box spans at
+    most MAX_WINDOW_PIXELS 10 m pixels, a region larger than that alone.
+    Regions are taken west to east, so nearby ones tend to share a group."""
+    groups: List[List[int]] = []
+    box = None
+    for i in sorted(range(len(region_bounds)), key=lambda i: region_bounds[i][0]):
+        b = region_bounds[i]
+        if box is not None:
+            grown = (
+                min(box[0], b[0]),
+                min(box[1], b[1]),
+                max(box[2], b[2]),
+                max(box[3], b[3]),
+            )
+            pixels = (grown[2] - grown[0]) * (grown[3] - grown[1]) / PIXEL_SIZE_M**2
+            if pixels <= MAX_WINDOW_PIXELS:
+                groups[-1].append(i)
+                box = grown
+                continue
+        groups.append([i])
+        box = b
+    return groups
+
+
+def _intersects(a, b) -> bool:
+    return a[0] <= b[2] and b[0] <= a[2] and a[1] <= b[3] and b[1] <= a[3]
+
+
+def _stack_grid(region: Region, crs: str) -> StackGrid:
+    """Grid of the region's bounds in `crs`, snapped outward to the 10 m
+    Sentinel-2 pixel grid so nearest neighbour warping keeps pixels intact."""
+    minx, miny, maxx, maxy = _geometry_bounds(_region_geometry(region, crs))
+    d = PIXEL_SIZE_M
+    minx, miny = math.floor(minx / d) * d, math.floor(miny / d) * d
+    maxx, maxy = math.ceil(maxx / d) * d, math.ceil(maxy / d) * d
+    return StackGrid(
+        crs=crs,
+        transform=Affine(d, 0, minx, 0, -d, maxy),
+        width=max(int(round((maxx - minx) / d)), 1),
+        height=max(int(round((maxy - miny) / d)), 1),
+    )
+
+
+def _warp_band(path: str, grid: StackGrid) -> np.ndarray:
+    """Band resampled onto `grid`, 0 (no data for SCL) off the scene."""
+    with rasterio.open(path) as src:
+        with WarpedVRT(
+            src,
+            crs=grid.crs,
+            transform=grid.transform,
+            width=grid.width,
+            height=grid.height,
+            resampling=Resampling.nearest,
+            nodata=0,
+        ) as vrt:
+            return vrt.read(1)
+
+
+class LocalSentinel2ChipSource(ChipSource):
+    """Pest detection chips from Sentinel-2 scenes cached under `root`,
+    laid out as for LocalSentinel2Backend.
+
+    Chips come from the most recent scene over the region. When its window
+    has no clear chip, up to `max_scenes_back` older scenes are tried, so a
+    cloudy acquisition does not leave the field without an answer.
+    """
+
+    name = "local"
+
+    def __init__(
+        self,
+        root: Optional[str],
+        boa_offset: float = 0.0,
+        max_scenes_back: int = 6,
+        rescan_seconds: float = 300.0,
+    ):
+        self.root = root
+        self.boa_offset = boa_offset
+        self.max_scenes_back = max_scenes_back
+        self.index = SceneIndex(root, rescan_seconds) if root else None
+
+    def start(self) -> None:
+        if self.index is None:
+            logger.warning("MUNDI_S2_CACHE_DIR is not set, no imagery for pests")
+            return
+        self.index.refresh()
+
+    def _candidates(self, region: Region) -> List[Scene]:
+        """Scenes covering the region, newest first."""
+        if self.index is None:
+            return []
+        bounds = _region_bounds_4326(region)
+        today = date.today()
+        candidates = [
+            s
+            for s in self.index.get()
+            if s.acquired <= today and _contains(s.bounds, bounds)
+        ]
+        return sorted(candidates, key=lambda s: s.acquired, reverse=True)
+
+    def scene_id(self, region: Region) -> Optional[str]:
+        candidates = self._candidates(region)
+        if not candidates:
+            return None
+        return f"{candidates[0].tile}/{candidates[0].acquired.isoformat()}"
+
+    def read_chips(self, region: Region, scene_id: str) -> np.ndarray:
+        chips = np.zeros((0, 3, CHIP_SIZE, CHIP_SIZE), dtype="float32")
+        for scene in self._candidates(region)[: self.max_scenes_back]:
+            chips = tile_chips(self._read_image(scene, region))
+            if len(chips):
+                break
+        return chips
+
+    def _read_image(self, scene: Scene, region: Region) -> np.ndarray:
+        """(3, h, w) red, green, blue reflectance over the region, NaN where
+        masked or outside it."""
+        geometry = _region_geometry(region, scene.crs)
+        with rasterio.open(scene.paths["B04"]) as src:
+            window = (
+                from_bounds(*_geometry_bounds(geometry), transform=src.transform)
+                .round_offsets()
+                .round_lengths()
+                .intersection(Window(0, 0, src.width, src.height))
+            )
+            window_transform = src.window_transform(window)
+            shape = (int(window.height), int(window.width))
+            red = src.read(1, window=window)
+        window_bounds = rasterio.transform.array_bounds(
+            shape[0], shape[1], window_transform
+        )
+
+        def read_band(band: str) -> np.ndarray:
+            with rasterio.open(scene.paths[band]) as src:
+                band_window = from_bounds(*window_bounds, transform=src.transform)
+                return src.read(
+                    1,
+                    window=band_window,
+                    out_shape=shape,
+                    boundless=True,
+                    fill_value=0,
+                )
+
+        image = (
+            np.stack([red, read_band("B03"), read_band("B02")]).astype("float32")
+            + self.boa_offset
+        ) * 1e-4
+        clear = ~np.isin(read_band("SCL"), MASKED_SCL_CLASSES)
+        clear &= geometry_mask(
+            [geometry], out_shape=shape, transform=window_transform, invert=True
+        )
+        image[:, ~clear] = np.nan
+        return image
+
+
+def _region_geometry(region: Region, crs: str):
+    """Region in the scene's projected CRS, points become the square of
+    ROI_BUFFER_M around them."""
+    if region.geometry is not None:
+        return transform_geom("EPSG:4326", crs, region.geometry)
+    xs, ys = transform("EPSG:4326", crs, [region.longitude], [region.latitude])
+    x, y, d = xs[0], ys[0], ROI_BUFFER_M
+    return {
+        "type": "Polygon",
+        "coordinates": [
+            [
+                (x - d, y - d),
+                (x + d, y - d),
+                (x + d, y + d),
+                (x - d, y + d),
+                (x - d, y - d),
+            ]
+        ],
+    }
+
+
+def _region_bounds_4326(region: Region) -> Tuple[float, float, float, float]:
+    if region.geometry is not None:
+        return _geometry_bounds(region.geometry)
+    # generous, the exact square is cut in the scene CRS
+    d = ROI_BUFFER_M / 100000
+    return (
+        region.longitude - 2 * d,
+        region.latitude - d,
+        region.longitude + 2 * d,
+        region.latitude + d,
+    )
+
+
+def _contains(outer, inner) -> bool:
+    """Whether the (west, south, east, north) box `outer` covers the center
+    of `inner`."""
+    x = (inner[0] + inner[2]) / 2
+    y = (inner[1] + inner[3]) / 2
+    return outer[0] <= x <= outer[2] and outer[1] <= y <= outer[3]
@@ -0,0 +1,189 @@
+from dataclasses import dataclass
+from datetime import date
+from typing import Optional
+
+import numpy as np
+
+MODEL_VERSION = "gdd-v1"
+
+# almond chill is satisfied by January, heat accumulates from Jan 1, and
+# from Jul 1 in the southern hemisphere where the seasons are six months out
+BASE_TEMPERATURE_C = 4.5
+SOUTHERN_SEASON_START = (7, 1)
+# closer to the equator there is no winter chill to break dormancy
+MIN_ABS_LATITUDE = 20.0
+# accumulated growing degree days at peak bloom before any history is fitted
+DEFAULT_GDD_THRESHOLD = 230.0
+# bloom starts once this share of the peak requirement has accumulated
+START_FRACTION = 0.8
+DEFAULT_CONFIDENCE = 0.3
+DAYS = np.arange(1, 366)
+# what callers should know about where the dates come from
+PREDICTION_BASIS = (
+    "Climatological estimate from latitude alone: longitude, elevation and "
+    "this season's observed temperatures are not taken into account."
+)
+
+
+def climatology_daily_mean(latitudes: np.ndarray) -> np.ndarray:
+    """Daily mean air temperature in °C, shape (len(latitudes), 365).
+
+    A sinusoidal annual cycle whose mean falls and amplitude grows with
+    latitude, coldest in mid January north of the equator and mid July south
+    of it. Crude, but the GDD threshold is fitted against the same
+    climatology, which absorbs much of its regional bias.
+    """
+    latitudes = np.asarray(latitudes, dtype="float64")[:, None]
+    abs_lat = np.abs(latitudes)
+    mean = 27.0 - 0.27 * abs_lat
+    amplitude = 0.25 * abs_lat
+    coldest_day = np.where(latitudes >= 0, 15, 197)
+    return mean - amplitude * np.cos(2 * np.pi * (DAYS - coldest_day) / 365)
+
+
+def season_start_day(latitudes: np.ndarray) -> np.ndarray:
+    """Day of year heat starts accumulating, per location."""
+    month, day = SOUTHERN_SEASON_START
+    southern = date(2025, month, day).timetuple().tm_yday
+    return np.where(np.asarray(latitudes) >= 0, 1, southern)
+
+
+def supported(latitudes: np.ndarray) -> np.ndarray:
+    """Whether the model applies at each latitude."""
+    return np.abs(np.asarray(latitudes, dtype="float64")) >= MIN_ABS_LATITUDE
+
+
+def accumulated_gdd(latitudes: np.ndarray) -> np.ndarray:
+    """Growing degree days accumulated since the start of each location's
+    season, per location and day of the season."""
+    daily = np.clip(climatology_daily_mean(latitudes) - BASE_TEMPERATURE_C, 0, None)
+    # rotate each row so that column 0 is its season's first day
+    days = (season_start_day(latitudes)[:, None] - 1 + np.arange(365)) % 365
+    return np.cumsum(np.take_along_axis(daily, days, axis=1), axis=1)
+
+
+def first_day_reaching(gdd: np.ndarray, thresholds: np.ndarray) -> np.ndarray:
+    """Day of the season each row first reaches its threshold, NaN if it
+    never does."""
+    reached = gdd >= np.asarray(thresholds, dtype="float64").reshape(-1, 1)
+    day = reached.argmax(axis=1).astype("float64") + 1
+    day[~reached.any(axis=1)] = np.nan
+    return day
+
+
+@dataclass(frozen=True)
+class PhenologyModel:
+    """Peak bloom when accumulated GDD reaches `gdd_threshold`.
+
+    `sigma_days` is the spread of the fitted model's errors on the
+    observations it was fitted on.
+    """
+
+    gdd_threshold: float = DEFAULT_GDD_THRESHOLD
+    sigma_days: Optional[float] = None
+    n_observations: int = 0
+
+    @property
+    def version(self) -> str:
+        return f"{MODEL_VERSION}-{self.gdd_threshold:.0f}"
+
+    @property
+    def confidence(self) -> float:
+        if not self.n_observations or self.sigma_days is None:
+            return DEFAULT_CONFIDENCE
+        # few observations or a wide error spread both lower confidence
+        support = self.n_observations / (self.n_observations + 5)
+        return float(np.clip(np.exp(-self.sigma_days / 14) * support, 0.05, 0.95))
+
+    @classmethod
+    def fit(cls, latitudes: np.ndarray, peak_days: np.ndarray) -> "PhenologyModel":
+        """Fit the threshold to observed peak bloom days of year. Both
+        hemispheres share it, each counted from its own season start."""
+        latitudes = np.asarray(latitudes, dtype="float64")
+        peak_days = np.asarray(peak_days, dtype="int64")
+        keep = supported(latitudes)
+        latitudes, peak_days = latitudes[keep], peak_days[keep]
+        if latitudes.size == 0:
+            return cls()
+        peak_days = (np.clip(peak_days, 1, 365) - season_start_day(latitudes)) % 365 + 1
+        gdd = accumulated_gdd(latitudes)
+        at_peak = gdd[np.arange(latitudes.size), peak_days - 1]
+        threshold = float(np.median(at_peak))
+        if not threshold > 0:
+            return cls()
+
+        predicted = first_day_reaching(gdd, np.full(latitudes.size, threshold))
+        errors = predicted - peak_days
+        errors = errors[np.isfinite(errors)]
+        sigma = float(np.std(errors, ddof=1)) if errors.size > 1 else None
+        return cls(
+            gdd_threshold=threshold,
+            sigma_days=sigma,
+            n_observations=int(latitudes.size),
+        )
+
+    def _season_days(self, latitudes: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """Day of the season bloom starts and peaks, NaN where it never does
+        or the latitude is outside the band the model covers."""
+        gdd = accumulated_gdd(latitudes)
+        n = gdd.shape[0]
+        starts = first_day_reaching(
+            gdd, np.full(n, START_FRACTION * self.gdd_threshold)
+        )
+        peaks = first_day_reaching(gdd, np.full(n, self.gdd_threshold))
+        in_band = supported(latitudes)
+        starts[~in_band] = np.nan
+        peaks[~in_band] = np.nan
+        return starts, peaks
+
+    @staticmethod
+    def _to_dates(latitudes: np.ndarray, days: np.ndarray, year: int) -> np.ndarray:
+        season_start = np.where(
+            latitudes >= 0,
+            np.datetime64(date(year, 1, 1), "D"),
+            np.datetime64(date(year, *SOUTHERN_SEASON_START), "D"),
+        )
+        dates = np.full(days.shape, np.datetime64("NaT"), dtype="datetime64[D]")
+        reached = np.isfinite(days)
+        dates[reached] = season_start[reached] + (days[reached].astype("int64") - 1)
+        return dates
+
+    def predict(
+        self, latitudes: np.ndarray, year: int
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """Predicted bloom start and peak as datetime64[D] arrays, NaT where
+        the location never accumulates enough heat or is outside the
+        latitudes the model covers. Southern locations bloom in the season
+        starting in the second half of `year`."""
+        latitudes = np.asarray(latitudes, dtype="float64")
+        starts, peaks = self._season_days(latitudes)
+        return (
+            self._to_dates(latitudes, starts, year),
+            self._to_dates(latitudes, peaks, year),
+        )
+
+    def predict_upcoming(
+        self, latitudes: np.ndarray, today: date
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """Like predict, but for each location's next season whose peak is on
+        or after `today`, so a bloom that has already passed this year rolls
+        over to next year's."""
+        latitudes = np.asarray(latitudes, dtype="float64")
+        starts, peaks = self._season_days(latitudes)
+        # a long southern season can peak in the calendar year after it starts
+        years = (today.year - 1, today.year, today.year + 1)
+        start_dates = np.stack([self._to_dates(latitudes, starts, y) for y in years])
+        peak_dates = np.stack([self._to_dates(latitudes, peaks, y) for y in years])
+        # NaT compares false, those locations have no upcoming season
+        upcoming = peak_dates >= np.datetime64(today, "D")
+        season = upcoming.argmax(axis=0)
+        columns = np.arange(latitudes.size)
+        none = ~upcoming.any(axis=0)
+        start, peak = start_dates[season, columns], peak_dates[season, columns]
+        start[none] = np.datetime64("NaT")
+        peak[none] = np.datetime64("NaT")
+        return start, peak
+
+
+def to_date(value: np.datetime64) -> Optional[date]:
+    return None if np.isnat(value) else value.item()
@@ -24,7 +24,7 @@ from opentelemetry import trace
 import asyncio
 from pydantic import BaseModel
 from src.database.models import MundiChatCompletionMessage
-from src.geoprocessing.dispatch import get_tools
+from src.geoprocessing.dispatch import geoprocessing_tool_names
 from openai.types.chat import ChatCompletionMessageToolCallParam
 
 IS_RUNNING_PYTEST = "pytest" in sys.modules or "PYTEST_CURRENT_TEST" in os.environ
@@ -51,7 +51,7 @@ async def _get_async_connection_pool():
                 _async_connection_pool = await asyncpg.create_pool(
                     dsn=postgres_url,
                     min_size=1,
-                    max_size=10,
+                    max_size=int(os.environ.get("MUNDI_PG_POOL_MAX_SIZE", "10")),
                 )
     return _async_connection_pool
 
@@ -219,11 +219,7 @@ def convert_openai_tool_call_to_sanitized_tool_call(
     args = json.loads(tool_call["function"]["arguments"])
     function_name = tool_call["function"]["name"]
 
-    # Check if this is a geoprocessing tool
-    all_tools = get_tools()
-    geoprocessing_function_names = [tool["function"]["name"] for tool in all_tools]
-
-    is_geoprocessing_tool = function_name in geoprocessing_function_names
+    is_geoprocessing_tool = function_name in geoprocessing_tool_names()
 
     code_block: CodeBlock | None = None
     if tool_call["function"]["name"] == "query_duckdb_sql":
@@ -242,3 +242,27 @@ async def test_render_basemap_invalid_basemap_name(auth_client):
     error_data = response.json()
     assert "Invalid basemap" in error_data["detail"]
     assert "Available options:" in error_data["detail"]
+
+
+@pytest.mark.anyio
+async def test_local_basemap_style_skips_network(tmp_path, monkeypatch):
+    """Styles in MUNDI_BASEMAP_STYLES_DIR are served without fetching upstream."""
+    import json
+    from src.dependencies.base_map import OpenStreetMapProvider, remote_style_cache
+
+    local_style = {"version": 8, "name": "Local Liberty", "sources": {}, "layers": []}
+    (tmp_path / "openfreemap.json").write_text(json.dumps(local_style))
+    monkeypatch.setenv("MUNDI_BASEMAP_STYLES_DIR", str(tmp_path))
+
+    async def fail_fetch(url):
+        raise AssertionError(f"unexpected network fetch of {url}")
+
+    monkeypatch.setattr(remote_style_cache, "get_style", fail_fetch)
+
+    style = await OpenStreetMapProvider().get_base_style("openfreemap")
+    assert style == local_style
+
+    # callers mutate the style they get back, that must not leak into the cache
+    style["layers"].append({"id": "mutated"})
+    again = await OpenStreetMapProvider().get_base_style("openfreemap")
+    assert again["layers"] == []
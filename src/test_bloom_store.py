@@ -0,0 +1,166 @@
+# Copyright (C) 2025 Bunting Labs, Inc.
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import math
+import random
+from datetime import date, datetime, timedelta, timezone
+
+import pytest
+
+from src.services import bloom
+from src.services.bloom import bloom_study, detect_bloom
+from src.services.bloom_store import (
+    METERS_PER_DEGREE_LAT,
+    detection_valid_until,
+    find_nearest_observation,
+    find_nearest_prediction,
+    store_detections,
+    store_predictions,
+)
+from src.services.earth_engine import FakeEarthEngineBackend, get_earth_engine
+from src.structures import async_conn
+
+
+def test_detection_valid_until_follows_the_season():
+    utc = timezone.utc
+    # before the window opens, last season's result stands until it does
+    assert detection_valid_until(
+        date(2025, 3, 30), datetime(2026, 1, 2, tzinfo=utc)
+    ) == datetime(2026, 1, 15, tzinfo=utc)
+    # during the season, until the next revisit is due
+    assert detection_valid_until(
+        date(2026, 3, 10), datetime(2026, 3, 11, 8, tzinfo=utc)
+    ) == datetime(2026, 3, 15, tzinfo=utc)
+    # an old acquisition still gets the minimum lifetime
+    now = datetime(2026, 3, 20, 8, tzinfo=utc)
+    assert detection_valid_until(date(2026, 3, 1), now) == now + timedelta(hours=12)
+    # after the season the result is final until next year's window
+    assert detection_valid_until(
+        date(2026, 4, 14), datetime(2026, 6, 1, tzinfo=utc)
+    ) == datetime(2027, 1, 15, tzinfo=utc)
+
+
+@pytest.mark.anyio
+async def test_detect_bloom_writes_through():
+    class CountingBackend(FakeEarthEngineBackend):
+        calls = 0
+
+        def _ebi_time_series(self, latitude, longitude, seasons):
+            CountingBackend.calls += 1
+            return super()._ebi_time_series(latitude, longitude, seasons)
+
+    earth_engine = CountingBackend()
+    # somewhere in the ocean no other test stores detections for
+    latitude = random.uniform(-40.0, -30.0)
+    longitude = random.uniform(-120.0, -110.0)
+
+    first = await detect_bloom(latitude, longitude, earth_engine=earth_engine)
+    assert CountingBackend.calls == 1
+
+    # a point 50 m away reuses the stored detection
+    nearby = await detect_bloom(
+        latitude + 0.00045, longitude, earth_engine=earth_engine
+    )
+    assert CountingBackend.calls == 1
+    assert nearby["date_of_max_ebi"] == first["date_of_max_ebi"]
+    assert nearby["ebi_value"] == first["ebi_value"]
+    earth_engine.close()
+
+
+@pytest.mark.anyio
+async def test_bloom_study_reuses_stored_results(monkeypatch):
+    monkeypatch.setenv("MUNDI_EARTH_ENGINE", "fake")
+    get_earth_engine.cache_clear()
+    latitude = random.uniform(-40.0, -30.0)
+    longitude = random.uniform(-120.0, -110.0)
+    try:
+        first = await bloom_study(latitude, longitude)
+        assert first["observation"]["ebi_value"] > 0
+        assert first["prediction"]["predicted_bloom_peak"] is not None
+
+        async def not_recomputed(latitude, longitude):
+            raise AssertionError("stored result was not reused")
+
+        monkeypatch.setattr(bloom, "detect_bloom", not_recomputed)
+        monkeypatch.setattr(bloom, "predict_bloom", not_recomputed)
+        again = await bloom_study(latitude + 0.00045, longitude)
+        assert (
+            again["observation"]["date_of_max_ebi"]
+            == (first["observation"]["date_of_max_ebi"])
+        )
+        assert (
+            again["prediction"]["predicted_bloom_peak"]
+            == (first["prediction"]["predicted_bloom_peak"])
+        )
+    finally:
+        get_earth_engine().close()
+        get_earth_engine.cache_clear()
+
+
+@pytest.mark.anyio
+async def test_nearest_lookup_picks_the_closest_row():
+    latitude = random.uniform(-40.0, -30.0)
+    longitude = random.uniform(-120.0, -110.0)
+    # metres east of the point, in degrees of longitude at its latitude
+    east = 1 / (METERS_PER_DEGREE_LAT * math.cos(math.radians(latitude)))
+    # 120 m east is nearer than 140 m north, though more degrees away
+    points = [
+        (latitude, longitude + 120 * east),
+        (latitude + 140 / METERS_PER_DEGREE_LAT, longitude),
+        (latitude, longitude + 600 * east),
+    ]
+    async with async_conn("test") as conn:
+        await store_detections(
+            conn,
+            [
+                {
+                    "latitude": lat,
+                    "longitude": lon,
+                    "date_of_max_ebi": date(2026, 3, day),
+                    "ebi_value": 0.5,
+                    "season": 2026,
+                    "imagery_date": date(2026, 3, day),
+                }
+                for day, (lat, lon) in enumerate(points, start=1)
+            ],
+            {"backend": "test"},
+        )
+        await store_predictions(
+            conn,
+            [lat for lat, _ in points],
+            [lon for _, lon in points],
+            [date(2026, 2, day) for day in (1, 2, 3)],
+            [date(2026, 3, day) for day in (1, 2, 3)],
+            0.5,
+            "test",
+        )
+
+        observation = await find_nearest_observation(conn, latitude, longitude, 2026)
+        assert observation["date_of_max_ebi"] == date(2026, 3, 1)
+        assert observation["distance_m"] == pytest.approx(120, abs=1)
+        prediction = await find_nearest_prediction(conn, latitude, longitude, 2026)
+        assert prediction["predicted_bloom_peak"] == date(2026, 3, 1)
+
+        # nothing within 100 m, and only the same season counts
+        assert (
+            await find_nearest_observation(
+                conn, latitude, longitude, 2026, tolerance_m=100
+            )
+            is None
+        )
+        assert await find_nearest_observation(conn, latitude, longitude, 2025) is None
+        # from the far point, its own row wins
+        far = await find_nearest_prediction(conn, *points[2], 2026)
+        assert far["predicted_bloom_peak"] == date(2026, 3, 3)
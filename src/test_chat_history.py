@@ -0,0 +1,107 @@
+# Copyright (C) 2025 Bunting Labs, Inc.
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import json
+
+from src.dependencies.chat_history import DefaultChatHistoryCompactor
+
+
+def _turn(n: int, rows: int) -> list[dict]:
+    dump = "\n".join(f"{i}\tparcel {i}\t{i * 1.5}" for i in range(rows))
+    return [
+        {"role": "system", "content": f"<MapState>turn {n}</MapState>"},
+        {"role": "user", "content": f"question {n}"},
+        {
+            "role": "assistant",
+            "content": None,
+            "tool_calls": [
+                {
+                    "id": f"call_{n}",
+                    "type": "function",
+                    "function": {"name": "query_duckdb_sql", "arguments": "{}"},
+                }
+            ],
+        },
+        {
+            "role": "tool",
+            "tool_call_id": f"call_{n}",
+            "content": json.dumps({"status": "success", "result": dump}),
+        },
+        {"role": "assistant", "content": f"answer {n}"},
+    ]
+
+
+def test_history_under_budget_is_untouched():
+    messages = _turn(1, 5) + _turn(2, 5)
+    compactor = DefaultChatHistoryCompactor(token_budget=100_000)
+    assert compactor.compact(messages) is messages
+
+
+def test_old_tool_results_are_summarized_first():
+    messages = _turn(1, 2000) + _turn(2, 2000)
+    compactor = DefaultChatHistoryCompactor(token_budget=15_000)
+    compacted = compactor.compact(messages)
+
+    # same shape, only the first turn's tool result was shortened
+    assert len(compacted) == len(messages)
+    old_result = json.loads(compacted[3]["content"])
+    assert old_result["status"] == "success"
+    assert "truncated" in old_result["result"]
+    assert compacted[8] == messages[8]
+    # input history is not mutated
+    assert "truncated" not in json.loads(messages[3]["content"])["result"]
+
+
+def test_oldest_turns_dropped_when_summaries_are_not_enough():
+    messages = []
+    for n in range(50):
+        messages += _turn(n, 5)
+    compactor = DefaultChatHistoryCompactor(token_budget=1_000)
+    compacted = compactor.compact(messages)
+
+    assert sum(compactor.count_tokens(m) for m in compacted) <= 1_000
+    # the current turn survives intact and every tool result keeps its call
+    assert compacted[-4:] == messages[-4:]
+    called = {
+        tc["id"]
+        for m in compacted
+        if m["role"] == "assistant"
+        for tc in m.get("tool_calls") or []
+    }
+    assert all(m["tool_call_id"] in called for m in compacted if m["role"] == "tool")
+
+
+def test_current_turn_keeps_only_the_latest_tool_results_intact():
+    # one turn calling tools over and over, nothing earlier to drop
+    messages = _turn(1, 2000)[1:-1]
+    for n in range(2, 6):
+        messages += _turn(n, 2000)[2:4]
+    compactor = DefaultChatHistoryCompactor(token_budget=20_000)
+    compacted = compactor.compact(messages)
+
+    assert len(compacted) == len(messages)
+    assert "truncated" in json.loads(compacted[2]["content"])["result"]
+    assert compacted[-1] == messages[-1]
+    assert sum(compactor.count_tokens(m) for m in compacted) <= 20_000
+
+
+def test_reserved_tokens_count_against_the_budget():
+    messages = _turn(1, 2000) + _turn(2, 5)
+    compactor = DefaultChatHistoryCompactor(token_budget=20_000)
+    assert compactor.compact(messages) is messages
+
+    compacted = compactor.compact(messages, reserved_tokens=15_000)
+    assert "truncated" in json.loads(compacted[3]["content"])["result"]
+    assert sum(compactor.count_tokens(m) for m in compacted) <= 5_000
@@ -0,0 +1,58 @@
+# Copyright (C) 2025 Bunting Labs, Inc.
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import random
+import uuid
+
+import pytest
+from fastapi import HTTPException
+
+from src.chat_queue import ChatRun, ChatRunQueue
+
+
+@pytest.mark.anyio
+async def test_admission_limits_conversations_and_users():
+    queue = ChatRunQueue(
+        max_runs_per_user=2,
+        max_queue_depth=100,
+        slow_provider_seconds=20,
+        queue_wait_seconds=60,
+    )
+    user_id = str(uuid.uuid4())
+    base = random.randint(10_000_000, 20_000_000)
+    first = ChatRun.new("MTESTMAP0001", base, user_id)
+    await queue.admit(first, queued=False)
+
+    # at most one run per conversation
+    with pytest.raises(HTTPException) as exc_info:
+        await queue.admit(ChatRun.new("MTESTMAP0001", base, user_id), queued=False)
+    assert exc_info.value.status_code == 409
+
+    second = ChatRun.new("MTESTMAP0001", base + 1, user_id)
+    await queue.admit(second, queued=False)
+
+    # per-user cap, and the rejected run does not keep its conversation locked
+    third = ChatRun.new("MTESTMAP0001", base + 2, user_id)
+    with pytest.raises(HTTPException) as exc_info:
+        await queue.admit(third, queued=False)
+    assert exc_info.value.status_code == 429
+
+    await queue.release(first)
+    await queue.admit(third, queued=False)
+
+    # finishing a run frees its conversation
+    async with queue.lease(second):
+        pass
+    await queue.admit(ChatRun.new("MTESTMAP0001", base + 1, user_id), queued=False)
@@ -0,0 +1,132 @@
+# Copyright (C) 2025 Bunting Labs, Inc.
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import asyncio
+import threading
+import time
+
+import pytest
+
+from src.services.bloom import detect_bloom, detect_bloom_many
+from src.services.earth_engine import (
+    EarthEngineTimeout,
+    FakeEarthEngineBackend,
+    Region,
+    bloom_season,
+    image_date_ranges,
+    region_from_geojson,
+)
+
+
+@pytest.mark.anyio
+async def test_detect_bloom_with_fake_backend_is_deterministic():
+    earth_engine = FakeEarthEngineBackend()
+    first = await detect_bloom(
+        36.7378, -119.7871, earth_engine=earth_engine, use_cache=False
+    )
+    second = await detect_bloom(
+        36.7378, -119.7871, earth_engine=earth_engine, use_cache=False
+    )
+    assert first == second
+    assert first["ebi_value"] > 0.4
+    assert first["image_url"] is None
+
+    start, end = bloom_season(first["date_of_max_ebi"].year)
+    assert start <= first["date_of_max_ebi"] < end
+    earth_engine.close()
+
+
+@pytest.mark.anyio
+async def test_calls_run_off_the_event_loop_with_timeouts():
+    earth_engine = FakeEarthEngineBackend(latency=0.2, max_workers=2, timeout=1.0)
+    loop_thread = threading.get_ident()
+    assert await earth_engine.run(threading.get_ident) != loop_thread
+
+    # the loop stays responsive while both pool threads are busy
+    started = time.monotonic()
+    calls = asyncio.gather(
+        earth_engine.ebi_time_series(36.7, -119.8, [2025]),
+        earth_engine.ebi_time_series(37.6, -121.0, [2025]),
+    )
+    await asyncio.sleep(0.01)
+    assert time.monotonic() - started < 0.1
+    await calls
+
+    with pytest.raises(EarthEngineTimeout):
+        await earth_engine.run(time.sleep, 0.5, timeout=0.05)
+    earth_engine.close()
+
+
+@pytest.mark.anyio
+async def test_detect_bloom_many_streams_every_region(monkeypatch):
+    monkeypatch.setenv("MUNDI_BLOOM_BATCH_CHUNK_SIZE", "2")
+    earth_engine = FakeEarthEngineBackend()
+    regions = [
+        Region(36.7378, -119.7871),
+        Region(37.6391, -120.9969),
+        region_from_geojson(
+            {
+                "type": "Polygon",
+                "coordinates": [
+                    [[-120.0, 36.0], [-119.9, 36.0], [-119.9, 36.1], [-120.0, 36.0]]
+                ],
+            }
+        ),
+    ]
+    results = [
+        r
+        async for r in detect_bloom_many(
+            regions, earth_engine=earth_engine, use_cache=False
+        )
+    ]
+    assert sorted(r["index"] for r in results) == [0, 1, 2]
+
+    single = await detect_bloom(
+        36.7378, -119.7871, earth_engine=earth_engine, use_cache=False
+    )
+    first = next(r for r in results if r["index"] == 0)
+    assert first["date_of_max_ebi"] == single["date_of_max_ebi"]
+    assert first["ebi_value"] == single["ebi_value"]
+    assert first["image_count"] > 0 and first["error"] is None
+    earth_engine.close()
+
+
+@pytest.mark.anyio
+async def test_detect_bloom_many_queues_chunks_beyond_the_pool(monkeypatch):
+    monkeypatch.setenv("MUNDI_BLOOM_BATCH_CHUNK_SIZE", "1")
+    # 10 chunks on 2 threads take 1.5 s, longer than any single call may
+    earth_engine = FakeEarthEngineBackend(latency=0.3, max_workers=2, timeout=1.0)
+    regions = [Region(36.7 + i / 100, -119.8) for i in range(10)]
+    results = [
+        r
+        async for r in detect_bloom_many(
+            regions, earth_engine=earth_engine, use_cache=False
+        )
+    ]
+    assert sorted(r["index"] for r in results) == list(range(10))
+    assert all(r["error"] is None for r in results)
+    earth_engine.close()
+
+
+def test_image_date_ranges_bound_each_reduction():
+    # two tiles of one datatake share each acquisition time
+    timestamps = [t for t in (500, 100, 300, 200, 400) for _ in range(2)]
+    assert image_date_ranges(timestamps, 10) == [(100, 501)]
+    assert image_date_ranges(timestamps, 5) == [(100, 201), (300, 401), (500, 501)]
+    # images of the same time are never split
+    assert image_date_ranges(timestamps, 1) == [
+        (t, t + 1) for t in (100, 200, 300, 400, 500)
+    ]
+    assert image_date_ranges([], 10) == []
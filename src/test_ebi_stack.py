@@ -0,0 +1,120 @@
+# Copyright (C) 2025 Bunting Labs, Inc.
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from datetime import date, timedelta
+
+import numpy as np
+import pytest
+from affine import Affine
+from rasterio.warp import transform
+
+from src.services.ebi_stack import TILE_SIZE, EbiStackStore, StackGrid
+
+CRS = "EPSG:32611"
+ORIGIN_X, ORIGIN_Y = 250000.0, 4072000.0
+# spans two tiles per axis, the second ones partly empty
+GRID = StackGrid(
+    crs=CRS,
+    transform=Affine(10, 0, ORIGIN_X, 0, -10, ORIGIN_Y),
+    width=TILE_SIZE + 36,
+    height=TILE_SIZE + 16,
+)
+START = date(2025, 2, 1)
+
+
+def plane(value: float) -> np.ndarray:
+    return np.full((GRID.height, GRID.width), value, dtype="float32")
+
+
+@pytest.fixture
+def stack(tmp_path):
+    stack = EbiStackStore(str(tmp_path)).create("block-7", GRID)
+    for i in range(10):
+        ebi = plane(0.1 * i)
+        # every third date is clouded over the western half
+        if i % 3 == 2:
+            ebi[:, : GRID.width // 2] = np.nan
+        stack.append(START + timedelta(days=5 * i), ebi)
+    return stack
+
+
+def test_stack_reads_windows_across_tiles(stack):
+    dates, values = stack.read(START, START + timedelta(days=50))
+    assert len(dates) == 10
+    assert values.shape == (10, GRID.height, GRID.width)
+
+    # the window straddles all four tiles
+    window = (TILE_SIZE - 2, TILE_SIZE + 2, TILE_SIZE - 3, TILE_SIZE + 3)
+    dates, values = stack.read(
+        START + timedelta(days=10), START + timedelta(days=25), window
+    )
+    assert dates == [START + timedelta(days=d) for d in (10, 15, 20)]
+    assert values.shape == (3, 4, 6)
+    assert np.allclose(values[:, 0, 0], [0.2, 0.3, 0.4])
+
+
+def test_stack_point_and_polygon_series(stack, tmp_path):
+    lons, lats = transform(CRS, "EPSG:4326", [ORIGIN_X + 105], [ORIGIN_Y - 105])
+    series = stack.point_series(lats[0], lons[0], START, START + timedelta(days=50))
+    # cloudy dates have no value on the western half
+    assert [day for day, _ in series] == [
+        START + timedelta(days=5 * i) for i in range(10) if i % 3 != 2
+    ]
+
+    x0, y0 = ORIGIN_X + 100, ORIGIN_Y - 100
+    polygon = {
+        "type": "Polygon",
+        "coordinates": [
+            [(x0, y0), (x0 + 600, y0), (x0 + 600, y0 - 500), (x0, y0 - 500), (x0, y0)]
+        ],
+    }
+    # the polygon is mostly inside the clouded half
+    series = stack.region_series(
+        polygon, START, START + timedelta(days=50), max_masked_percent=50
+    )
+    assert len(series) == 7
+    assert series[1][1] == pytest.approx(0.1)
+    series = stack.region_series(polygon, START, START + timedelta(days=50))
+    assert len(series) == 10
+
+    # reopened from disk, the series is unchanged
+    reopened = EbiStackStore(str(tmp_path)).open("block-7")
+    assert reopened.region_series(polygon, START, START + timedelta(days=50)) == series
+
+
+def test_stack_appends_in_date_order(stack):
+    with pytest.raises(ValueError):
+        stack.append(START, plane(1.0))
+    with pytest.raises(ValueError):
+        stack.append(date(2026, 1, 1), np.zeros((3, 3), dtype="float32"))
+
+    stack.append(date(2026, 1, 1), plane(1.0))
+    dates, values = stack.read(date(2026, 1, 1), date(2026, 1, 2))
+    assert dates == [date(2026, 1, 1)]
+    assert np.all(values == 1.0)
+
+
+def test_stack_appends_from_several_processes(stack, tmp_path):
+    # a second store stands in for another process with its own view
+    other = EbiStackStore(str(tmp_path)).open("block-7")
+    stack.append(date(2026, 1, 1), plane(1.0))
+    with pytest.raises(ValueError):
+        other.append(date(2026, 1, 1), plane(2.0))
+    other.append(date(2026, 1, 6), plane(2.0))
+
+    dates, values = stack.read(date(2026, 1, 1), date(2026, 2, 1))
+    assert dates == [date(2026, 1, 1), date(2026, 1, 6)]
+    assert np.all(values[0] == 1.0) and np.all(values[1] == 2.0)
+    assert stack.last_date == other.last_date == date(2026, 1, 6)
@@ -0,0 +1,79 @@
+# Copyright (C) 2025 Bunting Labs, Inc.
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from contextlib import asynccontextmanager
+from datetime import date, datetime, timezone
+
+import pytest
+
+from src import field_scheduler
+from src.field_scheduler import in_window, refresh_window, seconds_until_next_opening
+from src.services.bloom import BATCH_FAILED_ERROR
+
+
+def test_refresh_window(monkeypatch):
+    monkeypatch.setenv("MUNDI_FIELD_REFRESH_WINDOW", "22-4")
+    window = refresh_window()
+    assert window == (22, 4)
+    assert in_window(23, window) and in_window(0, window) and in_window(3, window)
+    assert not in_window(4, window) and not in_window(12, window)
+
+    assert in_window(2, (2, 6)) and not in_window(6, (2, 6))
+    # equal bounds mean always open
+    assert in_window(13, (0, 0))
+
+
+def test_seconds_until_next_opening():
+    now = datetime(2025, 2, 1, 1, 30, tzinfo=timezone.utc)
+    assert seconds_until_next_opening(now, (2, 6)) == 30 * 60
+    # a window that already opened today next opens tomorrow
+    now = datetime(2025, 2, 1, 3, 0, tzinfo=timezone.utc)
+    assert seconds_until_next_opening(now, (2, 6)) == 23 * 3600
+
+
+@pytest.mark.anyio
+async def test_refresh_fields_leaves_failed_fields_due(monkeypatch):
+    errors = [None, "No Sentinel-2 data available for the location", BATCH_FAILED_ERROR]
+
+    async def detect_bloom_many(regions):
+        for i, error in enumerate(errors):
+            yield {"index": i, "error": error, "imagery_date": date(2026, 3, 3)}
+
+    async def predict_bloom_many(points, store):
+        pass
+
+    updates = []
+
+    class Conn:
+        async def execute(self, query, field_ids, valid_until, now):
+            updates.append(dict(zip(field_ids, valid_until)))
+
+    @asynccontextmanager
+    async def async_conn(name):
+        yield Conn()
+
+    monkeypatch.setattr(field_scheduler, "detect_bloom_many", detect_bloom_many)
+    monkeypatch.setattr(field_scheduler, "predict_bloom_many", predict_bloom_many)
+    monkeypatch.setattr(field_scheduler, "async_conn", async_conn)
+    fields = [
+        {"id": f"F{i}", "latitude": 36.0 + i, "longitude": -120.0} for i in range(3)
+    ]
+    detected, failed = await field_scheduler.refresh_fields(fields)
+
+    assert detected == 1
+    assert failed == ["F2"]
+    # the field without imagery is marked refreshed, without a detection
+    assert list(updates[0]) == ["F0", "F1"]
+    assert updates[0]["F0"] is not None and updates[0]["F1"] is None
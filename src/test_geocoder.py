@@ -0,0 +1,99 @@
+# Copyright (C) 2025 Bunting Labs, Inc.
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import pytest
+
+from src.dependencies.geocoder import (
+    GazetteerGeocoderBackend,
+    Geocoder,
+    normalize_query,
+)
+
+
+def test_normalize_query():
+    assert normalize_query("  Fresno ,  CA ") == "fresno, ca"
+    assert normalize_query("Zaragoza, Aragón.") == "zaragoza, aragon"
+
+
+@pytest.mark.anyio
+async def test_gazetteer_geocoder_batches_and_caches(tmp_path):
+    gazetteer = tmp_path / "places.csv"
+    gazetteer.write_text(
+        "name,latitude,longitude\nFresno,36.7378,-119.7871\nModesto,37.6391,-120.9969\n"
+    )
+
+    class CountingBackend(GazetteerGeocoderBackend):
+        calls = 0
+
+        async def geocode(self, query):
+            CountingBackend.calls += 1
+            return await super().geocode(query)
+
+    geocoder = Geocoder(CountingBackend(str(gazetteer)))
+    results = await geocoder.geocode_many(
+        ["Fresno", "12 Orchard Rd, Fresno", "FRESNO ", "Atlantis", ""]
+    )
+    assert results == [
+        (36.7378, -119.7871),
+        (36.7378, -119.7871),
+        (36.7378, -119.7871),
+        None,
+        None,
+    ]
+    # "Fresno" and "FRESNO " normalize to the same query, "" is never looked up
+    assert CountingBackend.calls == 3
+
+    assert await geocoder.geocode("fresno") == (36.7378, -119.7871)
+    assert await geocoder.geocode("Atlantis") is None
+    assert CountingBackend.calls == 3
+
+
+@pytest.mark.anyio
+async def test_geocoder_survives_cache_errors(tmp_path):
+    gazetteer = tmp_path / "places.csv"
+    gazetteer.write_text("name,latitude,longitude\nFresno,36.7378,-119.7871\n")
+
+    class PersistingBackend(GazetteerGeocoderBackend):
+        persist_results = True
+
+    class BrokenCacheGeocoder(Geocoder):
+        async def _load_persisted(self, keys):
+            raise ConnectionError("database is down")
+
+        async def _persist(self, results, fetched_at):
+            raise ConnectionError("database is down")
+
+    geocoder = BrokenCacheGeocoder(PersistingBackend(str(gazetteer)))
+    assert await geocoder.geocode("Fresno") == (36.7378, -119.7871)
+
+
+@pytest.mark.anyio
+async def test_geocoder_sends_the_address_as_written(tmp_path):
+    gazetteer = tmp_path / "places.csv"
+    gazetteer.write_text("name,latitude,longitude\nFresno,36.7378,-119.7871\n")
+
+    class RecordingBackend(GazetteerGeocoderBackend):
+        queries = []
+
+        async def geocode(self, query):
+            RecordingBackend.queries.append(query)
+            return await super().geocode(query)
+
+    geocoder = Geocoder(RecordingBackend(str(gazetteer)))
+    results = await geocoder.geocode_many(
+        ["12-34 31st Ave, Fresno", "12 34 31ST AVE, fresno"]
+    )
+    assert results == [(36.7378, -119.7871)] * 2
+    assert RecordingBackend.queries == ["12-34 31st Ave, Fresno"]
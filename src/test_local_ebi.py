@@ -0,0 +1,222 @@
+# Copyright (C) 2025 Bunting Labs, Inc.
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from datetime import date
+
+import numpy as np
+import pytest
+import rasterio
+from rasterio.transform import from_origin
+from rasterio.warp import transform
+
+from src.services.bloom import detect_bloom, detect_bloom_many
+from src.services.earth_engine import Region
+from src.services import local_ebi
+from src.services.ebi_stack import EbiStackStore
+from src.services.local_ebi import LocalSentinel2Backend, LocalSentinel2ChipSource
+from src.services.pest import CHIP_SIZE
+
+CRS = "EPSG:32611"
+# 4 km square of UTM 11N around Fresno
+ORIGIN_X, ORIGIN_Y = 250000.0, 4072000.0
+
+
+def write_scene(root, day: date, dn: int, scl):
+    scene_dir = root / "11SKA" / day.isoformat()
+    scene_dir.mkdir(parents=True)
+    for band in ("B02", "B03", "B04"):
+        with rasterio.open(
+            scene_dir / f"{band}.tif",
+            "w",
+            driver="GTiff",
+            width=400,
+            height=400,
+            count=1,
+            dtype="uint16",
+            crs=CRS,
+            transform=from_origin(ORIGIN_X, ORIGIN_Y, 10, 10),
+        ) as dst:
+            dst.write(np.full((1, 400, 400), dn, dtype="uint16"))
+    with rasterio.open(
+        scene_dir / "SCL.tif",
+        "w",
+        driver="GTiff",
+        width=200,
+        height=200,
+        count=1,
+        dtype="uint8",
+        crs=CRS,
+        transform=from_origin(ORIGIN_X, ORIGIN_Y, 20, 20),
+    ) as dst:
+        dst.write(scl.reshape(1, 200, 200).astype("uint8"))
+
+
+def lat_lon(x, y):
+    lons, lats = transform(CRS, "EPSG:4326", [x], [y])
+    return lats[0], lons[0]
+
+
+@pytest.fixture
+def backend(tmp_path):
+    year = date.today().year
+    vegetation = np.full((200, 200), 4)
+    write_scene(tmp_path, date(year, 2, 1), 1000, vegetation)
+    # flowering canopy is bright in every visible band
+    write_scene(tmp_path, date(year, 3, 3), 3000, vegetation)
+    # overcast, skipped entirely
+    write_scene(tmp_path, date(year, 3, 8), 5000, np.full((200, 200), 9))
+    # clouds over the western half only
+    half_cloudy = vegetation.copy()
+    half_cloudy[:, :100] = 9
+    write_scene(tmp_path, date(year, 3, 13), 2000, half_cloudy)
+    backend = LocalSentinel2Backend(str(tmp_path))
+    yield backend
+    backend.close()
+
+
+@pytest.mark.anyio
+async def test_local_backend_detects_bloom(backend):
+    latitude, longitude = lat_lon(ORIGIN_X + 1000, ORIGIN_Y - 2000)
+    result = await detect_bloom(
+        latitude, longitude, earth_engine=backend, use_cache=False
+    )
+    assert result["date_of_max_ebi"] == date(date.today().year, 3, 3)
+    assert result["ebi_value"] == pytest.approx(0.9, abs=1e-3)
+
+
+@pytest.mark.anyio
+async def test_local_backend_masks_clouds_per_region(backend):
+    west = Region(*lat_lon(ORIGIN_X + 1000, ORIGIN_Y - 2000))
+    east = Region(*lat_lon(ORIGIN_X + 3000, ORIGIN_Y - 2000))
+    series = await backend.ebi_time_series_many([west, east], [date.today().year])
+    west_dates = [day for day, _ in series[0][1]]
+    east_dates = [day for day, _ in series[1][1]]
+    assert len(west_dates) == 2
+    assert len(east_dates) == 3
+    assert east_dates[-1] == date(date.today().year, 3, 13)
+
+    # a polygon block and a point far outside every scene
+    x0, y0 = ORIGIN_X + 500, ORIGIN_Y - 500
+    ring = [lat_lon(x, y)[::-1] for x, y in [(x0, y0), (x0 + 300, y0), (x0, y0 - 300)]]
+    block = {"type": "Polygon", "coordinates": [ring + [ring[0]]]}
+    results = [
+        r
+        async for r in detect_bloom_many(
+            [Region(0.0, 0.0), Region(*lat_lon(x0, y0), geometry=block)],
+            earth_engine=backend,
+            use_cache=False,
+        )
+    ]
+    by_index = {r["index"]: r for r in results}
+    assert by_index[0]["error"] is not None
+    assert by_index[1]["image_count"] == 2
+    assert by_index[1]["ebi_value"] == pytest.approx(0.9, abs=1e-3)
+
+
+@pytest.mark.anyio
+async def test_local_backend_applies_cloud_threshold_per_region(tmp_path, monkeypatch):
+    year = date.today().year
+    vegetation = np.full((200, 200), 4)
+    write_scene(tmp_path, date(year, 2, 1), 1000, vegetation)
+    # clouds over most of the western square, a small part of the scene
+    mostly_cloudy = vegetation.copy()
+    mostly_cloudy[50:150, 25:65] = 9
+    write_scene(tmp_path, date(year, 3, 3), 3000, mostly_cloudy)
+    backend = LocalSentinel2Backend(str(tmp_path))
+    west = Region(*lat_lon(ORIGIN_X + 1000, ORIGIN_Y - 2000))
+    east = Region(*lat_lon(ORIGIN_X + 3000, ORIGIN_Y - 2000))
+    try:
+        series = await backend.ebi_time_series_many([west, east], [year])
+        assert [day for day, _ in series[0][1]] == [date(year, 2, 1)]
+        assert [day for day, _ in series[1][1]] == [date(year, 2, 1), date(year, 3, 3)]
+
+        # one window per region reads the same means
+        monkeypatch.setattr(local_ebi, "MAX_WINDOW_PIXELS", 1)
+        assert await backend.ebi_time_series_many([west, east], [year]) == series
+    finally:
+        backend.close()
+
+
+def test_local_chip_source_skips_cloudy_scenes(backend):
+    source = LocalSentinel2ChipSource(backend.root)
+    source.start()
+    year = date.today().year
+
+    east = Region(*lat_lon(ORIGIN_X + 3000, ORIGIN_Y - 2000))
+    assert source.scene_id(east) == f"11SKA/{year}-03-13"
+    chips = source.read_chips(east, source.scene_id(east))
+    # 1 km square of 10 m pixels holds 3 x 3 chips
+    assert chips.shape == (9, 3, CHIP_SIZE, CHIP_SIZE)
+    assert np.nanmean(chips) == pytest.approx(0.2)
+
+    # clouded over on the 13th and 8th, read from the 3rd instead
+    west = Region(*lat_lon(ORIGIN_X + 1000, ORIGIN_Y - 2000))
+    chips = source.read_chips(west, source.scene_id(west))
+    assert len(chips) == 9
+    assert np.nanmean(chips) == pytest.approx(0.3)
+
+    assert source.scene_id(Region(0.0, 0.0)) is None
+
+
+@pytest.mark.anyio
+async def test_local_backend_stacked_series_match(backend, tmp_path):
+    stacked = LocalSentinel2Backend(
+        backend.root, stacks=EbiStackStore(str(tmp_path / "stacks"))
+    )
+    x0, y0 = ORIGIN_X + 500, ORIGIN_Y - 500
+    ring = [lat_lon(x, y)[::-1] for x, y in [(x0, y0), (x0 + 300, y0), (x0, y0 - 300)]]
+    regions = [
+        Region(*lat_lon(ORIGIN_X + 1000, ORIGIN_Y - 2000)),
+        Region(*lat_lon(ORIGIN_X + 3000, ORIGIN_Y - 2000)),
+        Region(
+            *lat_lon(x0, y0),
+            geometry={"type": "Polygon", "coordinates": [ring + [ring[0]]]},
+        ),
+        Region(0.0, 0.0),
+    ]
+    seasons = [date.today().year]
+    try:
+        expected = await backend.ebi_time_series_many(regions, seasons)
+        # the second call is served from the stacks, nothing new to append
+        for _ in range(2):
+            results = await stacked.ebi_time_series_many(regions, seasons)
+            assert [r is None for r in results] == [e is None for e in expected]
+            for result, (season, series) in zip(results, expected[:3]):
+                assert result[0] == season
+                assert [day for day, _ in result[1]] == [day for day, _ in series]
+                assert [v for _, v in result[1]] == pytest.approx(
+                    [v for _, v in series], abs=1e-6
+                )
+    finally:
+        stacked.close()
+
+
+@pytest.mark.anyio
+async def test_local_backend_picks_up_new_scenes(tmp_path):
+    year = date.today().year
+    vegetation = np.full((200, 200), 4)
+    write_scene(tmp_path, date(year, 2, 1), 1000, vegetation)
+    backend = LocalSentinel2Backend(str(tmp_path), rescan_seconds=0)
+    region = Region(*lat_lon(ORIGIN_X + 1000, ORIGIN_Y - 2000))
+    try:
+        series = await backend.ebi_time_series_many([region], [year])
+        assert len(series[0][1]) == 1
+
+        # synced while the process runs
+        write_scene(tmp_path, date(year, 3, 3), 3000, vegetation)
+        series = await backend.ebi_time_series_many([region], [year])
+        assert [day for day, _ in series[0][1]] == [date(year, 2, 1), date(year, 3, 3)]
+    finally:
+        backend.close()
@@ -44,3 +44,37 @@ async def test_style_json_nonexistent_map(auth_client):
     error_data = response.json()
     assert "detail" in error_data
     assert "not found" in error_data["detail"].lower()
+
+
+@pytest.mark.anyio
+async def test_style_json_etag_revalidation(auth_client):
+    response = await auth_client.post(
+        "/api/maps/create",
+        json={"title": "Style ETag Test"},
+    )
+    assert response.status_code == 200
+    map_id = response.json()["id"]
+
+    first = await auth_client.get(f"/api/maps/{map_id}/style.json")
+    assert first.status_code == 200
+    etag = first.headers["etag"]
+    assert etag.startswith('"') and etag.endswith('"')
+
+    revalidated = await auth_client.get(
+        f"/api/maps/{map_id}/style.json", headers={"If-None-Match": etag}
+    )
+    assert revalidated.status_code == 304
+    assert revalidated.headers["etag"] == etag
+
+    # changing the map must invalidate the cached style
+    update_response = await auth_client.patch(
+        f"/api/maps/{map_id}", json={"basemap": "openfreemap"}
+    )
+    assert update_response.status_code == 200
+
+    changed = await auth_client.get(
+        f"/api/maps/{map_id}/style.json", headers={"If-None-Match": etag}
+    )
+    assert changed.status_code == 200
+    assert changed.headers["etag"] != etag
+    assert changed.json()["metadata"]["current_basemap"] == "openfreemap"
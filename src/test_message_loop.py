@@ -16,11 +16,14 @@
 import pytest
 import uuid
 import os
+from types import SimpleNamespace
 from unittest.mock import patch, AsyncMock
 from openai.types.chat import (
     ChatCompletionMessage,
 )
 
+from src.routes import message_routes
+
 
 class MockChoice:
     def __init__(self, content: str, tool_calls=None):
@@ -406,3 +409,69 @@ async def test_map_locking_prevents_concurrent_requests(auth_client):
 
     conflict_response = next(r for r in responses if r.status_code == 409)
     assert "currently being processed" in conflict_response.json()["detail"]
+
+
+@pytest.mark.anyio
+async def test_stream_updates_arrive_in_order_and_complete_last():
+    def chunk(content=None, tool_call=None):
+        delta = SimpleNamespace(
+            content=content, tool_calls=[tool_call] if tool_call else None
+        )
+        return SimpleNamespace(choices=[SimpleNamespace(delta=delta)])
+
+    def tool_call_delta(name=None, arguments=None, id=None):
+        return SimpleNamespace(
+            index=0,
+            id=id,
+            function=SimpleNamespace(name=name, arguments=arguments),
+        )
+
+    chunks = [
+        chunk("Looking "),
+        chunk("at the orchard."),
+        chunk(tool_call=tool_call_delta("bloom_study", '{"addr', id="call_1")),
+        chunk(tool_call=tool_call_delta(arguments='ess": "Fresno"}')),
+    ]
+
+    class StreamingResponse:
+        def __aiter__(self):
+            return self._chunks()
+
+        async def _chunks(self):
+            for c in chunks:
+                yield c
+
+    client = SimpleNamespace(
+        chat=SimpleNamespace(
+            completions=SimpleNamespace(
+                create=AsyncMock(return_value=StreamingResponse())
+            )
+        )
+    )
+    updates = []
+
+    async def record(
+        conversation_id, action_id, description, content, status="streaming"
+    ):
+        updates.append((action_id, description, content, status))
+
+    with (
+        patch.object(message_routes, "STREAM_UPDATE_INTERVAL_SECONDS", 0),
+        patch.object(message_routes, "kue_stream_update", record),
+    ):
+        message = await message_routes.stream_chat_completion(client, 1)
+
+    # one update per chunk, then the completion, all for the same action
+    assert len(updates) == len(chunks) + 1
+    assert len({action_id for action_id, *_ in updates}) == 1
+    contents = [content for _, _, content, _ in updates]
+    assert all(b.startswith(a) for a, b in zip(contents, contents[1:]))
+    assert [status for *_, status in updates] == ["streaming"] * len(chunks) + [
+        "completed"
+    ]
+    assert updates[0][1] == "Kue is writing..."
+    assert updates[-1][1] == "Calling bloom_study..."
+
+    assert message.content == "Looking at the orchard."
+    assert message.tool_calls[0].id == "call_1"
+    assert message.tool_calls[0].function.arguments == '{"address": "Fresno"}'
@@ -0,0 +1,101 @@
+# Copyright (C) 2025 Bunting Labs, Inc.
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import asyncio
+
+import numpy as np
+import pytest
+
+from src.services.earth_engine import Region
+from src.services.pest import (
+    CHIP_SIZE,
+    NO_IMAGERY_ERROR,
+    PestDetector,
+    SpectralPestModel,
+    SyntheticChipSource,
+    get_chip_source,
+    tile_chips,
+)
+
+
+def test_tile_chips_drops_edges_and_masked_chips():
+    image = np.ones((3, 2 * CHIP_SIZE + 5, 3 * CHIP_SIZE), dtype="float32")
+    assert tile_chips(image).shape == (6, 3, CHIP_SIZE, CHIP_SIZE)
+
+    image[:, :CHIP_SIZE, :CHIP_SIZE] = np.nan
+    chips = tile_chips(image)
+    assert chips.shape == (5, 3, CHIP_SIZE, CHIP_SIZE)
+    assert np.isfinite(chips).all()
+
+
+def test_spectral_model_flags_stressed_canopy():
+    healthy = np.empty((1, 3, CHIP_SIZE, CHIP_SIZE), dtype="float32")
+    healthy[:, 0], healthy[:, 1], healthy[:, 2] = 0.04, 0.08, 0.03
+    stressed = healthy.copy()
+    stressed[:, 0] = 0.09
+    stressed[:, 1, ::2] = 0.06
+
+    probabilities = SpectralPestModel().predict(np.concatenate([healthy, stressed]))
+    assert probabilities[0] < 0.5 < probabilities[1]
+
+
+class CountingSource(SyntheticChipSource):
+    def __init__(self):
+        self.reads = 0
+
+    def read_chips(self, region, scene_id):
+        self.reads += 1
+        return super().read_chips(region, scene_id)
+
+
+@pytest.mark.anyio
+async def test_detector_batches_concurrent_requests_and_caches_chips():
+    source = CountingSource()
+    detector = PestDetector(source, SpectralPestModel(), max_wait=0.05)
+    try:
+        regions = [Region(36.7 + i * 0.01, -119.8) for i in range(20)]
+        first, second = await asyncio.gather(
+            detector.detect_many(regions[:10]), detector.detect_many(regions[10:])
+        )
+        # both requests' chips went through the model together
+        assert detector.batcher.batches == 1
+        assert [r["index"] for r in first + second] == list(range(10)) * 2
+        assert all(r["error"] is None and r["chip_count"] == 9 for r in first)
+
+        again = await detector.detect_many(regions[:10])
+        assert source.reads == 20
+        # same imagery, same model: same answer
+        assert again == first
+        assert any(r["detected_pest"] for r in first + second)
+        assert not all(r["detected_pest"] for r in first + second)
+    finally:
+        detector.close()
+
+
+@pytest.mark.anyio
+async def test_pest_detection_without_imagery_reports_no_imagery(monkeypatch):
+    monkeypatch.delenv("MUNDI_PEST_IMAGERY", raising=False)
+    monkeypatch.delenv("MUNDI_S2_CACHE_DIR", raising=False)
+    source = get_chip_source()
+    assert not isinstance(source, SyntheticChipSource)
+
+    detector = PestDetector(source, SpectralPestModel())
+    await detector.start()
+    try:
+        result = await detector.detect(36.7378, -119.7871)
+    finally:
+        detector.close()
+    assert result["error"] == NO_IMAGERY_ERROR
+    assert not result["detected_pest"] and result["confidence_score"] is None
@@ -0,0 +1,99 @@
+# Copyright (C) 2025 Bunting Labs, Inc.
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from datetime import date
+
+import numpy as np
+import pytest
+
+from src.services.phenology import (
+    DEFAULT_CONFIDENCE,
+    PhenologyModel,
+    accumulated_gdd,
+    first_day_reaching,
+    to_date,
+)
+
+
+def test_fit_recovers_the_gdd_threshold():
+    rng = np.random.default_rng(7)
+    latitudes = rng.uniform(35.0, 39.0, 400)
+    peak_days = first_day_reaching(accumulated_gdd(latitudes), np.full(400, 260.0))
+    noisy_days = np.round(peak_days + rng.normal(0, 3, 400))
+
+    model = PhenologyModel.fit(latitudes, noisy_days)
+    assert abs(model.gdd_threshold - 260.0) < 15
+    assert model.sigma_days < 5
+    assert model.confidence > DEFAULT_CONFIDENCE
+    assert PhenologyModel.fit(np.array([]), np.array([])) == PhenologyModel()
+
+
+def test_predict_is_vectorized_over_locations():
+    model = PhenologyModel(gdd_threshold=230.0)
+    starts, peaks = model.predict(np.array([34.0, 36.7, 40.0]), 2026)
+    assert peaks.shape == (3,)
+    # cooler, higher latitudes bloom later
+    assert peaks[0] < peaks[1] < peaks[2]
+    assert (starts < peaks).all()
+    assert date(2026, 2, 1) < to_date(peaks[1]) < date(2026, 4, 1)
+
+    # a requirement no location ever reaches
+    _, never = PhenologyModel(gdd_threshold=1e6).predict(np.array([36.7]), 2026)
+    assert to_date(never[0]) is None
+
+
+def test_predict_follows_the_southern_season():
+    model = PhenologyModel(gdd_threshold=230.0)
+    _, peaks = model.predict(np.array([36.7, -36.7, -10.0, 0.0]), 2026)
+    # mirrored climatology, the same bloom six months later
+    assert date(2026, 7, 1) < to_date(peaks[1]) < date(2026, 10, 1)
+    assert (peaks[1] - peaks[0]).astype(int) in range(175, 190)
+    # no winter chill near the equator
+    assert to_date(peaks[2]) is None and to_date(peaks[3]) is None
+
+    # peaks from both hemispheres fit one threshold
+    latitudes = np.array([35.0, 37.0, -35.0, -37.0, 5.0])
+    peak_days = np.array(
+        [
+            to_date(p).timetuple().tm_yday
+            for p in PhenologyModel(gdd_threshold=260.0).predict(latitudes[:4], 2025)[1]
+        ]
+        + [11]
+    )
+    assert PhenologyModel.fit(latitudes, peak_days).gdd_threshold == pytest.approx(
+        260.0, abs=10
+    )
+
+
+def test_predict_upcoming_rolls_past_blooms_to_next_season():
+    model = PhenologyModel(gdd_threshold=230.0)
+    latitudes = np.array([36.7, -36.7, 5.0])
+    _, this_year = model.predict(latitudes, 2026)
+    north_peak, south_peak = to_date(this_year[0]), to_date(this_year[1])
+
+    # before either peak, both are this year's
+    starts, peaks = model.predict_upcoming(latitudes, date(2026, 1, 2))
+    assert to_date(peaks[0]) == north_peak and to_date(peaks[1]) == south_peak
+    assert to_date(peaks[2]) is None
+
+    # the northern bloom has passed, the southern one has not
+    starts, peaks = model.predict_upcoming(latitudes, date(2026, 5, 1))
+    assert to_date(peaks[0]) == to_date(model.predict(latitudes, 2027)[1][0])
+    assert to_date(peaks[1]) == south_peak
+    assert (starts[:2] < peaks[:2]).all()
+
+    # the peak day itself is still upcoming
+    _, peaks = model.predict_upcoming(latitudes, south_peak)
+    assert to_date(peaks[1]) == south_peak
@@ -0,0 +1,57 @@
+# Copyright (C) 2025 Bunting Labs, Inc.
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import asyncio
+import os
+
+import pytest
+
+from src.dependencies import redis_pool
+from src.dependencies.redis_pool import close_redis, get_redis
+
+
+@pytest.fixture(autouse=True)
+def redis_host(monkeypatch):
+    monkeypatch.setenv("REDIS_HOST", os.environ.get("REDIS_HOST", "localhost"))
+
+
+@pytest.mark.anyio
+async def test_get_redis_is_shared_within_a_loop():
+    async def client():
+        await asyncio.sleep(0)
+        return get_redis()
+
+    clients = await asyncio.gather(*(client() for _ in range(3)))
+    assert all(c is get_redis() for c in clients)
+
+
+def test_get_redis_rebinds_to_a_new_loop_and_closes():
+    async def client_and_close(close: bool):
+        client = get_redis()
+        if close:
+            await close_redis()
+        return client
+
+    first = asyncio.run(client_and_close(close=False))
+    # a new loop cannot use connections opened on the previous one
+    second = asyncio.run(client_and_close(close=True))
+    assert second is not first
+    assert redis_pool._redis_client is None
+    assert redis_pool._redis_loop is None
+
+    # closing again without a client is a no-op
+    asyncio.run(close_redis())
+    third = asyncio.run(client_and_close(close=True))
+    assert third is not second
@@ -18,6 +18,8 @@ import asyncio
 import pytest
 from unittest.mock import patch
 
+from fastapi import HTTPException
+
 
 @pytest.fixture
 def mock_esri_requests(monkeypatch):
@@ -700,3 +702,110 @@ async def test_cloud_native_tiff_redirect(auth_client):
     assert raster_min is not None and raster_max is not None
     assert abs(round(raster_min, 1) - 368.7) < 0.2
     assert abs(round(raster_max, 1) - 371.4) < 0.2
+
+
+@pytest.mark.anyio
+async def test_remote_raster_is_converted_to_cog_on_ingest(auth_client):
+    fixture_path = os.path.abspath(
+        os.path.join(os.path.dirname(__file__), "..", "test_fixtures", "waterboard.tif")
+    )
+
+    async def fake_download(url, path):
+        # Earth Engine download URLs have no extension and a generic type
+        with open(fixture_path, "rb") as src, open(path, "wb") as dst:
+            dst.write(src.read())
+        return "application/octet-stream"
+
+    map_response = await auth_client.post(
+        "/api/maps/create", json={"name": "Test Map for Remote GeoTIFF"}
+    )
+    assert map_response.status_code == 200
+    map_id = map_response.json()["id"]
+
+    with patch("src.routes.postgres_routes.stream_download", fake_download):
+        response = await auth_client.post(
+            f"/api/maps/{map_id}/layers/remote",
+            json={
+                "url": "https://earthengine.googleapis.com/v1/projects/p/thumbnails/ebi:getPixels",
+                "name": "Bloom EBI",
+                "source_type": "raster",
+            },
+        )
+    assert response.status_code == 200
+    layer_data = response.json()
+    assert layer_data["type"] == "raster"
+
+    layers_response = await auth_client.get(
+        f"/api/maps/{layer_data['dag_child_map_id']}/layers"
+    )
+    layer = next(
+        layer
+        for layer in layers_response.json()["layers"]
+        if layer["id"] == layer_data["id"]
+    )
+    metadata = layer.get("metadata", {})
+    if isinstance(metadata, str):
+        import json
+
+        metadata = json.loads(metadata)
+    assert metadata["original_filename"] == "ebi:getPixels.tif"
+    # the COG was built during ingest, not on first view
+    assert metadata["cog_key"] == f"cog/layer/{layer_data['id']}.cog.tif"
+
+    cog_response = await auth_client.get(f"/api/layer/{layer_data['id']}.cog.tif")
+    assert cog_response.status_code == 200
+
+
+@pytest.mark.anyio
+async def test_remote_raster_without_cog_on_ingest_converts_on_view(auth_client):
+    fixture_path = os.path.abspath(
+        os.path.join(os.path.dirname(__file__), "..", "test_fixtures", "waterboard.tif")
+    )
+
+    async def fake_download(url, path):
+        with open(fixture_path, "rb") as src, open(path, "wb") as dst:
+            dst.write(src.read())
+        return "application/octet-stream"
+
+    async def failing_create_cog(*args):
+        raise HTTPException(status_code=504, detail="Command timed out")
+
+    map_response = await auth_client.post(
+        "/api/maps/create", json={"name": "Test Map for COG fallback"}
+    )
+    assert map_response.status_code == 200
+    map_id = map_response.json()["id"]
+
+    with (
+        patch("src.routes.postgres_routes.stream_download", fake_download),
+        patch("src.routes.postgres_routes.create_cog", failing_create_cog),
+    ):
+        response = await auth_client.post(
+            f"/api/maps/{map_id}/layers/remote",
+            json={
+                "url": "https://earthengine.googleapis.com/v1/projects/p/thumbnails/ebi:getPixels",
+                "name": "Bloom EBI",
+                "source_type": "raster",
+            },
+        )
+    assert response.status_code == 200
+    layer_data = response.json()
+
+    layers_response = await auth_client.get(
+        f"/api/maps/{layer_data['dag_child_map_id']}/layers"
+    )
+    layer = next(
+        layer
+        for layer in layers_response.json()["layers"]
+        if layer["id"] == layer_data["id"]
+    )
+    metadata = layer.get("metadata", {})
+    if isinstance(metadata, str):
+        import json
+
+        metadata = json.loads(metadata)
+    assert "cog_key" not in metadata
+
+    # the lazy path builds it on first view instead
+    cog_response = await auth_client.get(f"/api/layer/{layer_data['id']}.cog.tif")
+    assert cog_response.status_code == 200
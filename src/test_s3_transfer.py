@@ -0,0 +1,94 @@
+# Copyright (C) 2025 Bunting Labs, Inc.
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import hashlib
+import pytest
+
+from src import s3_transfer, utils
+from src.utils import get_bucket_name, get_async_s3_client
+
+
+@pytest.mark.s3
+@pytest.mark.anyio
+async def test_multipart_roundtrip_verifies_checksum(tmp_path, monkeypatch):
+    monkeypatch.setenv("MUNDI_S3_PART_SIZE_MB", "5")
+    monkeypatch.setenv("MUNDI_S3_MAX_CONCURRENCY", "4")
+
+    data = os.urandom(12 * 1024**2 + 123)
+    source = tmp_path / "source.bin"
+    source.write_bytes(data)
+    bucket = get_bucket_name()
+    key = "test/s3_transfer/roundtrip.bin"
+
+    upload = await s3_transfer.upload_file(str(source), bucket, key)
+    assert upload.parts == 3
+    assert upload.sha256 == hashlib.sha256(data).hexdigest()
+
+    target = tmp_path / "target.bin"
+    download = await s3_transfer.download_file(bucket, key, str(target))
+    assert download.parts == 3
+    assert download.size_bytes == len(data)
+    assert target.read_bytes() == data
+
+    # tamper with the stored checksum, the download must refuse the bytes
+    s3 = await get_async_s3_client()
+    await s3.copy_object(
+        Bucket=bucket,
+        Key=key,
+        CopySource={"Bucket": bucket, "Key": key},
+        Metadata={"sha256": "0" * 64},
+        MetadataDirective="REPLACE",
+    )
+    with pytest.raises(s3_transfer.TransferChecksumError):
+        await s3_transfer.download_file(bucket, key, str(tmp_path / "bad.bin"))
+
+
+@pytest.mark.anyio
+async def test_presigned_urls_are_reused_until_near_expiry(monkeypatch):
+    signed = []
+
+    class FakeS3:
+        async def generate_presigned_url(self, method, Params, ExpiresIn):
+            signed.append(ExpiresIn)
+            return f"https://s3.example/{Params['Key']}?v={len(signed)}"
+
+    async def fake_client(signature_version="s3"):
+        return FakeS3()
+
+    now = [1_000_000.0]
+    monkeypatch.setattr(utils, "get_async_s3_client", fake_client)
+    monkeypatch.setattr(utils.time, "time", lambda: now[0])
+    monkeypatch.setattr(utils, "_presigned_urls", type(utils._presigned_urls)())
+
+    first = await utils.get_presigned_get_url("bucket", "a.pmtiles")
+    # 900 s lifetime, reused while more than 300 s remain
+    now[0] += 599
+    assert await utils.get_presigned_get_url("bucket", "a.pmtiles") == first
+    now[0] += 1
+    second = await utils.get_presigned_get_url("bucket", "a.pmtiles")
+    assert second != first
+    assert await utils.get_presigned_get_url("bucket", "a.pmtiles") == second
+    assert signed == [900, 900]
+
+    # a caller needing a longer remaining lifetime gets a fresh URL
+    now[0] += 300
+    assert (
+        await utils.get_presigned_get_url("bucket", "a.pmtiles", min_remaining=700)
+        != second
+    )
+    # other keys are signed and cached separately
+    assert await utils.get_presigned_get_url("bucket", "b.pmtiles") != second
+    assert len(signed) == 4
@@ -0,0 +1,104 @@
+# Copyright (C) 2025 Bunting Labs, Inc.
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import asyncio
+import json
+
+import pytest
+
+from src.dependencies.pydantic_tools import get_pydantic_tool_calls
+from src.geoprocessing.dispatch import get_tools
+from src.routes.message_routes import (
+    ToolCallContext,
+    get_tool_registry,
+    run_tool_call,
+    unattached_layers_message,
+)
+from src.tools.registry import RegisteredTool
+
+
+def test_tool_registry_covers_all_tool_kinds():
+    pydantic_tool_calls = get_pydantic_tool_calls()
+    registry = get_tool_registry(pydantic_tool_calls)
+
+    # same pydantic tools, same registry instance
+    assert get_tool_registry(get_pydantic_tool_calls()) is registry
+
+    assert registry.get("set_layer_style").kind == "builtin"
+    assert registry.get("zoom_to_bounds").kind == "pydantic"
+    for tool in get_tools():
+        registered = registry.get(tool["function"]["name"])
+        assert registered.kind == "geoprocessing"
+        assert registered.changes_map
+    assert not registry.get("query_duckdb_sql").changes_map
+    assert len(registry) == len(registry.definitions())
+
+
+def test_tools_payload_is_byte_stable():
+    registry = get_tool_registry(get_pydantic_tool_calls())
+
+    # nothing per-user is embedded in the tool schemas, so the serialized
+    # payload is identical between requests and cacheable by providers
+    first = json.dumps(registry.definitions())
+    assert (
+        json.dumps(get_tool_registry(get_pydantic_tool_calls()).definitions()) == first
+    )
+    # serialized once per registry
+    assert registry.definitions_json() == first
+    assert registry.definitions_json() is registry.definitions_json()
+    add_layer = registry.get("add_layer_to_map").definition
+    assert "enum" not in add_layer["function"]["parameters"]["properties"]["layer_id"]
+
+
+def test_unattached_layers_message():
+    message = unattached_layers_message({"LAbCdEfGhIjK": "Parcels (type: vector)"})
+    assert message["role"] == "system"
+    assert "LAbCdEfGhIjK: Parcels (type: vector)" in message["content"]
+    assert unattached_layers_message({})["content"] == "<UnattachedLayers />"
+
+
+@pytest.mark.anyio
+async def test_failing_tool_returns_an_error_result():
+    async def handler(ctx, tool_call, tool_args):
+        raise RuntimeError("imagery service unavailable")
+
+    tool = RegisteredTool("flaky", "pydantic", {}, handler)
+    ctx = ToolCallContext(None, None, "M1", "P1", "U1", 1, None, None)
+    result = await run_tool_call(tool, ctx, None, {}, asyncio.Lock())
+    assert result["status"] == "error"
+    assert "imagery service unavailable" in result["error"]
+
+
+@pytest.mark.anyio
+async def test_turn_fanout_bounds_concurrent_tool_calls():
+    running = 0
+    peak = 0
+
+    async def handler(ctx, tool_call, tool_args):
+        nonlocal running, peak
+        running += 1
+        peak = max(peak, running)
+        await asyncio.sleep(0.01)
+        running -= 1
+        return {"status": "success"}
+
+    tool = RegisteredTool("slow", "pydantic", {}, handler)
+    ctx = ToolCallContext(None, None, "M1", "P1", "U1", 1, None, None)
+    map_lock, fanout = asyncio.Lock(), asyncio.Semaphore(2)
+    results = await asyncio.gather(
+        *(run_tool_call(tool, ctx, None, {}, map_lock, fanout) for _ in range(6))
+    )
+    assert [r["status"] for r in results] == ["success"] * 6
+    assert peak == 2
@@ -0,0 +1,95 @@
+# Copyright (C) 2025 Bunting Labs, Inc.
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import asyncio
+import json
+from typing import Any, Awaitable, Callable, Iterator, Literal, Optional
+
+from openai.types.chat import ChatCompletionMessageToolCall
+
+ToolKind = Literal["builtin", "pydantic", "geoprocessing"]
+# (context, tool_call, parsed arguments) -> tool result
+ToolHandler = Callable[[Any, ChatCompletionMessageToolCall, dict], Awaitable[dict]]
+
+DEFAULT_TOOL_CONCURRENCY = 8
+
+
+class RegisteredTool:
+    def __init__(
+        self,
+        name: str,
+        kind: ToolKind,
+        definition: dict,
+        handler: ToolHandler,
+        changes_map: bool = False,
+        mutates_map: bool = False,
+        max_concurrency: int = DEFAULT_TOOL_CONCURRENCY,
+    ):
+        self.name = name
+        self.kind = kind
+        self.definition = definition
+        self.handler = handler
+        # whether running the tool can add layers to the map or create new
+        # unattached layers, which invalidates the chat's map context
+        self.changes_map = changes_map
+        # whether the tool writes to the map itself, such tools are never run
+        # concurrently with each other
+        self.mutates_map = mutates_map
+        # shared by every chat in the process
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+
+
+class ToolRegistry:
+    """Every tool Kue can call, indexed by function name.
+
+    Built once per set of pydantic tools; definitions are shared between chat
+    tasks and must be treated as read-only. The tools payload and its JSON
+    are built once, on first use after the last registration.
+    """
+
+    def __init__(self):
+        self.tools: dict[str, RegisteredTool] = {}
+        self._definitions: Optional[list[dict]] = None
+        self._definitions_json: Optional[str] = None
+
+    def register(self, tool: RegisteredTool):
+        if tool.name in self.tools:
+            raise ValueError(f"Tool {tool.name} is already registered")
+        self.tools[tool.name] = tool
+        self._definitions = None
+        self._definitions_json = None
+
+    def get(self, name: str) -> Optional[RegisteredTool]:
+        return self.tools.get(name)
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.tools
+
+    def __iter__(self) -> Iterator[RegisteredTool]:
+        return iter(self.tools.values())
+
+    def __len__(self) -> int:
+        return len(self.tools)
+
+    def definitions(self) -> list[dict]:
+        if self._definitions is None:
+            self._definitions = [tool.definition for tool in self.tools.values()]
+        return self._definitions
+
+    def definitions_json(self) -> str:
+        """The tools payload as sent to the LLM, serialized once."""
+        if self._definitions_json is None:
+            self._definitions_json = json.dumps(self.definitions())
+        return self._definitions_json
@@ -21,6 +21,8 @@ import shutil
 import aioboto3
 import asyncio
 import secrets
+import time
+from collections import OrderedDict
 from functools import lru_cache
 from openai import AsyncOpenAI
 from fastapi import Request
@@ -80,6 +82,46 @@ def get_bucket_name():
     return os.environ["S3_BUCKET"]
 
 
+# (signature_version, bucket, key, expires_in) -> (url, expires_at)
+_presigned_urls: OrderedDict[tuple[str, str, str, int], tuple[str, float]] = (
+    OrderedDict()
+)
+MAX_PRESIGNED_URLS = 10000
+
+
+async def get_presigned_get_url(
+    bucket: str,
+    key: str,
+    signature_version: str = "s3",
+    expires_in: int = 900,
+    min_remaining: int = 300,
+) -> str:
+    """Return a presigned GET URL for bucket/key, reusing a previously signed
+    URL until it has less than min_remaining seconds left.
+
+    Handing out the same URL lets HTTP caches and GDAL's VSI cache reuse
+    each other's work instead of seeing a new URL on every request.
+    """
+    cache_key = (signature_version, bucket, key, expires_in)
+    cached = _presigned_urls.get(cache_key)
+    now = time.time()
+    if cached is not None and cached[1] - now > min_remaining:
+        _presigned_urls.move_to_end(cache_key)
+        return cached[0]
+
+    s3 = await get_async_s3_client(signature_version=signature_version)
+    url = await s3.generate_presigned_url(
+        "get_object",
+        Params={"Bucket": bucket, "Key": key},
+        ExpiresIn=expires_in,
+    )
+    _presigned_urls[cache_key] = (url, now + expires_in)
+    _presigned_urls.move_to_end(cache_key)
+    while len(_presigned_urls) > MAX_PRESIGNED_URLS:
+        _presigned_urls.popitem(last=False)
+    return url
+
+
 async def process_zip_with_shapefile(zip_file_path):
     temp_dir = tempfile.mkdtemp()
 
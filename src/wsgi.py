@@ -31,6 +31,10 @@ from src.routes import pest_routes
 from src.routes.postgres_routes import basemap_router
 from src.routes.layer_router import layer_router
 from src.routes.attribute_table import attribute_table_router
+from src.dependencies.pydantic_tools import get_pydantic_tool_calls
+from src.dependencies.redis_pool import close_redis
+from src.services.earth_engine import get_earth_engine
+from src.services.pest import get_pest_detector
 # from fastapi_mcp import FastApiMCP
 
 
@@ -40,8 +44,17 @@ async def lifespan(app: FastAPI):
     from src.database.migrate import run_migrations
 
     await run_migrations()
+    # build the chat tool registry up front so tool schema errors fail startup
+    message_routes.get_tool_registry(get_pydantic_tool_calls())
+    # authenticate Earth Engine once per process, not on every bloom request
+    await get_earth_engine().start()
+    # load the pest model and imagery index before the first request
+    await get_pest_detector().start()
     yield
-    # Cleanup code here if needed
+    get_earth_engine().close()
+    get_pest_detector().close()
+    await message_routes.chat_cancellations.close()
+    await close_redis()
 
 
 app = FastAPI(